@@ -2,22 +2,83 @@
 import requests
 import re
 import html
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import streamlit as st 
 
+import ocr_correction
+import mfds_local
+import tracing
+
 # =========================================================
 # 1. 설정 및 유틸리티
 # =========================================================
+# 검색 백엔드: "api"(식약처 OpenAPI, 기본) / "local"(mfds_local.py로 적재한 오프라인 인덱스, 네트워크 미사용)
+try:
+    BACKEND = st.secrets["public_data_portal"].get("backend", "api")
+    LOCAL_DB_PATH = st.secrets["public_data_portal"].get("local_db_path", mfds_local.DEFAULT_DB_PATH)
+except Exception:
+    BACKEND = "api"
+    LOCAL_DB_PATH = mfds_local.DEFAULT_DB_PATH
+LOCAL_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), LOCAL_DB_PATH)
+
 # API 키는 secrets.toml에서 가져옴
 try:
     # secrets.toml에 [public_data_portal] 섹션의 api_key를 사용
     SERVICE_KEY = st.secrets["public_data_portal"]["api_key"]
 except Exception as e:
-    st.error("❌ secrets.toml에 [public_data_portal] api_key 설정이 필요합니다.")
-    print(f"[ERROR] API Key Missing: {e}")
+    if BACKEND != "local":
+        st.error("❌ secrets.toml에 [public_data_portal] api_key 설정이 필요합니다.")
+        print(f"[ERROR] API Key Missing: {e}")
     SERVICE_KEY = "" 
 
 API_URL = "http://apis.data.go.kr/1471000/DrugPrdtPrmsnInfoService07/getDrugPrdtPrmsnDtlInq06"
 
+# 처방전 내 약물 동시 조회 상한 (secrets.toml [public_data_portal] max_concurrency로 조정)
+# 투기적 재시도(speculative_retry): 재시도 사다리의 모든 쿼리를 한 번에 보내고 가장 우선순위 높은 성공을 채택
+#   -> 지연은 줄지만 API 호출량(쿼터)이 늘어나므로 기본값은 꺼짐
+try:
+    MAX_CONCURRENCY = int(st.secrets["public_data_portal"].get("max_concurrency", 6))
+    SPECULATIVE_RETRY = bool(st.secrets["public_data_portal"].get("speculative_retry", False))
+except Exception:
+    MAX_CONCURRENCY = 6
+    SPECULATIVE_RETRY = False
+
+# 응답 캐시 (SQLite): 성공 응답은 길게, 검색 실패(미매칭)는 짧게 보관
+try:
+    _cache_conf = st.secrets["public_data_portal"]
+    CACHE_PATH = _cache_conf.get("cache_path", os.path.join("data", "mfds_cache.sqlite3"))
+    CACHE_TTL_SEC = float(_cache_conf.get("cache_ttl_hours", 24 * 7)) * 3600
+    NEGATIVE_TTL_SEC = float(_cache_conf.get("negative_ttl_minutes", 60)) * 60
+except Exception:
+    CACHE_PATH = os.path.join("data", "mfds_cache.sqlite3")
+    CACHE_TTL_SEC = 24 * 7 * 3600
+    NEGATIVE_TTL_SEC = 60 * 60
+
+# HTTP 연결 풀 (keep-alive) / 상태 코드 기반 재시도 / 연결·응답 타임아웃 분리
+try:
+    _http_conf = st.secrets["public_data_portal"]
+    HTTP_POOL_SIZE = int(_http_conf.get("pool_size", MAX_CONCURRENCY * 4))
+    HTTP_MAX_RETRIES = int(_http_conf.get("max_retries", 3))
+    HTTP_BACKOFF = float(_http_conf.get("retry_backoff", 0.3))
+    HTTP_TIMEOUT = (float(_http_conf.get("connect_timeout", 3.05)), float(_http_conf.get("read_timeout", 10)))
+except Exception:
+    HTTP_POOL_SIZE = MAX_CONCURRENCY * 4
+    HTTP_MAX_RETRIES = 3
+    HTTP_BACKOFF = 0.3
+    HTTP_TIMEOUT = (3.05, 10)
+
+# 투기적 재시도용 쿼리 풀 (약물 단위 풀과 분리해 중첩 대기로 인한 교착 방지)
+_query_pool = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE, thread_name_prefix="mfds-query")
+
 def remove_xml_tags(text):
     if not text: return ""
     text = html.unescape(text)
@@ -30,10 +91,186 @@ def remove_parentheses(text):
     if not text: return ""
     return re.sub(r'\(.*?\)', '', text).strip()
 
-def search_drug_api(drug_name):
-    """단일 약품 검색 함수"""
+# =========================================================
+# 2. HTTP 세션 (연결 풀 + 재시도)
+# =========================================================
+# 연결 풀 꺼냄(checkouts) / 새 연결(opened) 횟수. 재사용 = checkouts - opened
+# (풀은 여러 스레드가 공유하므로 꺼낼 때마다 카운터만 올리고, 풀 인스턴스에 상태를 두지 않음)
+_conn_stats = {"checkouts": 0, "opened": 0}
+_conn_lock = threading.Lock()
+# 현재 스레드의 요청을 함께 집계할 일괄 검색별 카운터 (search_drugs_batch가 지정)
+_conn_scope = threading.local()
+
+def _count_conn(key):
+    scoped = getattr(_conn_scope, "counter", None)
+    with _conn_lock:
+        _conn_stats[key] += 1
+        if scoped is not None: scoped[key] += 1
+
+class _CountingPoolMixin:
+    """연결 풀에서 연결을 꺼낸 횟수와 새로 연 횟수를 집계 (urllib3는 같은 스레드에서 _get_conn -> _new_conn 호출)"""
+    def _get_conn(self, timeout=None):
+        _count_conn("checkouts")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self):
+        _count_conn("opened")
+        return super()._new_conn()
+
+def _conn_summary(counter):
+    return {"opened": counter["opened"], "reused": counter["checkouts"] - counter["opened"]}
+
+def _in_conn_scope(counter, fn, *args):
+    """다른 스레드(작업자 풀)에서 fn을 실행하되 연결 집계는 counter에도 반영"""
+    previous = getattr(_conn_scope, "counter", None)
+    _conn_scope.counter = counter
+    try:
+        return fn(*args)
+    finally:
+        _conn_scope.counter = previous
+
+class _CountingHTTPPool(_CountingPoolMixin, HTTPConnectionPool): pass
+class _CountingHTTPSPool(_CountingPoolMixin, HTTPSConnectionPool): pass
+
+class _PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPPool, "https": _CountingHTTPSPool}
+
+def _build_session():
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),  # 일시 장애만 재시도
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # 재시도 소진 시 마지막 응답 반환 -> 아래에서 미확정 실패로 처리
+    )
+    adapter = _PooledAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# 모듈 공용 세션 (동시 일괄 검색/투기적 재시도 스레드가 같은 연결 풀 공유)
+_session = _build_session()
+
+def connection_stats():
+    """프로세스 누적 연결 통계 {"opened": n, "reused": m}"""
+    with _conn_lock:
+        return _conn_summary(_conn_stats)
+
+# =========================================================
+# 3. 응답 캐시 (SQLite, TTL + Negative Caching)
+# =========================================================
+_cache_local = threading.local()
+_stats_lock = threading.Lock()
+# 스키마 생성 / 만료 행 정리는 프로세스당 1회 (일괄 검색마다 새로 생기는 작업자 스레드가 쓰기 락을 다투지 않도록)
+_cache_init_lock = threading.Lock()
+_cache_ready = {}  # 캐시 파일 경로 -> 사용 가능 여부
+
+def normalize_query(text):
+    """캐시 키: 유니코드 NFC + 공백 정리"""
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r'\s+', ' ', text).strip()
+
+def _cache_path():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, CACHE_PATH)
+
+def _init_cache(path):
+    """캐시 파일 준비 (WAL 전환 / 테이블 생성 / 만료 행 정리) -> 사용 가능 여부. 경로별로 프로세스당 1회만 실행"""
+    with _cache_init_lock:
+        if path not in _cache_ready:
+            try:
+                conn = sqlite3.connect(path, timeout=5)
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")  # 파일에 유지되는 설정
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS mfds_cache ("
+                        " query TEXT PRIMARY KEY, payload TEXT, expires_at REAL NOT NULL)"
+                    )
+                    conn.execute("DELETE FROM mfds_cache WHERE expires_at < ?", (time.time(),))
+                    conn.commit()
+                finally:
+                    conn.close()
+                _cache_ready[path] = True
+            except Exception as e:
+                print(f"[WARN] MFDS 캐시 사용 불가: {e}")
+                _cache_ready[path] = False
+        return _cache_ready[path]
+
+def _cache_conn():
+    """스레드별 SQLite 연결 (조회/저장만, 준비 실패 시 None -> 캐시 없이 동작)"""
+    path = _cache_path()
+    if getattr(_cache_local, "path", None) == path:
+        return _cache_local.conn
+    conn = None
+    if _init_cache(path):
+        try:
+            conn = sqlite3.connect(path, timeout=5)
+        except Exception as e:
+            print(f"[WARN] MFDS 캐시 연결 실패: {e}")
+    _cache_local.path, _cache_local.conn = path, conn
+    return conn
+
+def _cache_get(key):
+    """(적중 여부, 결과) 반환. 결과 None + 적중 = Negative 캐시"""
+    conn = _cache_conn()
+    if conn is None: return False, None
+    try:
+        row = conn.execute(
+            "SELECT payload FROM mfds_cache WHERE query = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+    except sqlite3.Error:
+        return False, None
+    if row is None: return False, None
+    return True, (json.loads(row[0]) if row[0] is not None else None)
+
+def _cache_put(key, item):
+    conn = _cache_conn()
+    if conn is None: return
+    ttl = CACHE_TTL_SEC if item is not None else NEGATIVE_TTL_SEC
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO mfds_cache (query, payload, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(item, ensure_ascii=False) if item is not None else None, time.time() + ttl)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"[WARN] MFDS 캐시 저장 실패: {e}")
+
+def _count(stats, key):
+    """pipeline_metrics["api"] 카운터 증가 (동시 검색 스레드 안전)"""
+    if stats is None: return
+    with _stats_lock:
+        stats[key] = stats.get(key, 0) + 1
+
+def search_drug_api(drug_name, stats=None):
+    """단일 약품 검색 함수 (캐시 우선, stats에 cache_hit / cache_miss / negative_hit 집계)"""
     if not drug_name: return None
-    
+
+    # 오프라인 백엔드: 로컬 인덱스가 곧 원본이므로 네트워크/응답 캐시 없이 바로 응답
+    if BACKEND == "local":
+        _count(stats, "local_lookup")
+        return mfds_local.search(drug_name, LOCAL_DB_PATH)
+
+    key = normalize_query(drug_name)
+    hit, cached = _cache_get(key)
+    if hit:
+        _count(stats, "cache_hit")
+        if cached is None: _count(stats, "negative_hit")
+        return cached
+    _count(stats, "cache_miss")
+
+    item, definitive = _fetch_drug(drug_name)
+    # 일시 장애(네트워크/5xx/파싱 오류)는 캐시하지 않음 -> 다음 요청에서 재시도
+    if definitive:
+        _cache_put(key, item)
+    return item
+
+def _fetch_drug(drug_name):
+    """식약처 API 호출 -> (결과, 확정 응답 여부)"""
     params = {
         "serviceKey": SERVICE_KEY,
         "type": "json", 
@@ -43,22 +280,131 @@ def search_drug_api(drug_name):
     }
     
     try:
-        response = requests.get(API_URL, params=params, timeout=10)
+        response = _session.get(API_URL, params=params, timeout=HTTP_TIMEOUT)
         
         if response.status_code != 200:
-            return None
+            return None, False
 
         try:
             data = response.json()
         except:
-            return None
+            return None, False
             
         if 'body' in data and 'items' in data['body']:
             items = data['body']['items']
-            if items: return items[0]
+            if items: return items[0], True
+            return None, True
             
-        return None
+        return None, False
             
     except Exception as e:
         print(f"API Error: {e}")
-        return None
+        return None, False
+
+# =========================================================
+# 4. 재시도 검색 (4단계 쿼리 사다리)
+# =========================================================
+def build_query_ladder(base_name):
+    """
+    4단계 재시도 쿼리 목록 [(단계 번호, 쿼리)] 생성
+    (Full -> No Dosage -> No Paren -> Prefix, 원본과 같은 쿼리가 되는 단계는 제외)
+    """
+    base_name = base_name or ""
+    ladder = [(0, base_name)]  # 1단계: 원본 그대로
+
+    # 2단계: 용량/단위 제거
+    name_only, _ = ocr_correction.split_name_and_dosage(base_name)
+    # 3단계: 괄호 제거
+    no_paren = remove_parentheses(base_name)
+
+    for i, query in ((1, name_only), (2, no_paren)):
+        # 중복 쿼리 방지 (예: 괄호 없는데 괄호제거 단계 수행 시)
+        if query != base_name:
+            ladder.append((i, query))
+
+    # 4단계: 앞 4글자 (최후의 수단)
+    if len(base_name) > 4:
+        ladder.append((3, base_name[:4]))
+    return ladder
+
+def search_drug_with_retry(base_name, speculative=None, stats=None):
+    """
+    재시도 사다리를 검색하여 (검색 결과, 재시도 횟수) 반환
+    - 재시도 횟수: 1~3단계에서 실패한 횟수 (대시보드 'Search Difficulty' 지표)
+    - speculative=True면 모든 단계를 동시에 보내고, 우선순위가 가장 높은 성공을 채택 (재시도 횟수 의미 동일)
+    - stats: 캐시 적중/미스 카운터를 누적할 dict (pipeline_metrics["api"])
+    """
+    if speculative is None: speculative = SPECULATIVE_RETRY
+    ladder = build_query_ladder(base_name)
+    if speculative and len(ladder) > 1:
+        return _search_ladder_speculative(ladder, stats)
+
+    retry_count = 0
+    for i, query in ladder:
+        print(f"[DEBUG] API 검색 {i+1}차: {query}")
+        search_res = search_drug_api(query, stats)
+
+        if search_res:
+            print(f"  -> 성공!")
+            return search_res, retry_count
+        if i < 3: retry_count += 1
+    return None, retry_count
+
+def _search_ladder_speculative(ladder, stats=None):
+    """사다리의 서로 다른 쿼리를 동시에 보내고 단계 순서대로 결과를 확인"""
+    futures = {}
+    for i, query in ladder:
+        if query not in futures:  # 단계 간 같은 쿼리는 한 번만 호출
+            print(f"[DEBUG] API 검색 {i+1}차 (동시): {query}")
+            # 쿼리 풀 스레드의 연결도 호출한 일괄 검색의 카운터로 집계
+            futures[query] = _query_pool.submit(_in_conn_scope, getattr(_conn_scope, "counter", None),
+                                                search_drug_api, query, stats)
+
+    retry_count = 0
+    try:
+        for i, query in ladder:
+            # 앞 단계가 모두 실패한 경우에만 다음 단계 결과를 채택 (순차 실행과 같은 결과)
+            search_res = futures[query].result()
+            if search_res:
+                print(f"  -> 성공! ({i+1}차)")
+                return search_res, retry_count
+            if i < 3: retry_count += 1
+        return None, retry_count
+    finally:
+        # 아직 시작 안 된 하위 단계 요청은 취소 (진행 중인 요청은 결과만 버림)
+        for f in futures.values(): f.cancel()
+
+def search_drugs_batch(names, max_workers=None, speculative=None, stats=None, metrics=None):
+    """
+    처방전의 모든 약물을 동시에 검색 (스레드 풀, 동시 실행 상한 max_workers)
+    - 반환: 입력 순서대로 [(검색 결과, 재시도 횟수), ...]
+    - 전체 소요 시간 ≈ 가장 느린 약물 하나의 검색 시간
+    - stats에 connections_opened / connections_reused 누적 (이 일괄 검색의 요청만, 공용 HTTP 세션 기준)
+    - metrics: pipeline_metrics (약물별 "mfds.query" span 기록용, 선택)
+    """
+    names = list(names)
+    if not names: return []
+
+    # 작업 스레드의 span을 호출한 쪽의 현재 span 아래에 연결
+    parent = tracing.current_span(metrics)
+
+    # 이 일괄 검색의 요청만 세는 카운터 (같은 풀을 쓰는 다른 세션의 요청은 제외)
+    counter = {"checkouts": 0, "opened": 0}
+
+    def run(name):
+        with tracing.span(metrics, "mfds.query", parent=parent, query=name) as sp:
+            res, retries = _in_conn_scope(counter, search_drug_with_retry, name, speculative, stats)
+            sp.update({"matched": bool(res), "retries": retries})
+        return res, retries
+
+    workers = max(1, min(max_workers or MAX_CONCURRENCY, len(names)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mfds") as pool:
+        results = list(pool.map(run, names))
+
+    # [Metric] 이번 일괄 검색의 연결 재사용/신규
+    if stats is not None:
+        batch = _conn_summary(counter)
+        with _stats_lock:
+            stats["connections_opened"] = stats.get("connections_opened", 0) + batch["opened"]
+            stats["connections_reused"] = stats.get("connections_reused", 0) + batch["reused"]
+    return results
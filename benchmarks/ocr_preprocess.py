@@ -0,0 +1,91 @@
+# benchmarks/ocr_preprocess.py
+"""
+OCR 전처리 벤치마크: 원본 업로드 vs 전처리 업로드의 지연 시간과 추출 품질 비교
+
+사용법 (저장소 루트에서, .streamlit/secrets.toml 필요):
+    python benchmarks/ocr_preprocess.py <이미지 폴더> [--repeat 3]
+    python benchmarks/ocr_preprocess.py <이미지 폴더> --offline   # Gemini 호출 없이 용량/전처리 시간만
+
+품질 기준: 원본 업로드에서 추출된 약품명 집합 대비 전처리 업로드 결과의 일치율
+(공백 제거 후 비교. 원본 결과를 정답 대용으로 사용)
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_preprocess  # noqa: E402
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+
+
+def _names(ocr_result):
+    return {"".join((d.get("medicine_name") or "").split()) for d in ocr_result if d.get("medicine_name")}
+
+
+def _timed_ocr(path, preprocess):
+    import ocr
+    metrics = {}
+    started = time.perf_counter()
+    result = ocr.run_ocr(path, metrics=metrics, preprocess=preprocess, use_cache=False)
+    return (time.perf_counter() - started) * 1000, result, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image_dir")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--offline", action="store_true", help="Gemini 호출 없이 전처리 통계만 측정")
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir)
+                   if f.lower().endswith(IMAGE_EXTS))
+    if not paths:
+        sys.exit(f"이미지가 없습니다: {args.image_dir}")
+
+    rows = []
+    for path in paths:
+        _, prep = image_preprocess.preprocess_image(path)
+        row = {"image": os.path.basename(path), **prep}
+
+        if not args.offline:
+            raw_ms, prep_ms, agree = [], [], []
+            for _ in range(args.repeat):
+                t_raw, res_raw, _ = _timed_ocr(path, preprocess=False)
+                t_prep, res_prep, _ = _timed_ocr(path, preprocess=True)
+                raw_ms.append(t_raw)
+                prep_ms.append(t_prep)
+                base, got = _names(res_raw), _names(res_prep)
+                agree.append(len(base & got) / len(base) if base else float(not got))
+            row.update({
+                "ocr_ms_raw": statistics.median(raw_ms),
+                "ocr_ms_prep": statistics.median(prep_ms),
+                "name_agreement": statistics.mean(agree),
+            })
+        rows.append(row)
+
+    print(f"{'image':<28}{'KB before':>10}{'KB after':>10}{'prep ms':>9}"
+          + ("" if args.offline else f"{'OCR ms raw':>12}{'OCR ms prep':>13}{'agree':>8}"))
+    for r in rows:
+        line = (f"{r['image'][:27]:<28}{r['bytes_before'] / 1024:>10.0f}{r['bytes_after'] / 1024:>10.0f}"
+                f"{r['preprocess_ms']:>9}")
+        if not args.offline:
+            line += f"{r['ocr_ms_raw']:>12.0f}{r['ocr_ms_prep']:>13.0f}{r['name_agreement']:>8.0%}"
+        print(line)
+
+    total_before = sum(r["bytes_before"] for r in rows)
+    total_after = sum(r["bytes_after"] for r in rows)
+    print(f"\n[SUMMARY] upload bytes {total_before / 1024:.0f} KB -> {total_after / 1024:.0f} KB "
+          f"({1 - total_after / total_before:.0%} less)")
+    if not args.offline:
+        raw = statistics.median(r["ocr_ms_raw"] for r in rows)
+        prep = statistics.median(r["ocr_ms_prep"] for r in rows)
+        agree = statistics.mean(r["name_agreement"] for r in rows)
+        print(f"[SUMMARY] OCR latency p50 {raw:.0f} ms -> {prep:.0f} ms, name agreement {agree:.0%}")
+
+
+if __name__ == "__main__":
+    main()
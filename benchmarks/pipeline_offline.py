@@ -0,0 +1,247 @@
+# benchmarks/pipeline_offline.py
+"""
+오프라인 파이프라인 벤치마크: OCR -> 보정 -> 식약처 검색 -> DUR -> LLM -> DB 저장 전체 흐름을
+실제 서비스 없이 로컬 대역(benchmarks/stubs.py)으로 돌려 처리량 / 단계별 지연 / 메모리를 측정
+
+사용법 (저장소 루트에서, secrets.toml / 네트워크 불필요):
+    python benchmarks/pipeline_offline.py                           # 기본 20건, 동시 4건
+    python benchmarks/pipeline_offline.py --cases 50 --concurrency 8 --json out.json
+    python benchmarks/pipeline_offline.py --gemini lognormal:1500:0.4 --mfds fixed:300 --db uniform:40:120
+    python benchmarks/pipeline_offline.py --images <사진 폴더>       # 합성 이미지 대신 실제 사진 사용
+    python benchmarks/pipeline_offline.py --compare baseline.json   # 기준 대비 단계별 p50 회귀 시 종료 코드 1
+
+지연 분포 형식: fixed:<ms> | uniform:<lo>:<hi> | lognormal:<median>:<sigma>
+캐시(식약처 응답 / 약물 분석)는 실행마다 임시 경로를 새로 쓰므로 data/ 아래 실제 캐시에는 영향 없음
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL.Image  # noqa: E402
+from PIL import ImageDraw  # noqa: E402
+
+import stubs  # noqa: E402
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+BENCH_USER_ID = "offline-bench-user"
+
+
+# =========================================================
+# 1. 입력 이미지
+# =========================================================
+def synthetic_images(count, size):
+    """휴대폰 사진과 비슷한 용량의 합성 이미지(JPEG 바이트). 이미지마다 내용이 달라 OCR 캐시에 걸리지 않음"""
+    w, h = size
+    base = PIL.Image.effect_noise((w, h), 40).convert("RGB")
+    images = []
+    for i in range(count):
+        img = base.copy()
+        draw = ImageDraw.Draw(img)
+        for line in range(12):
+            draw.text((w // 10, h // 10 + line * h // 16), f"CASE {i} LINE {line} 약품명 1정 3회 3일", fill=(0, 0, 0))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=92)
+        images.append(buf.getvalue())
+    return images
+
+
+def folder_images(path):
+    names = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS))
+    images = []
+    for name in names:
+        with open(os.path.join(path, name), "rb") as f:
+            images.append(f.read())
+    return images
+
+
+# =========================================================
+# 2. 대역 설치 + 파이프라인 1건
+# =========================================================
+def install_stubs(args, workdir):
+    """앱 모듈의 외부 연결 지점을 대역으로 교체 -> (gemini, mfds_server, store)"""
+    import api_search
+    import care_processor
+    import db
+    import llm_gateway
+
+    gemini = stubs.RecordedGemini(latency=args.gemini, chunk_latency=args.gemini_chunk)
+    llm_gateway.get_client = lambda: gemini
+
+    mfds = stubs.FakeMfdsServer(latency=args.mfds, error_rate=args.mfds_error_rate).__enter__()
+    api_search.BACKEND = "api"
+    api_search.API_URL = mfds.url
+    api_search.SERVICE_KEY = "offline-bench"
+    api_search.CACHE_PATH = os.path.join(workdir, "mfds_cache.sqlite3")
+    care_processor.ANALYSIS_CACHE_PATH = os.path.join(workdir, "drug_analysis_cache.sqlite3")
+
+    store = stubs.InMemorySupabase(latency=args.db, rpc=not args.db_no_rpc)
+    db.init_supabase = lambda: store
+    return gemini, mfds, store
+
+
+def run_case(image_bytes, use_ocr_cache=False):
+    """pipeline.run 1건 (DB 저장 포함, main.py 업로드와 같은 경로) -> {trace, kpis, error?}"""
+    import pipeline
+
+    result = pipeline.run(image_bytes, user_id=BENCH_USER_ID, persist=True, use_ocr_cache=use_ocr_cache)
+    case = {"trace": result["metrics"].get("trace")}
+    if result["status"] != "ok":
+        case["error"] = f"{result['stage']}: {result['error']}"
+    elif result["report"] is not None:
+        case["kpis"] = result["report"]["meta_analysis"]["kpis"]
+    return case
+
+
+# =========================================================
+# 3. 집계 / 출력
+# =========================================================
+def _pct(values, q):
+    values = sorted(values)
+    if not values: return 0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(results, wall_sec):
+    import tracing
+
+    durations = {}
+    for m in results:
+        for name, values in tracing.stage_durations(m.get("trace")).items():
+            durations.setdefault(name, []).extend(values)
+        for key in ("total_latency_ms", "time_to_first_content_ms"):
+            if key in m.get("kpis", {}):
+                durations.setdefault(f"[{key}]", []).append(m["kpis"][key])
+
+    stages = {name: {"n": len(v), "p50": _pct(v, 0.5), "p95": _pct(v, 0.95), "max": max(v),
+                     "mean": round(statistics.mean(v), 1)}
+              for name, v in durations.items()}
+    ok = sum(1 for m in results if "error" not in m)
+    return {
+        "cases": len(results),
+        "succeeded": ok,
+        "wall_sec": round(wall_sec, 2),
+        "throughput_cases_per_sec": round(len(results) / wall_sec, 3) if wall_sec else 0,
+        "stages": stages,
+    }
+
+
+def print_report(summary):
+    print(f"\n[RUN] {summary['cases']} cases ({summary['succeeded']} ok), concurrency {summary['concurrency']}, "
+          f"{summary['wall_sec']} s -> {summary['throughput_cases_per_sec']} cases/s")
+    print(f"\n{'stage':<36}{'n':>5}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}")
+    for name in sorted(summary["stages"], key=lambda n: (not n.startswith("["), n)):
+        s = summary["stages"][name]
+        print(f"{name:<36}{s['n']:>5}{s['p50']:>9}{s['p95']:>9}{s['max']:>9}")
+    mem = summary["memory"]
+    print(f"\n[MEM] max RSS {mem['max_rss_mb']} MB" +
+          (f", tracemalloc peak {mem['tracemalloc_peak_mb']} MB" if "tracemalloc_peak_mb" in mem else ""))
+    print(f"[SETUP] " + ", ".join(f"{k} {v} ms" for k, v in summary["setup_ms"].items()))
+    print(f"[STUBS] " + ", ".join(f"{k}={v}" for k, v in summary["stubs"].items()))
+
+
+def compare(summary, baseline_path, tolerance, min_ms=5):
+    """기준 결과 대비 단계별 p50이 tolerance 이상 느려진 단계 목록"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, base in baseline.get("stages", {}).items():
+        cur = summary["stages"].get(name)
+        if cur is None or base["p50"] < min_ms: continue
+        if cur["p50"] > base["p50"] * (1 + tolerance):
+            regressions.append((name, base["p50"], cur["p50"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="측정 전에 버릴 건수 (사전/규칙 로드 등)")
+    parser.add_argument("--images", help="합성 이미지 대신 사용할 사진 폴더")
+    parser.add_argument("--image-size", default="3024x4032", help="합성 이미지 크기 WxH")
+    parser.add_argument("--ocr-cache", action="store_true", help="OCR 결과 캐시 사용 (기본: 끔)")
+    parser.add_argument("--gemini", default="lognormal:1200:0.3", help="Gemini 응답(첫 조각) 지연 분포")
+    parser.add_argument("--gemini-chunk", default="fixed:25", help="Gemini 스트리밍 조각 간 지연 분포")
+    parser.add_argument("--mfds", default="lognormal:180:0.4", help="식약처 API 지연 분포")
+    parser.add_argument("--mfds-error-rate", type=float, default=0.0, help="식약처 503 응답 비율")
+    parser.add_argument("--db", default="lognormal:60:0.3", help="Supabase 왕복 지연 분포")
+    parser.add_argument("--db-no-rpc", action="store_true", help="RPC 미배포 상태로 측정 (db.py 일괄 insert 경로)")
+    parser.add_argument("--tracemalloc", action="store_true", help="파이썬 할당 피크 측정 (느려짐)")
+    parser.add_argument("--json", help="결과 JSON 저장 경로")
+    parser.add_argument("--compare", help="기준 결과 JSON (단계별 p50 회귀 검사)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="허용 회귀 비율 (기본 25%%)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="medilens-bench-")
+    gemini, mfds, store = install_stubs(args, workdir)
+
+    import interaction_checker
+    import ocr_correction
+
+    # 콜드 스타트 비용은 케이스 지연과 따로 보고
+    setup_ms = {}
+    t0 = time.perf_counter()
+    ocr_correction.load_symspell_db()
+    setup_ms["symspell_load"] = int((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    interaction_checker.load_drug_rules()
+    setup_ms["drug_rules_load"] = int((time.perf_counter() - t0) * 1000)
+
+    total = args.warmup + args.cases
+    if args.images:
+        images = folder_images(args.images)
+        if not images: sys.exit(f"이미지가 없습니다: {args.images}")
+    else:
+        w, h = (int(v) for v in args.image_size.lower().split("x"))
+        images = synthetic_images(total, (w, h))
+
+    for i in range(args.warmup):
+        run_case(images[i % len(images)], args.ocr_cache)
+
+    if args.tracemalloc: tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda i: run_case(images[i % len(images)], args.ocr_cache),
+                                range(args.warmup, total)))
+    wall = time.perf_counter() - started
+
+    summary = summarize(results, wall)
+    summary["concurrency"] = args.concurrency
+    summary["setup_ms"] = setup_ms
+    summary["memory"] = {"max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if args.tracemalloc:
+        summary["memory"]["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    summary["stubs"] = {**{f"gemini_{k}": v for k, v in gemini.calls.items()},
+                        "mfds_requests": mfds.requests, "db_round_trips": store.round_trips,
+                        "db_round_trips_per_case": round(store.round_trips / total, 2)}
+    summary["config"] = {k: getattr(args, k) for k in ("gemini", "gemini_chunk", "mfds", "mfds_error_rate", "db", "db_no_rpc")}
+    errors = [m["error"] for m in results if "error" in m]
+    if errors: summary["errors"] = errors[:10]
+    mfds.__exit__(None, None, None)
+
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        regressions = compare(summary, args.compare, args.tolerance)
+        for name, base, cur in regressions:
+            print(f"[REGRESSION] {name}: p50 {base} ms -> {cur} ms")
+        if regressions: sys.exit(1)
+        print(f"[COMPARE] no stage regressed more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# benchmarks/stubs.py
+"""
+오프라인 벤치마크용 외부 서비스 대역 (Gemini / 식약처 API / Supabase)
+- RecordedGemini   : 녹화된 응답(fixtures/gemini_recorded.json)을 돌려주는 genai.Client 대역
+- FakeMfdsServer   : 식약처 OpenAPI와 같은 JSON을 돌려주는 로컬 HTTP 서버 (mfds_local 인덱스 기반)
+- InMemorySupabase : db.py가 쓰는 supabase 쿼리 체인(table/select/eq/insert/upsert...)과 RPC(supabase/*.sql)의 메모리 구현
+- Latency          : 각 대역의 응답 지연 분포 ("fixed:100", "uniform:50:150", "lognormal:800:0.4")
+"""
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mfds_local  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+# =========================================================
+# 1. 지연 분포
+# =========================================================
+class Latency:
+    """응답 지연 분포 (ms). spec: fixed:<ms> | uniform:<lo>:<hi> | lognormal:<median>:<sigma>"""
+
+    def __init__(self, spec):
+        kind, *args = str(spec).split(":")
+        self.spec = spec
+        self.kind = kind
+        self.args = [float(a) for a in args]
+        if kind not in ("fixed", "uniform", "lognormal") or len(self.args) != {"fixed": 1, "uniform": 2, "lognormal": 2}[kind]:
+            raise ValueError(f"지연 분포 형식 오류: {spec}")
+        self._rng = random.Random(hashlib.sha256(str(spec).encode()).digest())
+        self._lock = threading.Lock()
+
+    def sample_ms(self):
+        with self._lock:
+            if self.kind == "fixed":
+                return self.args[0]
+            if self.kind == "uniform":
+                return self._rng.uniform(*self.args)
+            median, sigma = self.args
+            return median * self._rng.lognormvariate(0, sigma)
+
+    def sleep(self):
+        time.sleep(self.sample_ms() / 1000)
+
+
+# =========================================================
+# 2. Gemini 대역 (녹화 응답)
+# =========================================================
+class _Usage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+
+
+class _Response:
+    def __init__(self, text, usage):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class RecordedGemini:
+    """
+    genai.Client 대역. llm_gateway.get_client 자리에 넣어 사용
+    - OCR 호출(이미지 포함): 이미지 해시로 녹화된 처방전 중 하나를 고정 선택
+    - 약물별 분석 호출: 프롬프트의 입력 JSON에서 약품명을 읽어 녹화된 항목(없으면 템플릿)으로 응답
+    - 리포트 합성 호출: 녹화된 리포트
+    """
+
+    def __init__(self, latency="lognormal:1200:0.3", chunk_latency="fixed:25", chunk_chars=48,
+                 fixture_path=None):
+        with open(fixture_path or os.path.join(FIXTURE_DIR, "gemini_recorded.json"), "r", encoding="utf-8") as f:
+            self.recorded = json.load(f)
+        self.latency = Latency(latency)
+        self.chunk_latency = Latency(chunk_latency)
+        self.chunk_chars = chunk_chars
+        self.calls = {"ocr": 0, "drug_analysis": 0, "report": 0}
+        self._lock = threading.Lock()
+        self.models = self
+
+    def _respond(self, contents):
+        if isinstance(contents, list):
+            image = next((c for c in contents if not isinstance(c, str)), None)
+            data = getattr(getattr(image, "inline_data", None), "data", None)
+            if data is None:  # 전처리 없이 PIL 이미지로 보낸 경우
+                data = image.tobytes() if hasattr(image, "tobytes") else b""
+            cases = self.recorded["ocr"]
+            kind, payload = "ocr", cases[int(hashlib.sha256(data).hexdigest(), 16) % len(cases)]
+        elif '"drug_analysis": [' in contents:
+            m = re.search(r"\[입력 데이터 JSON\]:\s*(\[.*?\])\s*</context>", contents, re.S)
+            names = [d["name"] for d in json.loads(m.group(1))] if m else []
+            template = self.recorded["drug_analysis_template"]
+            items = [{"name": n, **self.recorded["drug_analysis"].get(n, {k: v.format(name=n) for k, v in template.items()})}
+                     for n in names]
+            kind, payload = "drug_analysis", {"drug_analysis": items}
+        else:
+            kind, payload = "report", self.recorded["report"]
+
+        with self._lock:
+            self.calls[kind] += 1
+        text = json.dumps(payload, ensure_ascii=False)
+        prompt_len = sum(len(c) for c in contents if isinstance(c, str)) if isinstance(contents, list) else len(contents)
+        return text, _Usage(prompt_len // 2, len(text) // 2)
+
+    def generate_content(self, model, contents, config=None):
+        text, usage = self._respond(contents)
+        self.latency.sleep()
+        return _Response(text, usage)
+
+    def generate_content_stream(self, model, contents, config=None):
+        text, usage = self._respond(contents)
+        self.latency.sleep()  # 첫 조각까지
+        for i in range(0, len(text), self.chunk_chars):
+            if i: self.chunk_latency.sleep()
+            yield _Response(text[i:i + self.chunk_chars], usage)
+
+
+# =========================================================
+# 3. 식약처 API 대역 (로컬 HTTP 서버)
+# =========================================================
+class FakeMfdsServer:
+    """
+    getDrugPrdtPrmsnDtlInq06 과 같은 응답을 주는 로컬 HTTP 서버 (keep-alive 지원)
+    - 검색은 mfds_local 인덱스(기본: data/mfds_fixture.json 적재본)로 처리
+    - error_rate 확률로 503을 돌려 재시도 경로도 측정 가능
+    """
+
+    def __init__(self, latency="lognormal:180:0.4", error_rate=0.0, dump_path=None):
+        self.latency = Latency(latency)
+        self.error_rate = error_rate
+        self.requests = 0
+        self._tmpdir = tempfile.mkdtemp(prefix="medilens-bench-mfds-")
+        self.db_path = os.path.join(self._tmpdir, "mfds.sqlite3")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        mfds_local.ingest(dump_path or os.path.join(root, "data", "mfds_fixture.json"), self.db_path)
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests += 1
+                server.latency.sleep()
+                if random.random() < server.error_rate:
+                    self._send(503, {"header": {"resultCode": "99", "resultMsg": "SERVICE UNAVAILABLE"}})
+                    return
+                query = parse_qs(urlparse(self.path).query).get("item_name", [""])[0]
+                item = mfds_local.search(query, server.db_path)
+                self._send(200, {
+                    "header": {"resultCode": "00", "resultMsg": "NORMAL SERVICE."},
+                    "body": {"pageNo": 1, "numOfRows": 1, "totalCount": int(item is not None),
+                             "items": [item] if item else []},
+                })
+
+            def _send(self, code, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/1471000/DrugPrdtPrmsnInfoService07/getDrugPrdtPrmsnDtlInq06"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# =========================================================
+# 4. Supabase 대역 (메모리 저장소)
+# =========================================================
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    """supabase-py 쿼리 빌더 중 db.py가 쓰는 부분만 구현. execute() 1회 = 왕복 1회"""
+
+    def __init__(self, store, table):
+        self._store = store
+        self._table = table
+        self._op = "select"
+        self._payload = None
+        self._on_conflict = None
+        self._filters = []
+        self._order = None
+        self._limit = None
+
+    # --- 동작 ---
+    def select(self, columns="*", **kwargs):
+        self._op = "select"; return self
+
+    def insert(self, payload, **kwargs):
+        self._op, self._payload = "insert", payload; return self
+
+    def upsert(self, payload, on_conflict="", **kwargs):
+        self._op, self._payload = "upsert", payload
+        self._on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        return self
+
+    def update(self, values, **kwargs):
+        self._op, self._payload = "update", values; return self
+
+    def delete(self, **kwargs):
+        self._op = "delete"; return self
+
+    # --- 필터 / 정렬 ---
+    def eq(self, col, val):
+        self._filters.append(lambda r: r.get(col) == val); return self
+
+    def in_(self, col, vals):
+        vals = list(vals)
+        self._filters.append(lambda r: r.get(col) in vals); return self
+
+    def gte(self, col, val):
+        self._filters.append(lambda r: r.get(col) is not None and r.get(col) >= val); return self
+
+    def lte(self, col, val):
+        self._filters.append(lambda r: r.get(col) is not None and r.get(col) <= val); return self
+
+    def lt(self, col, val):
+        self._filters.append(lambda r: r.get(col) is not None and r.get(col) < val); return self
+
+    def gt(self, col, val):
+        self._filters.append(lambda r: r.get(col) is not None and r.get(col) > val); return self
+
+    def order(self, col, desc=False):
+        self._order = (col, desc); return self
+
+    def limit(self, n):
+        self._limit = n; return self
+
+    def execute(self):
+        return self._store._execute(self)
+
+
+class _Rpc:
+    def __init__(self, store, name, params):
+        self._store = store
+        self._name = name
+        self._params = params
+
+    def execute(self):
+        return self._store._call(self._name, self._params)
+
+
+class InMemorySupabase:
+    """
+    db.init_supabase 자리에 넣는 메모리 저장소. round_trips / latency로 네트워크 비용을 흉내냄
+    - rpc=False: RPC 미배포 상태 (PostgREST의 PGRST202 오류) -> db.py의 대체 경로 측정용
+    """
+
+    def __init__(self, latency="lognormal:60:0.3", rpc=True):
+        self.latency = Latency(latency)
+        self.tables = {}
+        self.round_trips = 0
+        self.rpc_enabled = rpc
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params=None):
+        return _Rpc(self, name, params or {})
+
+    def _insert_rows(self, table, payload):
+        rows = self.tables.setdefault(table, [])
+        written = []
+        for p in payload:
+            now = datetime.now().isoformat()
+            row = {"id": str(uuid.uuid4()), "created_at": now, "updated_at": now, **p}
+            rows.append(row)
+            written.append(dict(row))
+        return written
+
+    def _call(self, name, params):
+        self.latency.sleep()
+        with self._lock:
+            self.round_trips += 1
+            handler = getattr(self, f"_rpc_{name}", None) if self.rpc_enabled else None
+            if handler is None:
+                raise Exception({"code": "PGRST202", "message": f"Could not find the function public.{name}"})
+            return _Result(handler(**params))
+
+    # --- RPC (supabase/*.sql 과 같은 동작) ---
+    def _rpc_save_case(self, p_user_id, p_case_id, p_medicines, p_report=None):
+        for table in ("medicines", "reports"):
+            self.tables[table] = [r for r in self.tables.get(table, [])
+                                  if (r.get("user_id"), r.get("case_id")) != (p_user_id, p_case_id)]
+        self._insert_rows("medicines", p_medicines)
+        if p_report is not None:
+            # supabase/save_case.sql과 같이 저장 정보를 리포트에 기록
+            pipeline = (p_report.get("meta_analysis") or {}).get("pipeline")
+            if isinstance(pipeline, dict):
+                pipeline["persist"] = {"via": "rpc", "round_trips": 1, "server_ms": 0}
+            self._insert_rows("reports", [{"user_id": p_user_id, "case_id": p_case_id, "report_json": p_report}])
+        return len(p_medicines)
+
+    def _matches(self, q, row):
+        return all(f(row) for f in q._filters)
+
+    def _execute(self, q):
+        self.latency.sleep()
+        with self._lock:
+            self.round_trips += 1
+            rows = self.tables.setdefault(q._table, [])
+
+            if q._op in ("insert", "upsert"):
+                payload = q._payload if isinstance(q._payload, list) else [q._payload]
+                written = []
+                for p in payload:
+                    if q._op == "upsert" and q._on_conflict:
+                        key = tuple(p.get(c) for c in q._on_conflict)
+                        existing = next((r for r in rows if tuple(r.get(c) for c in q._on_conflict) == key), None)
+                        if existing is not None:
+                            existing.update(p, updated_at=datetime.now().isoformat())
+                            written.append(dict(existing))
+                            continue
+                    written.extend(self._insert_rows(q._table, [p]))
+                return _Result(written)
+
+            matched = [r for r in rows if self._matches(q, r)]
+            if q._op == "update":
+                for r in matched: r.update(q._payload, updated_at=datetime.now().isoformat())
+                return _Result([dict(r) for r in matched])
+            if q._op == "delete":
+                self.tables[q._table] = [r for r in rows if not self._matches(q, r)]
+                return _Result([dict(r) for r in matched])
+
+            if q._order:
+                col, desc = q._order
+                matched.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=desc)
+            if q._limit is not None:
+                matched = matched[:q._limit]
+            return _Result([dict(r) for r in matched])
@@ -1,23 +1,28 @@
-from google import genai
 from google.genai import types
 import streamlit as st
 import json
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from contextlib import closing
 import interaction_checker  # [RAG] 상호작용 검사기 모듈 임포트
+import llm_gateway
 
-def analyze_with_llm(final_json):
-    """
-    LLM에게 JSON(+ RAG 결과)을 주고, 
-    약물별 상세 분석(효능, 주의사항, 복용법, 음식궁합) + [통합 리포트]를 한 번에 요청
-    """
-    try:
-        client = genai.Client(api_key=st.secrets["gemini_api_key"])
-        
-        # [RAG] 상호작용 규칙 검사 (Local Hybrid RAG)
-        detected_warnings = interaction_checker.check_interactions(final_json)
-        warning_text = "\n".join(detected_warnings) if detected_warnings else "특이사항 없음"
+# 약물별 분석 캐시 (SQLite): (정규 약품명, 식약처 레코드 버전) -> efficacy/caution/usage/food_guide
+try:
+    ANALYSIS_CACHE_PATH = st.secrets.get("analysis_cache_path", os.path.join("data", "drug_analysis_cache.sqlite3"))
+    ANALYSIS_CACHE_TTL_SEC = float(st.secrets.get("analysis_cache_ttl_days", 30)) * 86400
+except Exception:
+    ANALYSIS_CACHE_PATH = os.path.join("data", "drug_analysis_cache.sqlite3")
+    ANALYSIS_CACHE_TTL_SEC = 30 * 86400
+
+DRUG_FIELDS = ("efficacy", "caution", "usage", "food_guide")
 
-        # 프롬프트 구성 (Gemini Prompt Strategy)
-        prompt = f"""
+ROLE_PROMPT = """
         <role>
         당신은 환자의 건강 회복을 돕는 '전문 AI 복약 가이드'입니다.
         약사 수준의 전문적인 지식을 갖추고 있지만, 자신을 '약사'라고 직접적으로 지칭하지는 마세요.
@@ -25,65 +30,290 @@ def analyze_with_llm(final_json):
         정확하지 않은 정보는 추측하지 말고, 제공된 데이터와 당신의 의학 지식을 바탕으로 답변하세요.
         **[중요] 모든 답변의 끝이나 적절한 위치에 "이 정보는 보조적인 수단이며, 전문적인 의학적 판단은 의사와 상의하세요"라는 취지의 문구를 자연스럽게 포함하세요.**
         </role>
+"""
+
+WRITING_GUIDELINES = """
+        <writing_guidelines>
+        1. **풍부한 설명**: 단답형보다는 문장형으로 설명하여 정보의 가치를 높이세요.
+        2. **톤앤매너**: 딱딱한 기계적인 말투 지양. 옆에서 챙겨주는 듯한 부드러운 "해요체" 사용.
+        3. **정확성**: 약물명(`name`)은 입력된 데이터와 100% 동일하게 유지하세요.
+        4. **가독성**: 리포트 내용에는 마크다운(bold, list)을 적절히 사용하여 읽기 편하게 만드세요.
+        </writing_guidelines>
+"""
+
+# 프롬프트/모델이 바뀌면 약물별 캐시는 자동으로 무효 (버전에 포함)
+_PROMPT_VERSION = hashlib.sha256(f"{ROLE_PROMPT}|{WRITING_GUIDELINES}|{llm_gateway.MODEL_ID}|v1".encode("utf-8")).hexdigest()[:12]
+
+
+# =========================================================
+# 1. 약물별 분석 캐시
+# =========================================================
+_cache_local = threading.local()
+_cache_init_lock = threading.Lock()
+_cache_ready = {}  # 캐시 파일 경로 -> 사용 가능 여부
+
+def _cache_path():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, ANALYSIS_CACHE_PATH)
+
+def _init_cache(path):
+    """캐시 파일 준비 (WAL 전환 / 테이블 생성 / 만료 행 정리) -> 사용 가능 여부. 경로별로 프로세스당 1회만 실행"""
+    with _cache_init_lock:
+        if path not in _cache_ready:
+            try:
+                conn = sqlite3.connect(path, timeout=5)
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")  # 파일에 유지되는 설정
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS drug_analysis ("
+                        " cache_key TEXT PRIMARY KEY, canonical_name TEXT, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+                    )
+                    conn.execute("DELETE FROM drug_analysis WHERE expires_at < ?", (time.time(),))
+                    conn.commit()
+                finally:
+                    conn.close()
+                _cache_ready[path] = True
+            except Exception as e:
+                print(f"[WARN] 약물 분석 캐시 사용 불가: {e}")
+                _cache_ready[path] = False
+        return _cache_ready[path]
+
+def _cache_conn():
+    """스레드별 SQLite 연결 (조회/저장만, 준비 실패 시 None -> 캐시 없이 동작)"""
+    path = _cache_path()
+    if getattr(_cache_local, "path", None) == path:
+        return _cache_local.conn
+    conn = None
+    if _init_cache(path):
+        try:
+            conn = sqlite3.connect(path, timeout=5)
+        except Exception as e:
+            print(f"[WARN] 약물 분석 캐시 연결 실패: {e}")
+    _cache_local.path, _cache_local.conn = path, conn
+    return conn
+
+def _drug_name(drug):
+    return drug.get('corrected_medicine_name') or drug.get('medicine_name') or ''
+
+def drug_cache_key(drug, warnings):
+    """
+    (정규 약품명, 식약처 레코드 버전) 캐시 키
+    - 정규 약품명: 식약처 품목명(매칭 시) 또는 보정된 약품명, 공백 제거
+    - 레코드 버전: 품목기준코드 + 식약처 본문(효능/용법/주의) + 해당 약물의 상호작용 규칙 + 프롬프트 버전
+    """
+    canonical = drug.get('mfds_item_name') or _drug_name(drug)
+    canonical = re.sub(r'\s+', '', unicodedata.normalize("NFC", canonical))
+    record = "|".join([str(drug.get('mfds_item_seq') or '')]
+                      + [drug.get(k) or '' for k in ('efficacy', 'usage', 'caution')]
+                      + sorted(warnings) + [_PROMPT_VERSION])
+    version = hashlib.sha256(record.encode("utf-8")).hexdigest()[:16]
+    return canonical, f"{canonical}|{version}"
+
+def _cache_get(key):
+    conn = _cache_conn()
+    if conn is None: return None
+    try:
+        row = conn.execute(
+            "SELECT payload FROM drug_analysis WHERE cache_key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0]) if row else None
+
+def _cache_put(key, canonical, entry):
+    conn = _cache_conn()
+    if conn is None: return
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO drug_analysis VALUES (?, ?, ?, ?)",
+            (key, canonical, json.dumps(entry, ensure_ascii=False), time.time() + ANALYSIS_CACHE_TTL_SEC)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"[WARN] 약물 분석 캐시 저장 실패: {e}")
+
+def _parse_days(drug):
+    """처방 일수를 정수로 (없으면 None)"""
+    m = re.search(r'\d+', str(drug.get('days') or ''))
+    return int(m.group()) if m else None
+
+def _drug_item(drug, entry):
+    """화면/DB용 약물 항목 (이름/일수는 이번 처방 기준)"""
+    item = {"name": _drug_name(drug), **entry}
+    days = _parse_days(drug)
+    if days is not None: item["days"] = days
+    return item
+
+class _StreamingArrayParser:
+    """
+    스트리밍 JSON 응답에서 key 배열의 원소(객체)가 닫히는 즉시 꺼내는 증분 파서
+    - 문자열 안의 중괄호/따옴표 이스케이프를 구분하며, 이미 읽은 위치는 다시 보지 않음
+    """
+    def __init__(self, key):
+        self._marker = f'"{key}"'
+        self._buf = ""
+        self._pos = None       # 배열 내부 스캔 위치 (배열 시작 전이면 None)
+        self._depth = 0
+        self._obj_start = 0
+        self._in_str = False
+        self._escape = False
+        self._done = False
+
+    def feed(self, text):
+        """텍스트 조각을 넣고, 이번에 완성된 객체 리스트를 반환"""
+        self._buf += text
+        buf, items = self._buf, []
+        if self._pos is None:
+            i = buf.find(self._marker)
+            j = buf.find("[", i + len(self._marker)) if i >= 0 else -1
+            if j < 0: return items
+            self._pos = j + 1
+
+        while self._pos < len(buf) and not self._done:
+            c = buf[self._pos]
+            if self._in_str:
+                if self._escape: self._escape = False
+                elif c == "\\": self._escape = True
+                elif c == '"': self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c == "{":
+                if self._depth == 0: self._obj_start = self._pos
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads(buf[self._obj_start:self._pos + 1]))
+                    except ValueError:
+                        pass
+            elif c == "]" and self._depth == 0:
+                self._done = True
+            self._pos += 1
+        return items
+
+
+# =========================================================
+# 2. LLM 호출
+# =========================================================
+def _analyze_drugs_stream(drugs, warnings_by_name, metrics=None):
+    """
+    캐시에 없는 약물들만 모아 한 번에 약물별 상세 분석 요청 (스트리밍)
+    - 응답의 drug_analysis 항목이 하나 닫힐 때마다 (약품명, item)을 바로 yield
+    """
+    payload = [{
+        "name": _drug_name(d),
+        "api_info": {k: d.get(k) for k in ('efficacy', 'usage', 'caution') if d.get(k)},
+        "known_interactions": warnings_by_name.get(_drug_name(d), []),
+    } for d in drugs]
+
+    prompt = f"""
+        {ROLE_PROMPT}
 
         <context>
-        JSON 데이터는 환자의 처방전 정보입니다. 
-        각 약물에 대해 식약처 API 결과('api_info')가 포함되어 있을 수 있습니다.
+        아래 JSON은 약물 목록입니다. 각 약물에 대해 식약처 API 결과('api_info')와
+        확정된 상호작용 주의사항('known_interactions')이 포함되어 있을 수 있습니다.
+        이 설명은 여러 환자에게 재사용되므로 특정 환자의 처방 상황(일수, 다른 약)은 언급하지 마세요.
+
+        [입력 데이터 JSON]:
+        {json.dumps(payload, ensure_ascii=False)}
+        </context>
+
+        <task>
+        각 약물별 'efficacy'(효능), 'caution'(주의사항), 'usage'(복용법), 'food_guide'(음식/생활 가이드)를 작성하세요.
+        - 단순히 "정보 없음"이라고 하기보다, 약의 성분과 일반적인 특성을 바탕으로 도움이 될 만한 정보를 풍부하게 작성하세요.
+        - 'known_interactions'에 경고가 있다면 'caution'나 'food_guide'에 반드시 포함하고 강조하세요.
+        </task>
+        {WRITING_GUIDELINES}
+        <output_format>
+        반드시 아래 JSON 포맷으로, 마크다운 코드블록 없이 순수 JSON 문자열만 응답하세요.
+
+        {{
+            "drug_analysis": [
+                {{
+                    "name": "약물명",
+                    "efficacy": "상세 효능 설명",
+                    "caution": "상세 주의사항",
+                    "usage": "복용법",
+                    "food_guide": "음식/생활 가이드(술, 커피, 특정 음식 등 상세히)"
+                }}
+            ]
+        }}
+        </output_format>
+        """
+
+    parser = _StreamingArrayParser("drug_analysis")
+    pending = {_drug_name(d) for d in drugs}
+    position = 0
+    # 파싱 오류 / 소비 측 중단으로 끝까지 읽지 않아도 게이트웨이 슬롯을 바로 반납
+    with closing(llm_gateway.generate_stream(
+        contents=prompt,
+        config=types.GenerateContentConfig(response_mime_type="application/json"),
+        metrics=metrics,
+        stage="drug_analysis"
+    )) as stream:
+        for chunk in stream:
+            for item in parser.feed(chunk):
+                if not isinstance(item, dict): continue
+                name = item.get('name')
+                # 이름이 바뀌어 돌아온 경우 같은 순서의 약물로 대응
+                if name not in pending:
+                    name = _drug_name(drugs[position]) if position < len(drugs) else None
+                position += 1
+                if name in pending:
+                    pending.discard(name)
+                    yield name, item
+
+def _synthesize_report(drugs, drug_analysis, warning_text, metrics=None):
+    """처방전 단위 정보(스케줄/메타/리포트)만 생성하는 가벼운 호출"""
+    prescription = [{
+        "name": _drug_name(d),
+        "dosage": d.get('dosage'),
+        "frequency": d.get('frequency'),
+        "days": d.get('days'),
+        "prescribed_usage": d.get('usage') if not d.get('efficacy') else None,
+        "api_match": bool(d.get('efficacy') or d.get('caution')),
+    } for d in drugs]
+    # 리포트 작성에 필요한 만큼만 요약해서 전달 (약물별 상세 본문은 이미 완성됨)
+    caution_digest = [{"name": a['name'], "caution": (a.get('caution') or '')[:300]} for a in drug_analysis]
+
+    prompt = f"""
+        {ROLE_PROMPT}
+
+        <context>
+        JSON 데이터는 환자의 처방전 정보입니다. 약물별 상세 설명은 이미 작성되어 있으니 다시 쓰지 마세요.
 
         [Known Interactions (확정된 주의사항 - 반드시 반영할 것)]:
         {warning_text}
 
-        [입력 데이터 JSON]:
-        {json.dumps(final_json, ensure_ascii=False)}
+        [처방전 JSON]:
+        {json.dumps(prescription, ensure_ascii=False)}
+
+        [약물별 주의사항 요약]:
+        {json.dumps(caution_digest, ensure_ascii=False)}
         </context>
 
         <task>
-        제공된 데이터를 바탕으로 아래 단계들을 수행하고, 결과를 JSON 포맷으로 반환하세요.
-        
-        1. **약물별 상세 분석 ('drug_analysis' 배열)**:
-           - 각 약물별 'efficacy'(효능), 'caution'(주의사항), 'usage'(복용법), 'food_guide'(음식/생활 가이드) 작성.
-           - 단순히 "정보 없음"이라고 하기보다, 약의 성분과 일반적인 특성을 바탕으로 도움이 될 만한 정보를 풍부하게 작성하세요.
-           - [Known Interactions]에 경고가 있다면 'caution'나 'food_guide'에 반드시 포함하고 강조하세요.
-           - 'days'(처방 일수)는 입력 데이터에서 정수로 추출하세요 (없으면 미표기).
-
-        2. **스케줄링 추론 ('schedule_time_list')**:
+        1. **스케줄링 추론 ('schedule_time_list')**:
            - 복용 횟수와 간격을 고려하여 최적의 시간표를 만드세요.
            - 기준: 아침(08:00), 점심(13:00), 저녁(19:00), 취침전(22:00).
 
-        3. **[NEW] 메타 데이터 분석 ('meta_analysis')**:
-           - 대시보드 시각화를 위한 정량적 데이터를 추출하세요.
+        2. **메타 데이터 분석 ('meta_analysis')**:
            - "risk_level": 상호작용이나 주의사항의 심각도에 따라 "Low", "Medium", "High" 중 하나.
            - "interaction_count": 발견된 상호작용 또는 중대한 주의사항의 개수 (정수).
-           - "quality_flags": 데이터 신뢰도 태그 (예: {{ "api_match_success": true, "ocr_confidence": "high" }}). API 검색 결과가 있으면 match success.
+           - "quality_flags": 데이터 신뢰도 태그 (예: {{ "api_match_success": true, "ocr_confidence": "high" }}). api_match가 모두 true면 match success.
 
-        4. **종합 리포트 생성 ('report' 객체)**:
+        3. **종합 리포트 생성 ('report' 객체)**:
            - "opening_message": 환자의 쾌유를 비는 따뜻하고 감성적인 인사말.
            - "schedule_proposal": 구체적이고 실천하기 쉬운 스케줄 제안.
-           - "safety_warnings": 운전, 졸음 등 생활 밀착형 안전 주의사항.
+           - "safety_warnings": 운전, 졸음 등 생활 밀착형 안전 주의사항 (약물 조합 관점 포함).
            - "medication_tips": 생활 습관, 피해야 할 음식 등 실질적 조언.
         </task>
-        
-        <writing_guidelines>
-        1. **풍부한 설명**: 단답형보다는 문장형으로 설명하여 정보의 가치를 높이세요.
-        2. **톤앤매너**: 딱딱한 기계적인 말투 지양. 옆에서 챙겨주는 듯한 부드러운 "해요체" 사용.
-        3. **정확성**: 약물명(`name`)은 입력된 데이터와 100% 동일하게 유지하세요.
-        4. **가독성**: 리포트 내용에는 마크다운(bold, list)을 적절히 사용하여 읽기 편하게 만드세요.
-        </writing_guidelines>
-
+        {WRITING_GUIDELINES}
         <output_format>
         반드시 아래 JSON 포맷으로, 마크다운 코드블록 없이 순수 JSON 문자열만 응답하세요.
 
         {{
-            "drug_analysis": [
-                {{
-                    "name": "약물명",
-                    "efficacy": "상세 효능 설명",
-                    "caution": "상세 주의사항",
-                    "usage": "복용법",
-                    "days": 3,
-                    "food_guide": "음식/생활 가이드(술, 커피, 특정 음식 등 상세히)"
-                }}
-            ],
             "schedule_time_list": ["08:30", "13:30", "19:30"],
             "meta_analysis": {{
                 "risk_level": "Low",
@@ -101,20 +331,79 @@ def analyze_with_llm(final_json):
         </output_format>
         """
 
-        # 4. AI 호출
-        response = client.models.generate_content(
-            model="gemini-3-flash-preview",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json" 
-            )
-        )
-        
-        # 5. 결과 파싱
-        return json.loads(response.text)
+    response = llm_gateway.generate(
+        contents=prompt,
+        config=types.GenerateContentConfig(response_mime_type="application/json"),
+        metrics=metrics,
+        stage="analysis"
+    )
+    return json.loads(response.text)
+
+def analyze_with_llm_stream(final_json, metrics=None):
+    """
+    LLM에게 JSON(+ RAG 결과)을 주고, 
+    약물별 상세 분석(효능, 주의사항, 복용법, 음식궁합) + [통합 리포트]를 생성
+    - 약물별 분석은 (정규 약품명, 식약처 레코드 버전) 단위로 캐시 -> 처음 보는 약물만 LLM 호출
+    - 처방전별 스케줄/메타/리포트만 가벼운 호출로 생성
+    - metrics: pipeline_metrics (LLM 지연/토큰, 캐시 적중 기록용, 선택)
+
+    이벤트를 순서대로 yield 하는 제너레이터:
+    - ("drug", item): 약물 카드 하나가 완성될 때마다 (캐시 적중분은 즉시, 나머지는 응답 스트림에서 닫히는 대로)
+    - ("result", dict): 마지막 1회. analyze_with_llm()의 반환값과 동일 (실패 시 {"error": ...})
+    """
+    try:
+        drugs = final_json if isinstance(final_json, list) else final_json.get('drugs', [])
+
+        # [RAG] 상호작용 규칙 검사 (Local Hybrid RAG)
+        detected_warnings = interaction_checker.check_interactions(final_json)
+        warning_text = "\n".join(detected_warnings) if detected_warnings else "특이사항 없음"
+        warnings_by_name = {_drug_name(d): interaction_checker.check_interactions([d]) for d in drugs}
+
+        # 1. 약물별 분석: 캐시 조회 (적중분은 바로 화면에 내보냄)
+        entries, missing = {}, []
+        keys, first_drug = {}, {}
+        for d in drugs:
+            name = _drug_name(d)
+            if name in keys: continue  # 같은 약이 두 번 적힌 경우
+            keys[name] = drug_cache_key(d, warnings_by_name[name])
+            first_drug[name] = d
+            cached = _cache_get(keys[name][1])
+            if cached is not None:
+                entries[name] = cached
+                yield "drug", _drug_item(d, cached)
+            else:
+                missing.append(d)
+
+        if metrics is not None:
+            metrics["analysis_cache"] = {"hit": len(keys) - len(missing), "miss": len(missing)}
+
+        # 2. 캐시에 없는 약물만 LLM 분석 (스트리밍) 후 저장
+        if missing:
+            with closing(_analyze_drugs_stream(missing, warnings_by_name, metrics)) as analyzed:
+                for name, item in analyzed:
+                    entry = {k: item.get(k, '') for k in DRUG_FIELDS}
+                    entries[name] = entry
+                    canonical, key = keys[name]
+                    _cache_put(key, canonical, entry)
+                    yield "drug", _drug_item(first_drug[name], entry)
+
+        # 3. 처방전 순서대로 조립
+        drug_analysis = [_drug_item(d, entries[_drug_name(d)]) for d in drugs if _drug_name(d) in entries]
+
+        # 4. 처방전 단위 리포트 (얇은 합성 호출)
+        result = _synthesize_report(drugs, drug_analysis, warning_text, metrics)
+        result["drug_analysis"] = drug_analysis
+        yield "result", result
         
     except Exception as e:
-        return {"error": f"AI 분석 실패: {str(e)}"}
+        yield "result", {"error": f"AI 분석 실패: {str(e)}"}
+
+def analyze_with_llm(final_json, metrics=None):
+    """analyze_with_llm_stream()을 끝까지 소비해 최종 결과 dict만 반환 (비대화형 호출용)"""
+    result = {"error": "AI 분석 실패: 결과 없음"}
+    for event, data in analyze_with_llm_stream(final_json, metrics=metrics):
+        if event == "result": result = data
+    return result
 
 # def generate_summary_report(medicines):
 #     """
@@ -0,0 +1,218 @@
+# check_outbox.py
+"""
+복용 체크 쓰기 지연 큐 (write-behind outbox)
+- 체크박스 토글은 세션 dict + 로컬 SQLite(data/check_outbox.sqlite3)에만 기록하고 바로 반환
+  -> 리런이 Supabase upsert 왕복을 기다리지 않음
+- 전송 스레드가 마지막 토글 후 FLUSH_DEBOUNCE_SEC 동안 조용하면 쌓인 체크를 upsert 1회로 전송
+  (연속으로 6개를 체크해도 왕복 1회, 같은 칸을 여러 번 누르면 마지막 값만 전송)
+- 사용자별로 묶어 전송하고, 서버가 행을 거부한 묶음(FK / RLS / 제약 위반, db.row_rejected)만 반씩 나눠
+  다시 보내 문제 행만 골라냄 (거부된 행 하나가 다른 체크나 다른 사용자를 막지 않도록)
+- 연결 오류 / 5xx는 나눠 보내도 같은 결과이므로 묶음 전체를 한 번에 미룸
+- 실패한 행은 남겨 두고 점점 긴 간격으로 재시도, 거부된 행은 MAX_ATTEMPTS번 실패하면 보류(failed) 처리해
+  화면에 표시 (장애 중인 행은 보류하지 않고 RETRY_MAX_SEC 간격으로 계속 재시도)
+  프로세스가 재시작되어도 파일에 남은 체크를 다시 전송
+- 전송 전에 기록을 다시 불러오면(db.sync_history) pending()으로 아직 안 보낸 체크를 덮어써 화면 값 유지
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+import db
+
+try:
+    OUTBOX_PATH = st.secrets.get("check_outbox_path", os.path.join("data", "check_outbox.sqlite3"))
+    FLUSH_DEBOUNCE_SEC = float(st.secrets.get("check_flush_debounce_sec", 1.0))
+except Exception:
+    OUTBOX_PATH = os.path.join("data", "check_outbox.sqlite3")
+    FLUSH_DEBOUNCE_SEC = 1.0
+
+RETRY_BASE_SEC = 2.0         # 첫 재시도 간격 (실패할 때마다 2배)
+RETRY_MAX_SEC = 60.0         # 재시도 간격 상한
+MAX_ATTEMPTS = 8             # 거부된 행이 이 횟수만큼 실패하면 자동 재시도 중단 (보류, 사용자가 다시 시도 / 버리기)
+POLL_INTERVAL_SEC = 5.0      # 다른 프로세스가 남긴 체크 / 재시도 시각 확인 주기
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_checks (
+    user_id     TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    drug_name   TEXT NOT NULL,
+    time        TEXT NOT NULL,
+    is_checked  INTEGER NOT NULL,
+    version     INTEGER NOT NULL DEFAULT 1,  -- 전송 중 다시 토글되면 증가 (전송 성공해도 지우지 않음)
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_try    REAL NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    failed      INTEGER NOT NULL DEFAULT 0,  -- MAX_ATTEMPTS 초과로 보류된 행
+    PRIMARY KEY (user_id, date, drug_name, time)
+);
+CREATE INDEX IF NOT EXISTS idx_pending_checks_next ON pending_checks(next_try);
+"""
+
+
+class CheckOutbox:
+    """SQLite 영속 체크 큐 + 일괄 전송 스레드"""
+
+    def __init__(self, path=OUTBOX_PATH, debounce=FLUSH_DEBOUNCE_SEC, writer=None):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        self.path = os.path.join(current_dir, path)
+        self.debounce = debounce
+        # 일괄 저장 함수 (기본: db.upsert_checks, 벤치마크/시험에서 교체 가능)
+        self._writer = writer or db.upsert_checks
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._last_enqueue = 0.0
+        self._thread = None
+
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        """스레드별 연결 (autocommit)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # --- 전송 스레드 ---
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, name="check-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """전송 스레드 종료 (남은 체크는 마지막으로 한 번 더 전송 시도)"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self._next_wait())
+            self._wakeup.clear()
+            # 디바운스: 마지막 토글 후 debounce초 동안 추가 토글이 없을 때까지 대기
+            while not self._stop.is_set():
+                quiet = time.time() - self._last_enqueue
+                if quiet >= self.debounce: break
+                self._stop.wait(self.debounce - quiet)
+            self.flush()
+        self.flush(force=True)
+
+    def _next_wait(self):
+        """다음 재시도 시각까지 대기 (없으면 POLL_INTERVAL_SEC)"""
+        row = self._conn().execute("SELECT MIN(next_try) FROM pending_checks WHERE failed = 0").fetchone()
+        if row[0] is None: return POLL_INTERVAL_SEC
+        return min(POLL_INTERVAL_SEC, max(0.0, row[0] - time.time()))
+
+    def flush(self, force=False):
+        """
+        전송할 때가 된 체크를 사용자별 upsert 1회씩으로 전송 -> 전송에 성공한 행 수
+        force: 재시도 대기 중인 행도 포함 (종료 시)
+        """
+        rows = self._conn().execute(
+            "SELECT user_id, date, drug_name, time, is_checked, version, attempts FROM pending_checks"
+            " WHERE failed = 0 AND next_try <= ?", (float("inf") if force else time.time(),)
+        ).fetchall()
+        by_user = {}
+        for r in rows:
+            by_user.setdefault(r["user_id"], []).append(r)
+        return sum(self._send(user_rows) for user_rows in by_user.values())
+
+    def _send(self, rows):
+        """
+        rows를 upsert 1회로 전송 -> 전송 성공 행 수
+        - 서버가 행을 거부하면 반씩 나눠 다시 보내 거부된 행만 남김
+        - 연결 오류 / 5xx면 나누지 않고 묶음 전체를 재시도 대기로
+        """
+        payload = [{"user_id": r["user_id"], "date": r["date"], "drug_name": r["drug_name"],
+                    "time": r["time"], "is_checked": bool(r["is_checked"])} for r in rows]
+        try:
+            self._writer(payload)
+        except Exception as e:
+            rejected = db.row_rejected(e)
+            if rejected and len(rows) > 1:
+                mid = len(rows) // 2
+                return self._send(rows[:mid]) + self._send(rows[mid:])
+            self._record_failure(rows, e, rejected)
+            return 0
+
+        # 전송 중 다시 토글된 행(version 증가)은 남겨 두고 다음 전송에 포함
+        self._conn().executemany(
+            "DELETE FROM pending_checks WHERE user_id = ? AND date = ? AND drug_name = ? AND time = ? AND version = ?",
+            [(r["user_id"], r["date"], r["drug_name"], r["time"], r["version"]) for r in rows]
+        )
+        return len(rows)
+
+    def _record_failure(self, rows, error, rejected):
+        """실패 기록: 행마다 다음 재시도 시각 설정, 거부된 행은 MAX_ATTEMPTS 도달 시 보류
+        (version이 같을 때만 -> 그 사이 다시 토글된 행은 next_try = 0 그대로 바로 전송)"""
+        if rejected:
+            r = rows[0]
+            print(f"체크 저장 거부 ({r['date']} {r['drug_name']} {r['time']}, {r['attempts'] + 1}회): {error}")
+        else:
+            print(f"체크 {len(rows)}건 저장 실패, 나중에 재시도: {error}")
+        now = time.time()
+        self._conn().executemany(
+            "UPDATE pending_checks SET attempts = ?, next_try = ?, last_error = ?, failed = ?"
+            " WHERE user_id = ? AND date = ? AND drug_name = ? AND time = ? AND version = ?",
+            [(r["attempts"] + 1, now + min(RETRY_MAX_SEC, RETRY_BASE_SEC * 2 ** r["attempts"]), str(error),
+              int(rejected and r["attempts"] + 1 >= MAX_ATTEMPTS), r["user_id"], r["date"], r["drug_name"],
+              r["time"], r["version"]) for r in rows]
+        )
+
+    # --- UI용 ---
+    def enqueue(self, user_id, date_str, drug_name, time_val, is_checked):
+        """체크 1건 기록 (로컬 파일 쓰기만 하고 즉시 반환, 같은 칸은 마지막 값으로 덮어씀)"""
+        self._conn().execute(
+            "INSERT INTO pending_checks (user_id, date, drug_name, time, is_checked) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (user_id, date, drug_name, time) DO UPDATE SET"
+            " is_checked = excluded.is_checked, version = version + 1, next_try = 0, attempts = 0, failed = 0",
+            (user_id, date_str, drug_name, time_val, int(is_checked))
+        )
+        self._last_enqueue = time.time()
+        self._wakeup.set()
+
+    def pending(self, user_id):
+        """아직 전송하지 않은 체크 -> {(날짜, 약이름, 시간): bool} (db.load_history와 같은 키)"""
+        rows = self._conn().execute(
+            "SELECT date, drug_name, time, is_checked FROM pending_checks WHERE user_id = ?", (user_id,)
+        ).fetchall()
+        return {(r["date"], r["drug_name"], r["time"]): bool(r["is_checked"]) for r in rows}
+
+    def retrying(self, user_id):
+        """전송에 한 번 이상 실패해 재시도 대기 중인 체크 수 (보류 제외)"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM pending_checks WHERE user_id = ? AND attempts > 0 AND failed = 0", (user_id,)
+        ).fetchone()[0]
+
+    def failed(self, user_id):
+        """자동 재시도를 멈춘(보류) 체크 목록 [{date, drug_name, time, is_checked, last_error}]"""
+        rows = self._conn().execute(
+            "SELECT date, drug_name, time, is_checked, last_error FROM pending_checks"
+            " WHERE user_id = ? AND failed = 1 ORDER BY date, drug_name, time", (user_id,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def retry_failed(self, user_id):
+        """보류된 체크를 다시 전송 대기열로"""
+        self._conn().execute(
+            "UPDATE pending_checks SET failed = 0, attempts = 0, next_try = 0 WHERE user_id = ? AND failed = 1",
+            (user_id,)
+        )
+        self._wakeup.set()
+
+    def discard_failed(self, user_id):
+        """보류된 체크 버리기 (서버 값이 유지됨, 화면은 기록을 다시 불러와 맞춤)"""
+        self._conn().execute("DELETE FROM pending_checks WHERE user_id = ? AND failed = 1", (user_id,))
+
+
+@st.cache_resource
+def get_check_outbox():
+    """프로세스당 1개의 체크 큐 (전송 스레드 시작 포함)"""
+    return CheckOutbox().start()
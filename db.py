@@ -1,7 +1,19 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from supabase import create_client, Client
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import inspect
+import threading
+import time
 import uuid
 
+# 세션 읽기 캐시 유효 시간(초). 이 세션의 쓰기는 즉시 반영되고, TTL은 다른 기기/작업자의 변경 반영 주기
+try:
+    CACHE_TTL_SEC = float(st.secrets.get("db_cache_ttl_sec", 300))
+except Exception:
+    CACHE_TTL_SEC = 300.0
+
 # Supabase 초기화 함수
 # secrets.toml 파일에 SUPABASE_URL과 SUPABASE_KEY가 있어야 합니다.
 @st.cache_resource
@@ -14,6 +26,158 @@ def init_supabase() -> Client:
         st.error(f"Supabase 연결 오류: secrets.toml 설정을 확인해주세요. ({e})")
         return None
 
+# --- 세션 읽기 캐시 (Read-through) ---
+# 리런마다 같은 조회를 반복하지 않도록 st.session_state에 결과 보관 -> 변화 없는 리런은 네트워크 0회
+# 키: (이름, user_id, 나머지 인자...). 쓰기 함수가 해당 사용자 키를 무효화하거나 제자리에서 고침
+# 조회 실패(_read_failed)로 돌려준 대체값([], None 등)은 캐시하지 않음 -> 다음 리런에서 다시 조회
+
+_read_state = threading.local()
+
+def _read_failed(message):
+    """
+    조회 실패 기록 (except 분기에서 대체값을 반환하기 전에 호출). 기록된 호출 결과는 캐시하지 않음
+    메시지는 스크립트 스레드에서 st.error로 표시 (페이지 로드 풀 스레드에서는 st.error가 화면에 나오지 않으므로)
+    """
+    print(f"[WARN] {message}")
+    errors = getattr(_read_state, "errors", None)
+    if errors is not None: errors.append(message)
+
+def _show_read_errors(errors):
+    """조회 실패 메시지를 화면에 표시 (스크립트 스레드에서만, 같은 메시지는 한 번)"""
+    if get_script_run_ctx(suppress_warning=True) is None: return
+    for message in dict.fromkeys(errors):
+        st.error(message)
+
+def _call_tracked(func, args, kwargs=None):
+    """func 실행 -> (결과, 실패 메시지 목록). 안쪽 호출의 실패는 바깥 호출에도 전달 (예: KPI 대체 경로의 리포트 조회)"""
+    outer = getattr(_read_state, "errors", None)
+    errors = _read_state.errors = []
+    try:
+        return func(*args, **(kwargs or {})), errors
+    finally:
+        _read_state.errors = outer
+        if outer is not None: outer.extend(errors)
+
+def _session_cache():
+    """현재 세션의 캐시 dict (작업자 스레드 / CLI 등 Streamlit 세션 밖에서는 None -> 캐시 안 함)"""
+    if get_script_run_ctx(suppress_warning=True) is None: return None
+    return st.session_state.setdefault("_db_cache", {})
+
+def _cache_key(name, func, args, kwargs):
+    """같은 호출이면 위치/키워드 인자 형태와 상관없이 같은 키 (기본값 포함)"""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return (name, *bound.arguments.values())
+
+def _cache_get(cache, key):
+    hit = cache.get(key)
+    if hit is not None and time.time() - hit[0] < CACHE_TTL_SEC:
+        return True, hit[1]
+    return False, None
+
+def _session_cached(name):
+    """첫 번째 인자가 user_id인 조회 함수에 세션 캐시 적용 (원본 함수는 .uncached)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = _session_cache()
+            if cache is None: return func(*args, **kwargs)
+            key = _cache_key(name, func, args, kwargs)
+            hit, value = _cache_get(cache, key)
+            if hit: return value
+            value, errors = _call_tracked(func, args, kwargs)
+            if not errors: cache[key] = (time.time(), value)
+            elif getattr(_read_state, "errors", None) is None:
+                _show_read_errors(errors)  # 가장 바깥 호출에서만 표시 (안쪽 실패는 바깥으로 전달됨)
+            return value
+        wrapper.cache_name = name
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+def _cached_value(user_id, name):
+    """캐시에 들어 있는 user_id의 name 조회 결과 (없으면 None)"""
+    cache = _session_cache()
+    hit = (cache or {}).get((name, user_id))
+    return hit[1] if hit is not None else None
+
+def invalidate(user_id, *names):
+    """user_id의 캐시 항목 삭제 (names 생략 시 전체)"""
+    cache = _session_cache()
+    if not cache: return
+    for key in [k for k in cache if k[1] == user_id and (not names or k[0] in names)]:
+        del cache[key]
+
+# 리포트가 새로 저장되면 바뀌는 조회들
+REPORT_CACHE_NAMES = ("latest_report", "user_reports", "report_kpis", "stage_latency", "analysis_stats")
+
+# --- 페이지 로드 동시 조회 (Snapshot) ---
+PAGE_LOAD_WORKERS = 4
+
+@st.cache_resource
+def _page_load_pool():
+    return ThreadPoolExecutor(max_workers=PAGE_LOAD_WORKERS, thread_name_prefix="db-page-load")
+
+def _page_load_call(label, func, args):
+    """풀 스레드에서 조회 1건 실행 -> (결과, 실패 메시지 목록). 예외도 실패로 돌려줌 (결과 None)"""
+    try:
+        return _call_tracked(func, args)
+    except Exception as e:
+        print(f"[WARN] {label} 조회 실패: {e}")
+        return None, [f"{label} 조회 실패: {e}"]
+
+def fetch_concurrently(calls):
+    """
+    서로 독립인 조회를 동시에 실행 -> {이름: 결과}
+    calls: {이름: (함수, 인자...)}. 세션 캐시 조회 함수면 캐시에 있는 것은 그대로 쓰고,
+    없는 것만 스레드 풀에서 실행한 뒤 (스크립트 스레드에서) 캐시에 저장
+    실패는 작업 스레드에서 모아 스크립트 스레드에서 st.error로 표시 (예외가 난 조회의 결과는 None)
+    """
+    cache = _session_cache()
+    results, pending = {}, {}
+    for label, (func, *args) in calls.items():
+        name = getattr(func, "cache_name", None)
+        if name is not None and cache is not None:
+            key = _cache_key(name, func.uncached, args, {})
+            hit, value = _cache_get(cache, key)
+            if hit:
+                results[label] = value
+                continue
+            pending[label] = (func.uncached, args, key)
+        else:
+            pending[label] = (getattr(func, "uncached", func), args, None)
+
+    failed = {}
+    if len(pending) == 1:  # 1건이면 스레드 전환 없이
+        label, (func, args, key) = next(iter(pending.items()))
+        results[label], failed[label] = _page_load_call(label, func, args)
+    elif pending:
+        pool = _page_load_pool()
+        futures = {label: pool.submit(_page_load_call, label, func, args)
+                   for label, (func, args, key) in pending.items()}
+        for label, fut in futures.items():
+            results[label], failed[label] = fut.result()
+
+    # 실패한 조회의 대체값은 캐시하지 않고, 실패 내용은 여기(스크립트 스레드)에서 표시
+    for label, (func, args, key) in pending.items():
+        if key is not None and not failed[label]: cache[key] = (time.time(), results[label])
+    _show_read_errors([m for label in pending for m in failed[label]])
+    return results
+
+def load_page_snapshot(user_id, dashboard=False, case_id=None, extra=None):
+    """
+    페이지 로드에 필요한 조회를 한 번에 (캐시에 없는 것만 동시에, 첫 로드도 왕복 1회 수준)
+    - 복약 비서: {"medicines", "latest_report"} (case_id: 선택한 처방전, None이면 전체의 최신)
+    - 대시보드: {"report_kpis", "stage_latency"}
+    - extra: {이름: (함수, 인자...)} 함께 실행할 조회 (예: 복용 기록 동기화)
+    """
+    if dashboard:
+        calls = {"report_kpis": (get_report_kpis, user_id), "stage_latency": (get_stage_latency_stats, user_id)}
+    else:
+        calls = {"medicines": (get_medicines, user_id), "latest_report": (load_latest_report, user_id, case_id)}
+    calls.update(extra or {})
+    return fetch_concurrently(calls)
+
 # --- 사용자 관리 ---
 
 def get_user_id():
@@ -40,6 +204,7 @@ def get_user_id():
 
 # --- 약물 관리 (Medicines) ---
 
+@_session_cached("medicines")
 def get_medicines(user_id):
     """사용자의 모든 약물 정보 가져오기"""
     supabase = init_supabase()
@@ -49,30 +214,34 @@ def get_medicines(user_id):
         response = supabase.table("medicines").select("*").eq("user_id", user_id).execute()
         return response.data
     except Exception as e:
-        st.error(f"데이터 조회 실패: {e}")
+        _read_failed(f"데이터 조회 실패: {e}")
         return []
 
+def _medicine_row(user_id, drug_data, case_id=None):
+    """약물 dict -> medicines 테이블 행"""
+    return {
+        "user_id": user_id,
+        "case_id": case_id,
+        "name": drug_data.get("name"),
+        "days": int(drug_data.get("days", 3)),
+        "start_date": drug_data.get("start_date").strftime("%Y-%m-%d"), # Date -> String
+        "color": drug_data.get("color"),
+        "time": drug_data.get("time"),
+        "efficacy": drug_data.get("efficacy"),
+        "usage": drug_data.get("usage"),
+        "info": drug_data.get("info"),
+        "food": drug_data.get("food")
+    }
+
 def add_medicine(user_id, drug_data, case_id=None):
     """약물 추가 (case_id 포함)"""
     supabase = init_supabase()
     if not supabase: return False
 
     try:
-        # 데이터 정리
-        payload = {
-            "user_id": user_id,
-            "case_id": case_id,
-            "name": drug_data.get("name"),
-            "days": int(drug_data.get("days", 3)),
-            "start_date": drug_data.get("start_date").strftime("%Y-%m-%d"), # Date -> String
-            "color": drug_data.get("color"),
-            "time": drug_data.get("time"),
-            "efficacy": drug_data.get("efficacy"),
-            "usage": drug_data.get("usage"),
-            "info": drug_data.get("info"),
-            "food": drug_data.get("food")
-        }
+        payload = _medicine_row(user_id, drug_data, case_id)
         supabase.table("medicines").insert(payload).execute()
+        invalidate(user_id, "medicines")
         return True
     except Exception as e:
         st.error(f"약물 추가 실패: {e}")
@@ -89,6 +258,7 @@ def delete_medicine(user_id, drug_name):
         # 관련된 체크 기록도 삭제할지 여부는 정책 나름 (Foreign Key 설정 없으면 수동 삭제 권장)
         supabase.table("check_history").delete().eq("user_id", user_id).eq("drug_name", drug_name).execute()
         
+        invalidate(user_id, "medicines")
         return True
     except Exception as e:
         st.error(f"삭제 실패: {e}")
@@ -96,43 +266,77 @@ def delete_medicine(user_id, drug_name):
 
 # --- 복용 기록 (History) ---
 
-def load_history(user_id):
-    """체크리스트 기록 로드 -> {(날짜, 약이름, 시간): True} (시간 포함)"""
+def _history_key(row):
+    t_val = row.get('time', '기본') or '기본'
+    return (row['date'], row['drug_name'], t_val)
+
+def _date_str(d):
+    return d if isinstance(d, str) else d.strftime("%Y-%m-%d")
+
+def _history_query(supabase, user_id, start_date=None, end_date=None):
+    query = supabase.table("check_history").select("*").eq("user_id", user_id)
+    if start_date is not None: query = query.gte("date", _date_str(start_date))
+    if end_date is not None: query = query.lte("date", _date_str(end_date))
+    return query
+
+def load_history(user_id, start_date=None, end_date=None):
+    """체크리스트 기록 로드 -> {(날짜, 약이름, 시간): True} (시간 포함)
+    start_date / end_date: 지정하면 그 기간(양 끝 포함)의 기록만 조회 (달력에 보이는 범위)
+    """
     supabase = init_supabase()
     if not supabase: return {}
     
     try:
-        response = supabase.table("check_history").select("*").eq("user_id", user_id).execute()
+        response = _history_query(supabase, user_id, start_date, end_date).execute()
         
         history_dict = {}
         for row in response.data:
-            t_val = row.get('time', '기본') or '기본'
-            key = (row['date'], row['drug_name'], t_val)
-            history_dict[key] = row['is_checked']
+            history_dict[_history_key(row)] = row['is_checked']
         return history_dict
     except Exception as e:
         # st.error(f"기록 조회 실패: {e}") # 로그 너무 많이 찍히면 시끄러움
         return {}
 
-def toggle_check(user_id, date_str, drug_name, time_val, is_checked):
-    """복용 체크 상태 토글 (Upsert: time 구분 포함)"""
+def sync_history(user_id, history, since=None, start_date=None, end_date=None):
+    """
+    체크 기록 증분 동기화: since(updated_at) 이후 바뀐 행만 받아 history dict를 제자리에서 갱신
+    - 반환: 다음 호출에 넘길 since (받은 행 중 가장 늦은 updated_at, 없으면 그대로)
+    - since가 None이면 기간 전체를 받아 채움 (첫 로드, 또는 updated_at 컬럼이 없는 DB)
+      -> updated_at 컬럼/트리거는 supabase/check_history_sync.sql
+    - 약물 삭제로 지워진 기록은 반영되지 않음 (해당 약물이 목록에서 사라지므로 표시에 영향 없음)
+    - 조회 실패는 예외로 올려 보냄 -> 호출 측이 동기화 시각을 갱신하지 않고 다음 리런에서 재시도
+    """
     supabase = init_supabase()
-    if not supabase: return
-    
-    try:
-        payload = {
-            "user_id": user_id,
-            "date": date_str,
-            "drug_name": drug_name,
-            "time": time_val,
-            "is_checked": is_checked
-        }
-        # Unique Key가 (user_id, date, drug_name, time)으로 변경됨
-        supabase.table("check_history").upsert(payload, on_conflict="user_id, date, drug_name, time").execute()
-    except Exception as e:
-        st.error(f"체크 저장 실패: {e}")
+    if not supabase: return since
+
+    query = _history_query(supabase, user_id, start_date, end_date)
+    if since is not None:
+        # 같은 시각에 커밋된 행을 놓치지 않도록 gte (다시 받아도 덮어쓰기라 무해)
+        query = query.gte("updated_at", since)
+    response = query.execute()
+
+    for row in response.data:
+        history[_history_key(row)] = row['is_checked']
+        stamp = row.get('updated_at')
+        if stamp and (since is None or stamp > since):
+            since = stamp
+    return since
+
+def upsert_checks(rows):
+    """
+    복용 체크 여러 건을 upsert 1회로 저장 (check_outbox의 일괄 전송용)
+    rows: [{user_id, date, drug_name, time, is_checked}, ...] (같은 키는 1건만)
+    실패는 예외로 올려 보냄 -> 호출 측(check_outbox)이 보관해 두었다가 재시도
+    """
+    supabase = init_supabase()
+    if not supabase: raise RuntimeError("Supabase 연결 없음")
+    if not rows: return 0
+    # Unique Key가 (user_id, date, drug_name, time)으로 변경됨
+    supabase.table("check_history").upsert(rows, on_conflict="user_id, date, drug_name, time").execute()
+    return len(rows)
 
 # --- 리포트 저장 (Report) ---
+@_session_cached("user_reports")
 def get_user_reports(user_id):
     """사용자의 모든 리포트 이력 조회"""
     supabase = init_supabase()
@@ -142,7 +346,7 @@ def get_user_reports(user_id):
         res = supabase.table("reports").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
         return res.data
     except Exception as e:
-        print(f"리포트 조회 실패: {e}")
+        _read_failed(f"리포트 조회 실패: {e}")
         return []
 
 def save_report(user_id, report_data, case_id=None):
@@ -157,9 +361,91 @@ def save_report(user_id, report_data, case_id=None):
             "case_id": case_id,
             "report_json": report_data  # JSONB 컬럼 권장
         }).execute()
+        invalidate(user_id, *REPORT_CACHE_NAMES)
     except Exception as e:
         st.error(f"리포트 저장 실패: {e}")
 
+def _missing_object(e):
+    """PostgREST: 뷰/테이블(PGRST205, 42P01) 또는 함수(PGRST202)가 없음"""
+    msg = str(e)
+    return any(code in msg for code in ("PGRST202", "PGRST205", "42P01", "Could not find"))
+
+def row_rejected(e):
+    """PostgREST: 보낸 행 자체가 거부됨 (데이터 형식 22xxx / 제약·FK 위반 23xxx / RLS 42501)
+    -> 같은 요청의 다른 행은 저장될 수 있음. 연결 오류 / 5xx / 비JSON 응답은 False"""
+    code = str(getattr(e, "code", "") or "")
+    return code.startswith(("22", "23")) or code == "42501"
+
+# save_case RPC(supabase/save_case.sql) 배포 여부. 없으면 첫 호출 실패 후 일괄 insert 방식으로 전환
+_save_case_rpc = True
+
+def save_case(user_id, medicines, report_data, case_id, replace=False):
+    """
+    처방전 1건(약물 여러 개 + 리포트) 일괄 저장 -> {"saved", "round_trips", "via", "error"?}
+    - RPC save_case: 같은 case_id의 기존 약물/리포트를 지우고 한 트랜잭션으로 저장 (왕복 1회)
+    - RPC가 없으면: 약물 일괄 insert 1회 + 리포트 insert 1회 (왕복 2회),
+      리포트 저장이 실패하면 방금 넣은 약물을 지워 반쪽 저장을 남기지 않음
+      replace=True(작업 재실행)면 먼저 같은 case_id의 약물/리포트를 지움 (왕복 +2)
+    """
+    global _save_case_rpc
+    result = {"saved": 0, "round_trips": 0, "via": None}
+    supabase = init_supabase()
+    if not supabase:
+        result["error"] = "Supabase 연결 없음"
+        return result
+
+    rows = [_medicine_row(user_id, m, case_id) for m in medicines]
+
+    if _save_case_rpc:
+        result.update(via="rpc", round_trips=1)
+        try:
+            res = supabase.rpc("save_case", {
+                "p_user_id": user_id,
+                "p_case_id": case_id,
+                "p_medicines": rows,
+                "p_report": report_data,
+            }).execute()
+            result["saved"] = res.data if isinstance(res.data, int) else len(rows)
+            invalidate(user_id, "medicines", *REPORT_CACHE_NAMES)
+            return result
+        except Exception as e:
+            # 함수 없음 -> 이후로는 일괄 insert 사용 (그 외 오류는 그대로 실패 처리)
+            if not _missing_object(e):
+                st.error(f"처방전 저장 실패: {e}")
+                result["error"] = str(e)
+                return result
+            _save_case_rpc = False
+
+    result["via"] = "bulk"
+    try:
+        if replace:
+            result["round_trips"] += 2
+            supabase.table("medicines").delete().eq("user_id", user_id).eq("case_id", case_id).execute()
+            supabase.table("reports").delete().eq("user_id", user_id).eq("case_id", case_id).execute()
+        if rows:
+            result["round_trips"] += 1
+            supabase.table("medicines").insert(rows).execute()
+        if report_data is not None:
+            result["round_trips"] += 1
+            try:
+                supabase.table("reports").insert({
+                    "user_id": user_id,
+                    "case_id": case_id,
+                    "report_json": report_data
+                }).execute()
+            except Exception:
+                if rows:
+                    result["round_trips"] += 1
+                    supabase.table("medicines").delete().eq("user_id", user_id).eq("case_id", case_id).execute()
+                raise
+        result["saved"] = len(rows)
+        invalidate(user_id, "medicines", *REPORT_CACHE_NAMES)
+    except Exception as e:
+        st.error(f"처방전 저장 실패: {e}")
+        result["error"] = str(e)
+    return result
+
+@_session_cached("latest_report")
 def load_latest_report(user_id, case_id=None):
     """가장 최근 리포트 불러오기 (case_id 옵션)"""
     supabase = init_supabase()
@@ -178,12 +464,118 @@ def load_latest_report(user_id, case_id=None):
             return response.data[0]['report_json']
         return None
     except Exception as e:
+        _read_failed(f"리포트 조회 실패: {e}")
         return None
 
+# --- 대시보드 집계 (Server-side Aggregation) ---
+# supabase/report_stats.sql 배포 여부. 없으면 첫 호출 실패 후 report_json을 받아 직접 계산
+_report_stats_sql = True
+
+def _report_meta(report_json):
+    return (report_json or {}).get('meta_analysis', {})
+
+def _report_kpi_row(row):
+    """reports 행 -> report_kpis 뷰와 같은 KPI 행 (뷰가 없을 때)"""
+    meta = _report_meta(row.get('report_json'))
+    kpis = meta.get('kpis', {})
+    ds = meta.get('data_sources', {})
+    metrics = meta.get('pipeline', meta.get('pipeline_metrics', {}))
+    return {
+        "id": row.get('id'),
+        "created_at": row.get('created_at'),
+        "case_id": meta.get('case_id', row.get('case_id') or 'unknown'),
+        "quality_score": meta.get('quality_score', 0),
+        "ocr_success": metrics.get('ocr', {}).get('success', False),
+        "api_success_rate": kpis.get('api_success_rate', kpis.get('search_success_rate', 0)), # Fallback for backward compatibility
+        "mfds_coverage": ds.get('coverage_pct', 0),
+        "latency_ms": kpis.get('total_latency_ms', 0),
+        "ttfc_ms": kpis.get('time_to_first_content_ms'),
+        "retry_count": metrics.get('api', {}).get('retry_count', 0),
+        "risk_level": meta.get('risk_level', 'Unknown'),
+        "interaction_count": meta.get('safety_summary', {}).get('interaction_count', 0),
+        "has_warning": meta.get('safety_summary', {}).get('has_warning', False),
+    }
+
+def _percentile(values, q):
+    """선형 보간 백분위 (Postgres percentile_cont / pandas quantile과 같은 값)"""
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+@_session_cached("report_kpis")
+def get_report_kpis(user_id):
+    """대시보드 케이스 목록용 KPI 행 (최신순). report_json 본문은 get_report로 1건만 조회"""
+    global _report_stats_sql
+    supabase = init_supabase()
+    if not supabase: return []
+
+    if _report_stats_sql:
+        try:
+            res = supabase.table("report_kpis").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
+            return res.data
+        except Exception as e:
+            if not _missing_object(e):
+                _read_failed(f"리포트 KPI 조회 실패: {e}")
+                return []
+            _report_stats_sql = False
+
+    return [_report_kpi_row(r) for r in get_user_reports(user_id)]
+
+@_session_cached("report")
+def get_report(user_id, report_id):
+    """리포트 1건의 report_json (대시보드 상세 보기)"""
+    supabase = init_supabase()
+    if not supabase: return None
+    try:
+        res = supabase.table("reports").select("report_json").eq("user_id", user_id).eq("id", report_id).limit(1).execute()
+        return res.data[0]['report_json'] if res.data else None
+    except Exception as e:
+        _read_failed(f"리포트 조회 실패: {e}")
+        return None
+
+@_session_cached("stage_latency")
+def get_stage_latency_stats(user_id):
+    """전체 리포트 기준 단계(span)별 지연 -> [{"stage", "p50", "p95", "n"}]"""
+    global _report_stats_sql
+    supabase = init_supabase()
+    if not supabase: return []
+
+    if _report_stats_sql:
+        try:
+            return supabase.rpc("report_stage_latency", {"p_user_id": user_id}).execute().data or []
+        except Exception as e:
+            if not _missing_object(e):
+                _read_failed(f"단계별 지연 집계 실패: {e}")
+                return []
+            _report_stats_sql = False
+
+    durations = {}
+    for r in get_user_reports(user_id):
+        meta = _report_meta(r.get('report_json'))
+        trace = meta.get('pipeline', meta.get('pipeline_metrics', {})).get('trace') or {}
+        for s in trace.get('spans', []):
+            if s.get('duration_ms') is None: continue  # 직렬화 시점에 열려 있던 span
+            durations.setdefault(s['name'], []).append(s['duration_ms'])
+    return [{"stage": name, "p50": _percentile(v, 0.5), "p95": _percentile(v, 0.95), "n": len(v)}
+            for name, v in durations.items()]
+
+@_session_cached("analysis_stats")
 def get_analysis_stats(user_id):
-    """대시보드용 통계 데이터 추출"""
+    """대시보드용 통계 데이터 추출 (analysis_stats RPC, 없으면 report_json을 받아 직접 계산)"""
+    global _report_stats_sql
     supabase = init_supabase()
     if not supabase: return {}
+
+    if _report_stats_sql:
+        try:
+            return supabase.rpc("analysis_stats", {"p_user_id": user_id}).execute().data or {}
+        except Exception as e:
+            if not _missing_object(e):
+                _read_failed(f"통계 집계 실패: {e}")
+                return {}
+            _report_stats_sql = False
     
     try:
         # 모든 리포트의 report_json 가져오기
@@ -195,18 +587,18 @@ def get_analysis_stats(user_id):
         quality_issues = 0
         
         for row in response.data:
-            meta = row['report_json'].get('meta_analysis', {})
+            meta = _report_meta(row['report_json'])
             
             # Risk Count
             r_level = meta.get('risk_level', 'Low')
             if r_level in risks: risks[r_level] += 1
             
-            # Interaction Count
-            interactions += int(meta.get('interaction_count', 0))
+            # Interaction Count (구버전: meta 최상위 / 현재: safety_summary)
+            interactions += int(meta.get('interaction_count', meta.get('safety_summary', {}).get('interaction_count', 0)))
             
-            # Quality Checks (예: flag가 false면 issue)
+            # Quality Checks (예: flag가 false면 issue / 현재 스키마: 식약처 미검증 약물 존재)
             flags = meta.get('quality_flags', {})
-            if not flags.get('api_match_success', True):
+            if not flags.get('api_match_success', True) or meta.get('case_summary', {}).get('unverified_drugs', 0) > 0:
                  quality_issues += 1
                  
         return {
@@ -216,6 +608,7 @@ def get_analysis_stats(user_id):
             "quality_issues": quality_issues
         }
     except Exception as e:
+        _read_failed(f"통계 집계 실패: {e}")
         return {}
 
 def update_medicines_start_date(user_id, updates):
@@ -247,6 +640,11 @@ def update_medicines_start_date(user_id, updates):
                     .eq("user_id", user_id) \
                     .eq("name", name) \
                     .execute()
+
+        # 캐시된 약물 목록은 다시 조회하지 않고 제자리에서 수정
+        for med in _cached_value(user_id, "medicines") or []:
+            if med.get("name") in updates:
+                med["start_date"] = _date_str(updates[med["name"]])
         return True
     except Exception as e:
         st.error(f"날짜 수정 실패: {e}")
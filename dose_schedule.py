@@ -0,0 +1,99 @@
+# dose_schedule.py
+"""
+복용 일정 색인 (약물 x 날짜 단위 복용 이벤트를 미리 펼쳐 둔 것)
+- 약물 목록이 바뀔 때(추가 / 삭제 / 시작일 변경)만 다시 만들고, 리런마다 다시 펼치지 않음
+- 날짜 문자열("YYYY-MM-DD") 색인 + 정렬된 날짜 목록 -> 달력은 기간 조회, 체크리스트는 하루 조회
+- 이벤트마다 체크된 복용 시간 수를 들고 있어 "모두 복용(all_checked)"은 비교 한 번
+  (체크 토글 / 기록 동기화 시 set_checked / recount로 갱신)
+"""
+import bisect
+import datetime
+
+
+def parse_time_slots(time_text):
+    """"아침, 저녁" -> ["아침", "저녁"] (비어 있으면 ["기본"], db.load_history와 같은 규칙)"""
+    slots = [t.strip() for t in (time_text or '').split(',') if t.strip()]
+    return slots or ['기본']
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+    return value
+
+
+def fingerprint(medicines):
+    """일정에 영향을 주는 필드만 모은 값 (같으면 색인 재사용)"""
+    return tuple(
+        (m.get('id'), m.get('case_id', 'Unknown'), m.get('name'), str(m.get('start_date')), m.get('days'),
+         m.get('time'), m.get('color'))
+        for m in medicines
+    )
+
+
+class DoseSchedule:
+    """약물 목록 -> 날짜별 복용 이벤트 색인"""
+
+    def __init__(self, medicines, history=None):
+        self.fingerprint = fingerprint(medicines)
+        self.by_date = {}   # "YYYY-MM-DD" -> [event, ...]
+        self._by_key = {}   # (날짜, 약이름) -> [event, ...] (같은 이름이 여러 처방전에 있을 수 있음)
+
+        for med_index, drug in enumerate(medicines):
+            start = _as_date(drug['start_date'])
+            try:
+                days = int(drug.get('days', 3))
+            except (TypeError, ValueError):
+                days = 3
+            end = start + datetime.timedelta(days=days - 1)
+            slots = parse_time_slots(drug.get('time'))
+
+            for i in range(days):
+                day = start + datetime.timedelta(days=i)
+                event = {
+                    "date": day.isoformat(),
+                    "day": day,
+                    "drug": drug,
+                    "med_index": med_index,
+                    "case_id": drug.get('case_id', 'Unknown'),
+                    "slots": slots,
+                    "days": days,
+                    "remaining": (end - day).days,
+                    "checked": 0,
+                }
+                self.by_date.setdefault(event["date"], []).append(event)
+                self._by_key.setdefault((event["date"], drug['name']), []).append(event)
+
+        self.dates = sorted(self.by_date)
+        if history: self.recount(history)
+
+    def recount(self, history):
+        """체크 기록 전체로 이벤트별 체크 수 다시 계산 (기록 동기화 후)"""
+        for events in self.by_date.values():
+            for event in events:
+                event["checked"] = 0
+        for (date_str, drug_name, slot), checked in history.items():
+            if not checked: continue
+            for event in self._by_key.get((date_str, drug_name), []):
+                if slot in event["slots"]: event["checked"] += 1
+
+    def set_checked(self, date_str, drug_name, slot, checked):
+        """체크 1건 반영 (이전 값과 다를 때만 호출)"""
+        for event in self._by_key.get((date_str, drug_name), []):
+            if slot in event["slots"]: event["checked"] += 1 if checked else -1
+
+    @staticmethod
+    def all_checked(event):
+        return event["checked"] >= len(event["slots"])
+
+    def range(self, start=None, end=None, case_id=None):
+        """start ~ end(양 끝 포함, None이면 끝까지) 이벤트. case_id를 주면 해당 처방전만"""
+        lo = 0 if start is None else bisect.bisect_left(self.dates, _as_date(start).isoformat())
+        hi = len(self.dates) if end is None else bisect.bisect_right(self.dates, _as_date(end).isoformat())
+        for date_str in self.dates[lo:hi]:
+            for event in self.by_date[date_str]:
+                if case_id is None or event["case_id"] == case_id:
+                    yield event
+
+    def on_date(self, day, case_id=None):
+        return list(self.range(day, day, case_id))
@@ -0,0 +1,100 @@
+# image_preprocess.py
+"""
+OCR 업로드 전 이미지 전처리
+- EXIF 회전 보정 -> 긴 변 상한 리사이즈 -> 흑백 + 대비 정규화 -> JPEG 용량 예산 맞춤
+- 휴대폰 원본(4000x3000, 수 MB)을 그대로 올리면 모바일 망에서 OCR 지연의 대부분이 업로드 시간이 됨
+"""
+import io
+import time
+
+import PIL.Image
+from PIL import ImageOps
+import streamlit as st
+
+# 설정 (secrets.toml 최상위 키, 모두 선택)
+try:
+    MAX_LONG_EDGE = int(st.secrets.get("ocr_max_long_edge", 1600))
+    JPEG_QUALITY = int(st.secrets.get("ocr_jpeg_quality", 85))
+    MAX_BYTES = int(st.secrets.get("ocr_max_bytes", 600_000))
+    GRAYSCALE = bool(st.secrets.get("ocr_grayscale", True))
+except Exception:
+    MAX_LONG_EDGE = 1600
+    JPEG_QUALITY = 85
+    MAX_BYTES = 600_000
+    GRAYSCALE = True
+
+MIN_JPEG_QUALITY = 50   # 이보다 낮추면 작은 글씨(용량 표기 등)가 뭉개짐
+MIN_LONG_EDGE = 800     # 용량 예산을 맞추려 줄이더라도 이 이하로는 축소하지 않음
+PREPROCESS_VERSION = 1  # 전처리 코드(회전/대비/인코딩 방식)를 바꾸면 올림 -> OCR 캐시 무효화
+
+
+def settings_signature():
+    """전처리 결과에 영향을 주는 설정 문자열 (ocr.py OCR 캐시 키에 포함)"""
+    return (f"v{PREPROCESS_VERSION}|{MAX_LONG_EDGE}|{JPEG_QUALITY}|{MAX_BYTES}|{int(GRAYSCALE)}"
+            f"|{MIN_JPEG_QUALITY}|{MIN_LONG_EDGE}")
+
+
+def read_image_bytes(image_file):
+    """업로드 파일(UploadedFile/BytesIO) 또는 경로에서 원본 바이트 읽기"""
+    if isinstance(image_file, (bytes, bytearray)):
+        return bytes(image_file)
+    if isinstance(image_file, str):
+        with open(image_file, "rb") as f:
+            return f.read()
+    if hasattr(image_file, "getvalue"):
+        return image_file.getvalue()
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+
+def _encode_jpeg(img, quality):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def preprocess_image(image_file, max_long_edge=None, grayscale=None, jpeg_quality=None, max_bytes=None):
+    """
+    OCR용 이미지 전처리 -> (JPEG 바이트, 통계 dict)
+    통계: bytes_before, bytes_after, size_before, size_after, jpeg_quality, preprocess_ms
+    """
+    max_long_edge = max_long_edge or MAX_LONG_EDGE
+    grayscale = GRAYSCALE if grayscale is None else grayscale
+    quality = jpeg_quality or JPEG_QUALITY
+    max_bytes = max_bytes or MAX_BYTES
+
+    started = time.perf_counter()
+    raw = read_image_bytes(image_file)
+    img = PIL.Image.open(io.BytesIO(raw))
+    size_before = img.size
+
+    # 1. EXIF 회전 보정 (세로로 찍은 사진이 눕혀져 인식되는 문제)
+    img = ImageOps.exif_transpose(img)
+
+    # 2. 긴 변 상한 리사이즈
+    if max(img.size) > max_long_edge:
+        img.thumbnail((max_long_edge, max_long_edge), PIL.Image.LANCZOS)
+
+    # 3. 흑백 + 대비 정규화 (약봉투 글자는 색 정보가 필요 없음)
+    img = img.convert("L") if grayscale else img.convert("RGB")
+    img = ImageOps.autocontrast(img, cutoff=1)
+
+    # 4. JPEG 용량 예산: 품질 -> 해상도 순으로 낮춤
+    data = _encode_jpeg(img, quality)
+    while len(data) > max_bytes and quality > MIN_JPEG_QUALITY:
+        quality = max(MIN_JPEG_QUALITY, quality - 10)
+        data = _encode_jpeg(img, quality)
+    while len(data) > max_bytes and max(img.size) * 0.85 >= MIN_LONG_EDGE:
+        img = img.resize((int(img.width * 0.85), int(img.height * 0.85)), PIL.Image.LANCZOS)
+        data = _encode_jpeg(img, quality)
+
+    stats = {
+        "bytes_before": len(raw),
+        "bytes_after": len(data),
+        "size_before": list(size_before),
+        "size_after": list(img.size),
+        "jpeg_quality": quality,
+        "preprocess_ms": int((time.perf_counter() - started) * 1000),
+    }
+    return data, stats
@@ -1,11 +1,71 @@
 import json
 import os
+from collections import deque
 import streamlit as st
 
+
+class KeywordAutomaton:
+    """
+    규칙 키워드 전체를 한 번에 찾는 Aho-Corasick 다중 패턴 매칭기.
+    약물명을 한 번만 훑으면(길이에 선형) 규칙 수와 무관하게 포함된 키워드를 모두 찾습니다.
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]    # 상태별 전이 테이블 {문자: 다음 상태}
+        self._fail = [0]     # 실패 링크
+        self._output = [()]  # 상태에서 끝나는 키워드들 (실패 링크 출력 포함)
+
+        for k in keywords:
+            if k: self._add(k)
+        self._build_links()
+
+    def _add(self, keyword):
+        state = 0
+        for ch in keyword:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][ch] = nxt
+            state = nxt
+        if keyword not in self._output[state]:
+            self._output[state] = self._output[state] + (keyword,)
+
+    def _build_links(self):
+        # BFS로 실패 링크 계산 (루트 자식은 루트로)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find_all(self, text):
+        """text에 포함된 키워드 집합 반환"""
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            if self._output[state]:
+                found.update(self._output[state])
+        return found
+
+
 @st.cache_resource
 def load_drug_rules(rule_path='data/drug_rules.json'):
     """
-    약물 상호작용 규칙 데이터(JSON)를 로드합니다.
+    약물 상호작용 규칙 데이터(JSON)를 로드하고 키워드 매칭기를 함께 만듭니다.
+    반환: (rules, automaton, keyword_index)
+      - keyword_index: {키워드: [(규칙 번호, 규칙 내 키워드 순서), ...]}
     """
     # 절대 경로 계산
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,16 +73,25 @@ def load_drug_rules(rule_path='data/drug_rules.json'):
     
     if not os.path.exists(full_path):
         # print(f"[ERROR] Interaction rules not found: {full_path}")
-        return []
+        return [], None, {}
     
     try:
         with open(full_path, 'r', encoding='utf-8') as f:
             rules = json.load(f)
             # print(f"[DEBUG] {len(rules)} interaction rules loaded.")
-            return rules
     except Exception as e:
         print(f"[ERROR] Failed to load rules: {e}")
-        return []
+        return [], None, {}
+
+    # [Index] 키워드 -> 규칙 ID 역색인
+    keyword_index = {}
+    for rule_id, rule in enumerate(rules):
+        for pos, k in enumerate(rule.get('keywords', [])):
+            if k:
+                keyword_index.setdefault(k, []).append((rule_id, pos))
+
+    automaton = KeywordAutomaton(keyword_index.keys())
+    return rules, automaton, keyword_index
 
 def check_interactions(drug_list_json):
     """
@@ -30,12 +99,13 @@ def check_interactions(drug_list_json):
     [출력] 발견된 위험 상호작용 리스트 (문자열 리스트)
     
     RAG 로직:
-    1. 로컬 규칙(drug_rules.json)을 로드
-    2. 입력 약물명에 규칙의 키워드가 포함되는지 검사
-    3. 매칭되면 해당 메시지를 수집하여 반환
+    1. 로컬 규칙(drug_rules.json)과 키워드 매칭기를 로드
+    2. 약물명을 한 번 훑어 포함된 키워드를 모두 찾음 (Aho-Corasick)
+    3. 키워드 역색인으로 매칭된 규칙의 메시지를 수집하여 반환
     """
-    rules = load_drug_rules()
+    rules, automaton, keyword_index = load_drug_rules()
     found_warnings = []
+    seen = set()
     
     if not rules:
         return []
@@ -46,19 +116,23 @@ def check_interactions(drug_list_json):
     for drug in target_drugs:
         drug_name = drug.get('corrected_medicine_name', '') or drug.get('medicine_name', '')
         
-        for rule in rules:
-            keywords = rule.get('keywords', [])
+        # 예: "아스피린프로텍트정" 안에 "아스피린"이 있으면 매칭
+        # 규칙별로 키워드 목록에서 가장 앞선 키워드 하나만 사용 (기존 동작 유지)
+        hit_rules = {}
+        for k in automaton.find_all(drug_name):
+            for rule_id, pos in keyword_index[k]:
+                if rule_id not in hit_rules or pos < hit_rules[rule_id]:
+                    hit_rules[rule_id] = pos
+
+        for rule_id in sorted(hit_rules):
+            rule = rules[rule_id]
+            k = rule['keywords'][hit_rules[rule_id]]
+            # [RAG] 원본 상세 내용을 그대로 반환
+            content = rule.get('original_content', '')
+            msg = f"⚠️ [식약처 상호작용 정보 found] 키워드 '{k}' 관련:\n{content}"
             
-            # 규칙 키워드 중 하나라도 약물명에 포함되면 경고 
-            # 예: "아스피린프로텍트정" 안에 "아스피린"이 있으면 매칭
-            for k in keywords:
-                if k in drug_name:
-                    # [RAG] 원본 상세 내용을 그대로 반환
-                    content = rule.get('original_content', '')
-                    msg = f"⚠️ [식약처 상호작용 정보 found] 키워드 '{k}' 관련:\n{content}"
-                    
-                    if msg not in found_warnings:
-                        found_warnings.append(msg)
-                    break 
+            if msg not in seen:
+                seen.add(msg)
+                found_warnings.append(msg)
                     
     return found_warnings
@@ -0,0 +1,243 @@
+# jobs.py
+"""
+분석 작업 큐 (프로세스 내 작업자 풀 + 로컬 영속 큐)
+- 업로드는 이미지를 큐에 넣고 job_id만 받아 바로 반환 -> Streamlit 스크립트 스레드가 Gemini 응답을 기다리지 않음
+- 큐는 SQLite 파일(data/jobs.sqlite3)에 저장: 사용자가 화면을 떠나도 작업은 계속되고,
+  다시 들어오면 같은 user_id로 진행 상황/결과를 이어서 확인
+- 작업자는 임대(lease) 방식으로 작업을 가져감: 실행 중에는 LEASE_RENEW_SEC마다 임대를 연장하고,
+  프로세스가 죽어 임대가 만료된 작업은 다른 작업자가 다시 가져감 (MAX_ATTEMPTS 초과 시 error)
+- job_id를 처방전 case_id로 사용 -> 재실행한 작업은 먼저 저장된 약물/리포트를 덮어씀 (중복 저장 없음)
+- 진행 단계 문구와 완성된 약물 카드(스트리밍 결과)도 큐에 기록 -> UI가 폴링해서 표시
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import streamlit as st
+
+import pipeline
+
+try:
+    JOBS_PATH = st.secrets.get("jobs_path", os.path.join("data", "jobs.sqlite3"))
+    JOB_WORKERS = int(st.secrets.get("job_workers", 2))
+except Exception:
+    JOBS_PATH = os.path.join("data", "jobs.sqlite3")
+    JOB_WORKERS = 2
+
+JOB_LEASE_SEC = 120          # 임대 기간: 이 시간 동안 연장이 없으면 (프로세스 중단) 다른 작업자가 회수
+LEASE_RENEW_SEC = 30         # 실행 중인 작업의 임대 연장 주기 (오래 걸리는 작업도 회수되지 않도록)
+MAX_ATTEMPTS = 2             # 임대 만료(프로세스 중단)로 인한 재실행 포함 최대 시도 횟수
+POLL_INTERVAL_SEC = 1.0      # 다른 프로세스가 넣은 작업을 확인하는 주기
+RETENTION_SEC = 7 * 86400    # 끝난 작업 보관 기간
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id      TEXT PRIMARY KEY,
+    user_id     TEXT NOT NULL,
+    status      TEXT NOT NULL,           -- queued / running / done / error
+    image       BLOB,                    -- 처리가 끝나면 비움
+    progress    TEXT,                    -- 현재 단계 문구
+    partial     TEXT,                    -- 완성된 약물 카드 JSON 리스트
+    result      TEXT,                    -- {case_id, saved_medicines, quality_score, persist}
+    error       TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    seen        INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, seen);
+"""
+
+
+class JobQueue:
+    """SQLite 영속 큐 + 작업자 스레드 풀"""
+
+    def __init__(self, path=JOBS_PATH, workers=JOB_WORKERS, runner=None):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        self.path = os.path.join(current_dir, path)
+        self.workers = workers
+        # 작업 실행 함수 (기본: pipeline.run, 벤치마크/시험에서 교체 가능)
+        self._runner = runner or pipeline.run
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'error') AND finished_at < ?",
+                     (time.time() - RETENTION_SEC,))
+
+    def _conn(self):
+        """스레드별 연결 (autocommit, 쓰기는 BEGIN IMMEDIATE로 직접 묶음)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # --- 작업자 ---
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(POLL_INTERVAL_SEC)
+                self._wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _claim(self):
+        """대기 중(또는 임대 만료) 작업 1건을 running으로 바꾸고 반환 (없으면 None)"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 임대 만료 + 시도 초과 작업은 실패 처리
+            conn.execute(
+                "UPDATE jobs SET status = 'error', error = '작업이 중단되었습니다 (재시도 초과)', image = NULL,"
+                " finished_at = ? WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                "SELECT job_id, user_id, image, attempts, created_at FROM jobs"
+                " WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, lease_until = ?"
+                    " WHERE job_id = ?", (now, now + JOB_LEASE_SEC, row["job_id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(row) if row is not None else None
+
+    def _update(self, job_id, **fields):
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        self._conn().execute(f"UPDATE jobs SET {cols} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def _renew_lease(self, job_id, attempt, done):
+        """작업이 끝날 때까지 임대 연장 (다른 작업자가 이미 회수한 작업이면 중단)"""
+        while not done.wait(LEASE_RENEW_SEC):
+            renewed = self._conn().execute(
+                "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND status = 'running' AND attempts = ?",
+                (time.time() + JOB_LEASE_SEC, job_id, attempt)
+            ).rowcount
+            if not renewed: break
+
+    def _execute(self, job):
+        job_id = job["job_id"]
+        attempt = job["attempts"] + 1
+        cards = []
+
+        def on_progress(message):
+            self._update(job_id, progress=message)
+
+        def on_drug(item):
+            cards.append({"name": item.get("name"), "efficacy": item.get("efficacy")})
+            self._update(job_id, partial=json.dumps(cards, ensure_ascii=False))
+
+        # [Metric] 큐 대기 시간 / 시도 횟수 (리포트의 pipeline.job 으로 저장)
+        metrics = {"job": {
+            "job_id": job_id,
+            "queue_ms": int((time.time() - job["created_at"]) * 1000),
+            "attempt": attempt,
+        }}
+        done = threading.Event()
+        threading.Thread(target=self._renew_lease, args=(job_id, attempt, done),
+                         name=f"job-lease-{job_id[:8]}", daemon=True).start()
+        try:
+            # 재실행(attempt > 1)이면 이전 시도가 저장한 같은 case_id의 기록을 덮어씀
+            result = self._runner(job["image"], user_id=job["user_id"], persist=True,
+                                  on_progress=on_progress, on_drug=on_drug, metrics=metrics,
+                                  case_id=job_id, replace=attempt > 1)
+        except Exception as e:
+            result = {"status": "error", "error": f"처리 중 오류가 발생했습니다: {e}"}
+        finally:
+            done.set()
+
+        if result.get("status") == "ok":
+            meta = (result.get("report") or {}).get("meta_analysis", {})
+            summary = {"case_id": result.get("case_id"), "saved_medicines": result.get("saved_medicines", 0),
+                       "quality_score": meta.get("quality_score"), "persist": result.get("persist")}
+            self._update(job_id, status="done", result=json.dumps(summary, ensure_ascii=False),
+                         image=None, finished_at=time.time(), lease_until=None)
+        else:
+            self._update(job_id, status="error", error=result.get("error"), image=None,
+                         finished_at=time.time(), lease_until=None)
+
+    # --- UI용 ---
+    def submit(self, user_id, image_bytes):
+        """이미지를 큐에 넣고 job_id 반환 (즉시 반환)"""
+        job_id = str(uuid.uuid4())
+        self._conn().execute(
+            "INSERT INTO jobs (job_id, user_id, status, image, progress, created_at)"
+            " VALUES (?, ?, 'queued', ?, ?, ?)",
+            (job_id, user_id, sqlite3.Binary(image_bytes), "⏳ 분석 대기 중...", time.time())
+        )
+        self._wakeup.set()
+        return job_id
+
+    def _row_to_job(self, row):
+        job = dict(row)
+        job.pop("image", None)
+        job["partial"] = json.loads(job["partial"]) if job.get("partial") else []
+        job["result"] = json.loads(job["result"]) if job.get("result") else None
+        return job
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            "SELECT job_id, user_id, status, progress, partial, result, error, attempts, created_at,"
+            " started_at, finished_at FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def pending_for_user(self, user_id):
+        """화면에 보여줄 작업: 진행 중이거나, 끝났지만 아직 사용자가 확인하지 않은 작업 (오래된 순)"""
+        rows = self._conn().execute(
+            "SELECT job_id, user_id, status, progress, partial, result, error, attempts, created_at,"
+            " started_at, finished_at FROM jobs WHERE user_id = ? AND seen = 0 ORDER BY created_at",
+            (user_id,)
+        ).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def acknowledge(self, job_id):
+        """완료/실패 결과를 사용자가 확인함 -> 다음부터 목록에서 제외"""
+        self._update(job_id, seen=1)
+
+    def depth(self):
+        """대기/진행 중 작업 수"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+        ).fetchone()[0]
+
+
+@st.cache_resource
+def get_job_queue():
+    """프로세스당 1개의 작업 큐 (작업자 스레드 시작 포함)"""
+    return JobQueue().start()
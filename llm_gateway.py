@@ -0,0 +1,187 @@
+# llm_gateway.py
+"""
+Gemini 호출 공용 게이트웨이 (ocr.py / care_processor.py 공용)
+- 클라이언트 1회 생성 후 재사용 (st.cache_resource)
+- 호출별 마감 시간(deadline), 동시 호출 상한, 레이트 리밋(429/503) 재시도
+- 호출별 지연 시간 / 입력·출력 토큰 수를 pipeline_metrics["llm"][stage]에 기록
+"""
+import random
+import threading
+import time
+
+import streamlit as st
+from google import genai
+from google.genai import errors, types
+
+import tracing
+
+# =========================================================
+# 1. 설정 (secrets.toml 최상위 키, 모두 선택)
+# =========================================================
+try:
+    MODEL_ID = st.secrets.get("gemini_model", "gemini-3-flash-preview")
+    MAX_CONCURRENCY = int(st.secrets.get("gemini_max_concurrency", 4))
+    DEFAULT_DEADLINE_SEC = float(st.secrets.get("gemini_deadline_sec", 120))
+    MAX_RETRIES = int(st.secrets.get("gemini_max_retries", 3))
+except Exception:
+    MODEL_ID = "gemini-3-flash-preview"
+    MAX_CONCURRENCY = 4
+    DEFAULT_DEADLINE_SEC = 120
+    MAX_RETRIES = 3
+
+# 재시도 대상: 레이트 리밋(429) / 일시 과부하(503)
+RETRYABLE_CODES = (429, 503)
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_metrics_lock = threading.Lock()
+
+
+@st.cache_resource
+def get_client():
+    """Gemini 클라이언트 (프로세스당 1개, API 키 없으면 None)"""
+    try:
+        api_key = st.secrets["gemini_api_key"]
+    except Exception:
+        return None
+    return genai.Client(api_key=api_key)
+
+
+def _record(metrics, stage, entry):
+    if metrics is None: return
+    with _metrics_lock:
+        metrics.setdefault("llm", {})[stage] = entry
+    # [Trace] 대기 + 호출(재시도 포함) 구간을 "llm.<stage>" span으로 기록
+    elapsed_ms = entry["queue_ms"] + entry["latency_ms"]
+    tracing.add_span(metrics, f"llm.{stage}", time.time() - elapsed_ms / 1000, elapsed_ms,
+                     model=entry["model"], attempts=entry["attempts"], success=entry["success"])
+
+
+def _usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    return (getattr(usage, "prompt_token_count", 0) or 0,
+            getattr(usage, "candidates_token_count", 0) or 0)
+
+
+def _new_entry(model):
+    return {"model": model, "attempts": 0, "queue_ms": 0, "latency_ms": 0,
+            "input_tokens": 0, "output_tokens": 0, "success": False}
+
+
+def _prepare(model, deadline_sec, metrics, stage):
+    """클라이언트 확인 + 동시 호출 슬롯 획득 -> (client, model, deadline, entry, started)"""
+    client = get_client()
+    if client is None:
+        raise RuntimeError("secrets.toml에 'gemini_api_key'가 설정되지 않았습니다.")
+
+    model = model or MODEL_ID
+    deadline = time.monotonic() + (deadline_sec or DEFAULT_DEADLINE_SEC)
+    entry = _new_entry(model)
+
+    started = time.monotonic()
+    # 동시 호출 상한 (남은 마감 시간만큼만 대기)
+    acquired = _slots.acquire(timeout=max(0.0, deadline - time.monotonic()))
+    entry["queue_ms"] = int((time.monotonic() - started) * 1000)
+    if not acquired:
+        entry["error"] = "concurrency wait timeout"
+        _record(metrics, stage, entry)
+        raise TimeoutError("Gemini 동시 호출 대기 시간이 초과되었습니다.")
+    return client, model, deadline, entry, started
+
+
+def _call_config(config, deadline):
+    """호출별 HTTP 타임아웃 = 남은 마감 시간 (ms)"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Gemini 호출 마감 시간이 초과되었습니다.")
+    config = config or types.GenerateContentConfig()
+    return config.model_copy(update={"http_options": types.HttpOptions(timeout=int(remaining * 1000))})
+
+
+def _backoff_or_raise(e, entry, deadline):
+    """재시도 가능한 오류면 백오프 대기, 아니면 예외 재발생"""
+    backoff = min(2 ** (entry["attempts"] - 1), 8) + random.uniform(0, 0.5)
+    if (e.code not in RETRYABLE_CODES or entry["attempts"] > MAX_RETRIES
+            or time.monotonic() + backoff >= deadline):
+        raise e
+    print(f"[WARN] Gemini {e.code}, {backoff:.1f}s 후 재시도 ({entry['attempts']}/{MAX_RETRIES})")
+    time.sleep(backoff)
+
+
+def generate(contents, config=None, metrics=None, stage="llm", model=None, deadline_sec=None):
+    """
+    generate_content 래퍼. 응답 객체를 반환하고 실패 시 예외를 그대로 올립니다.
+    - deadline_sec: 대기/재시도를 포함한 전체 마감 시간 (초과 시 TimeoutError)
+    - metrics/stage: pipeline_metrics dict와 단계명 (예: "ocr", "analysis")
+    """
+    client, model, deadline, entry, started = _prepare(model, deadline_sec, metrics, stage)
+    try:
+        call_started = time.monotonic()
+        while True:
+            call_config = _call_config(config, deadline)
+            entry["attempts"] += 1
+            try:
+                response = client.models.generate_content(model=model, contents=contents, config=call_config)
+                break
+            except errors.APIError as e:
+                _backoff_or_raise(e, entry, deadline)
+
+        entry["latency_ms"] = int((time.monotonic() - call_started) * 1000)
+        entry["input_tokens"], entry["output_tokens"] = _usage(response)
+        entry["success"] = True
+        return response
+    except Exception as e:
+        entry["latency_ms"] = int((time.monotonic() - started) * 1000) - entry["queue_ms"]
+        entry["error"] = str(e)[:200]
+        raise
+    finally:
+        _slots.release()
+        _record(metrics, stage, entry)
+
+
+def generate_stream(contents, config=None, metrics=None, stage="llm", model=None, deadline_sec=None):
+    """
+    generate_content_stream 래퍼. 응답 텍스트 조각을 도착 순서대로 yield 합니다.
+    - 재시도는 첫 조각을 받기 전 오류에만 적용 (이미 내보낸 내용은 되돌릴 수 없음)
+    - 기록: generate()와 같은 항목 + ttft_ms (첫 조각까지 걸린 시간)
+    - 동시 호출 슬롯은 끝까지 읽거나, 오류가 나거나, close()될 때 반납됨
+      -> 중간에 읽기를 멈출 수 있는 호출 측은 contextlib.closing(...)으로 감싸 바로 반납 (GC를 기다리지 않도록)
+    """
+    client, model, deadline, entry, started = _prepare(model, deadline_sec, metrics, stage)
+    try:
+        call_started = time.monotonic()
+        last_chunk = None
+        while True:
+            call_config = _call_config(config, deadline)
+            entry["attempts"] += 1
+            try:
+                stream = client.models.generate_content_stream(model=model, contents=contents, config=call_config)
+                try:
+                    for chunk in stream:
+                        last_chunk = chunk
+                        text = chunk.text
+                        if not text: continue
+                        if "ttft_ms" not in entry:
+                            entry["ttft_ms"] = int((time.monotonic() - call_started) * 1000)
+                        yield text
+                finally:
+                    # 중간에 멈춘 경우에도 SDK 스트림(HTTP 응답)을 바로 닫음
+                    close = getattr(stream, "close", None)
+                    if close: close()
+                break
+            except errors.APIError as e:
+                if "ttft_ms" in entry: raise
+                _backoff_or_raise(e, entry, deadline)
+
+        entry["latency_ms"] = int((time.monotonic() - call_started) * 1000)
+        entry["input_tokens"], entry["output_tokens"] = _usage(last_chunk)
+        entry["success"] = True
+    except GeneratorExit:
+        entry["error"] = "cancelled"
+        raise
+    except Exception as e:
+        entry["latency_ms"] = int((time.monotonic() - started) * 1000) - entry["queue_ms"]
+        entry["error"] = str(e)[:200]
+        raise
+    finally:
+        _slots.release()
+        _record(metrics, stage, entry)
@@ -1,20 +1,17 @@
 import streamlit as st
 from streamlit_calendar import calendar
 import datetime
+import json
 import pandas as pd
-import uuid
-import random
 import re
 from urllib.parse import quote
 import time
 import altair as alt
 
 # --- [AI 분석 모듈 임포트] ---
-import ocr
-import ocr_correction
-import api_search
-import care_processor
-import interaction_checker
+import jobs  # 분석 작업 큐 (pipeline.run을 작업자 스레드에서 실행)
+import check_outbox  # 복용 체크 쓰기 지연 큐 (모아서 일괄 upsert)
+import dose_schedule
 
 # --- [DB 모듈 임포트] ---
 import db
@@ -29,15 +26,11 @@ today = datetime.date.today()
 # 사용자 식별 (먼저 가져옴)
 user_id = db.get_user_id()
 
-# --- 헬퍼 함수 ---
+# 분석 작업 큐 (프로세스당 1개, 작업자 스레드 포함)
+job_queue = jobs.get_job_queue()
+check_queue = check_outbox.get_check_outbox()
 
-def get_random_color():
-    """약 구분을 위한 랜덤 색상 부여"""
-    colors = [
-        "#FF6B6B", "#4ECDC4", "#45B7D1", "#FFA07A", "#98D8C8", 
-        "#F06292", "#AED581", "#FFD54F", "#4DB6AC", "#9575CD"
-    ]
-    return random.choice(colors)
+# --- 헬퍼 함수 ---
 
 def update_multiple_medicines_dates(updates):
     """updates: {약이름: 새로운날짜} 형태의 딕셔너리"""
@@ -172,36 +165,171 @@ def plot_drug_survival_funnel(survival_data):
 
     st.altair_chart(chart, use_container_width=True)
 
-def flatten_reports(reports):
+def plot_trace_waterfall(trace):
+    """
+    [Altair] Stage Waterfall (Gantt-style Bar Chart)
+    - Spec: span별 start_ms ~ end_ms 가로 막대, 하위 span은 들여쓰기
+    - Height: span 개수에 비례 (최소 260px)
+    """
+    all_spans = (trace or {}).get("spans", [])
+    # 리포트 저장 시점에 열려 있던 span(duration_ms None)은 표시하지 않음 (부모 찾기에는 사용)
+    spans = [s for s in all_spans if s.get("duration_ms") is not None]
+    if not spans:
+        st.info("Legacy report: stage trace not recorded yet.")
+        return
+
+    by_id = {s["id"]: s for s in all_spans}
+
+    def depth(s):
+        d = 0
+        while s.get("parent") is not None and s["parent"] in by_id:
+            s = by_id[s["parent"]]
+            d += 1
+        return d
+
     rows = []
-    for r in reports:
-        meta = r.get('report_json', {}).get('meta_analysis', {})
-        kpis = meta.get('kpis', {})
-        ds = meta.get('data_sources', {})
-        metrics = meta.get('pipeline', meta.get('pipeline_metrics', {}))
-        
-        row = {
-            "created_at": r.get('created_at'),
-            "case_id": meta.get('case_id', r.get('case_id', 'unknown')),
-            "quality_score": meta.get('quality_score', 0),
-            
-            # KPIs
-            "ocr_success": metrics.get('ocr', {}).get('success', False),
-            "api_success_rate": kpis.get('api_success_rate', kpis.get('search_success_rate', 0)), # Fallback for backward compatibility
-            "mfds_coverage": ds.get('coverage_pct', 0),
-            "latency_ms": kpis.get('total_latency_ms', 0),
-            "retry_count": metrics.get('api', {}).get('retry_count', 0),
-            
-            # Safety
-            "risk_level": meta.get('risk_level', 'Unknown'),
-            "interaction_count": meta.get('safety_summary', {}).get('interaction_count', 0),
-            "has_warning": meta.get('safety_summary', {}).get('has_warning', False),
-            
-            # Drill-down Data
-            "raw_report": r.get('report_json', {})
-        }
-        rows.append(row)
-    return pd.DataFrame(rows)
+    for s in sorted(spans, key=lambda x: (x["start_ms"], x["id"])):
+        detail = s.get("query") or s.get("drug") or s.get("model")
+        label = f"{'· ' * depth(s)}{s['name']}" + (f" ({detail})" if detail else "")
+        rows.append({
+            "label": label,
+            "stage": s["name"].split(".")[0],
+            "start_ms": s["start_ms"],
+            "end_ms": s["start_ms"] + s["duration_ms"],
+            "duration_ms": s["duration_ms"],
+        })
+    df_trace = pd.DataFrame(rows)
+    label_order = list(dict.fromkeys(df_trace["label"]))
+
+    chart = alt.Chart(df_trace).mark_bar(cornerRadius=2).encode(
+        y=alt.Y("label", sort=label_order, axis=alt.Axis(title=None, labelFontSize=11, labelLimit=260)),
+        x=alt.X("start_ms", axis=alt.Axis(title="ms")),
+        x2="end_ms",
+        color=alt.Color("stage", legend=None),
+        tooltip=["label", "start_ms", "duration_ms"]
+    ).properties(
+        height=max(260, 22 * len(label_order))
+    ).configure_axis(
+        gridOpacity=0.2
+    ).configure_view(
+        stroke=None
+    )
+
+    st.altair_chart(chart, use_container_width=True)
+
+def plot_stage_percentiles(stage_stats):
+    """
+    [Altair] Stage Latency p50 / p95 (Horizontal Bar Chart, 전체 리포트 기준)
+    - Spec: p95 막대(연한색) 위에 p50 막대 겹침
+    - Height: 260px
+    - 집계는 DB에서 수행 (db.get_stage_latency_stats)
+    """
+    if not stage_stats:
+        st.info("Legacy reports: stage trace not recorded yet.")
+        return
+
+    df_pct = pd.DataFrame(stage_stats).sort_values("p95", ascending=False)
+
+    base = alt.Chart(df_pct).encode(
+        y=alt.Y("stage", sort=df_pct["stage"].tolist(), axis=alt.Axis(title=None, labelFontSize=12)),
+        tooltip=["stage", "p50", "p95", "n"]
+    )
+    p95 = base.mark_bar(size=18, color="#c6dbef").encode(x=alt.X("p95", axis=alt.Axis(title="ms")))
+    p50 = base.mark_bar(size=10, color="#4c78a8").encode(x="p50")
+
+    chart = (p95 + p50).properties(
+        height=260
+    ).configure_axis(
+        gridOpacity=0.2,
+        labelFontSize=12
+    ).configure_view(
+        stroke=None
+    )
+
+    st.altair_chart(chart, use_container_width=True)
+
+def clicked_date(cal_state):
+    """달력 컴포넌트 상태 -> 마지막으로 클릭한 날짜 (없으면 None)"""
+    clicked_date_str = (cal_state or {}).get("dateClick", {}).get("date")
+    if not clicked_date_str: return None
+    temp_date = datetime.datetime.strptime(clicked_date_str[:10], "%Y-%m-%d").date()
+    if "T" in clicked_date_str:  # 타임존 이슈 해결용
+        return temp_date + datetime.timedelta(days=1)
+    return temp_date
+
+def month_grid(month_first):
+    """월 보기 달력에 그려지는 날짜 범위 (일요일 시작 6주 고정, FullCalendar dayGridMonth 기본값과 같음)"""
+    start = month_first - datetime.timedelta(days=(month_first.weekday() + 1) % 7)
+    return start, start + datetime.timedelta(days=41)
+
+def shift_month(month_first, offset):
+    """month_first(1일)에서 offset개월 이동한 달의 1일"""
+    index = month_first.year * 12 + month_first.month - 1 + offset
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def move_calendar_month(offset):
+    """◀ / ▶ 버튼 콜백 (offset=None이면 이번 달). 리런 전에 실행되어 데이터 로드가 바뀐 달을 바로 사용"""
+    if offset is None:
+        st.session_state.cal_month = today.replace(day=1)
+    else:
+        st.session_state.cal_month = shift_month(st.session_state.cal_month, offset)
+
+def history_window(anchor):
+    """anchor가 속한 달의 달력(월 보기) 범위 + 앞뒤 1개월 (이전/다음 달 이동 대비)"""
+    first = anchor.replace(day=1)
+    start = (first - datetime.timedelta(days=1)).replace(day=1) - datetime.timedelta(days=7)
+    next_first = (first + datetime.timedelta(days=32)).replace(day=1)
+    end = (next_first + datetime.timedelta(days=32)).replace(day=1) + datetime.timedelta(days=13)
+    return start, end
+
+def check_history_sync_call(anchor):
+    """
+    st.session_state.check_history 동기화 작업 (db.sync_history) -> (함수,) 또는 None(할 일 없음)
+    페이지 로드의 다른 조회와 동시에 돌도록 작업만 만들어 db.load_page_snapshot에 넘김
+    - 처음: anchor 주변 기간만 조회
+    - anchor가 불러온 기간 밖이면: 새로 필요한 구간만 추가 조회해 기간 확장
+    - 그 외: db.CACHE_TTL_SEC마다 마지막 동기화 이후 바뀐 행만 조회 (다른 기기에서 체크한 기록 반영)
+    - 조회가 실패하면 synced_at을 갱신하지 않아 다음 리런에서 다시 시도 (오류는 db.fetch_concurrently가 표시)
+      이 세션의 체크는 세션 dict를 바로 고치므로 그 사이 리런은 네트워크 호출 없음
+    """
+    start, end = history_window(anchor)
+    sync = st.session_state.get('history_sync')
+    history = st.session_state.get('check_history')
+
+    if sync is None or sync['user_id'] != user_id or history is None:
+        history = st.session_state.check_history = {}
+        sync = st.session_state.history_sync = {"user_id": user_id, "start": start, "end": end, "since": None,
+                                                "synced_at": 0}
+        def first_load():
+            sync['since'] = db.sync_history(user_id, history, None, start, end)
+            sync['synced_at'] = time.time()
+        return (first_load,)
+
+    # 확장 구간의 updated_at은 커서로 쓰지 않음 (기존 구간의 더 이른 변경을 건너뛰지 않도록)
+    segments = []
+    if start < sync['start']:
+        segments.append((start, sync['start'] - datetime.timedelta(days=1)))
+        sync['start'] = start
+    if end > sync['end']:
+        segments.append((sync['end'] + datetime.timedelta(days=1), end))
+        sync['end'] = end
+    if segments:
+        def extend():
+            try:
+                for seg_start, seg_end in segments:
+                    db.sync_history(user_id, history, None, seg_start, seg_end)
+            except Exception:
+                # 범위는 이미 넓혔으므로 다음 리런에서 기간 전체를 다시 조회
+                sync['since'], sync['synced_at'] = None, 0
+                raise
+        return (extend,)
+
+    if time.time() - sync['synced_at'] >= db.CACHE_TTL_SEC:
+        def incremental():
+            sync['since'] = db.sync_history(user_id, history, sync['since'], sync['start'], sync['end'])
+            sync['synced_at'] = time.time()
+        return (incremental,)
+    return None
 
 def get_bulk_calendar_url(medicines, slot_name="전체", start_time=None, end_time=None):
     if not medicines: return "#"
@@ -241,12 +369,26 @@ def get_bulk_calendar_url(medicines, slot_name="전체", start_time=None, end_ti
 
 
 # --- 데이터 로드 (DB 연동) ---
-# 세션 상태 초기화 (또는 리프레시)
-user_medicines = db.get_medicines(user_id)
-st.session_state.medicines = user_medicines  # 전체 데이터
-
-user_history = db.load_history(user_id)
-st.session_state.check_history = user_history
+# 화면에 필요한 독립 조회(약물 / 최신 리포트 / 복용 기록, 또는 대시보드 집계)를 동시에 실행
+# (위젯 값은 리런 시작 시점에 이미 갱신되어 있으므로 key로 미리 읽어 사용, 이후 같은 조회는 캐시 적중)
+is_dashboard = st.session_state.get("app_mode") == "📊 시스템 대시보드"
+if is_dashboard:
+    snapshot = db.load_page_snapshot(user_id, dashboard=True)
+else:
+    prev_case = st.session_state.get("selected_case", "전체 보기")
+    # 복용 기록: 달력에 보이는 달(+ 앞뒤 1개월, 이동 대비 미리 조회)만 조회하고,
+    # 이후 리런에서는 바뀐 행만 받아 세션 dict를 갱신
+    st.session_state.setdefault('cal_month', today.replace(day=1))
+    history_call = check_history_sync_call(st.session_state.cal_month)
+    snapshot = db.load_page_snapshot(
+        user_id, case_id=None if prev_case == "전체 보기" else prev_case,
+        extra={"check_history": history_call} if history_call else None
+    )
+    user_medicines = snapshot["medicines"]
+    st.session_state.medicines = user_medicines  # 전체 데이터
+    if history_call:
+        # 아직 전송되지 않은 체크는 서버 값보다 최신이므로 다시 덮어씀
+        st.session_state.check_history.update(check_queue.pending(user_id))
 
 # 리포트 로드 (세션에 없으면 DB에서 최신 조회)
 # 이 부분은 아래에서 selected_case에 따라 로드하도록 변경됨
@@ -263,7 +405,7 @@ with st.sidebar:
     st.title("🧬 MediLens")
     
 
-    app_mode = st.radio("화면 모드", ["🏠 내 복약 비서", "📊 시스템 대시보드"])
+    app_mode = st.radio("화면 모드", ["🏠 내 복약 비서", "📊 시스템 대시보드"], key="app_mode")
     st.markdown("---")
 
 # ==========================================
@@ -274,13 +416,13 @@ if app_mode == "📊 시스템 대시보드":
     st.caption("Advanced Pipeline Analytics & Quality Control Console")
     st.divider()
     
-    # 1. 데이터 로드 (Data Load)
-    all_reports = db.get_user_reports(user_id)
+    # 1. 데이터 로드 (Data Load) - 리포트 본문 대신 DB에서 뽑은 KPI 컬럼만 (report_kpis 뷰)
+    kpi_rows = snapshot["report_kpis"]
     
-    if not all_reports:
+    if not kpi_rows:
         st.info("아직 분석된 데이터가 충분하지 않습니다.")
     else:
-        df = flatten_reports(all_reports)
+        df = pd.DataFrame(kpi_rows)
         
         # [Sidebar] 케이스 선택 (Case Selector) - 최신순 정렬
         with st.sidebar:
@@ -303,7 +445,7 @@ if app_mode == "📊 시스템 대시보드":
 
         # [Data Select] 선택된 데이터 추출
         row = df.loc[selected_idx]
-        raw = row['raw_report']
+        raw = db.get_report(user_id, row['id']) or {} # 선택한 케이스만 본문 조회
         meta = raw.get('meta_analysis', {})
         api_stat = meta.get('pipeline', meta.get('pipeline_metrics', {})).get('api', {})
         
@@ -344,7 +486,10 @@ if app_mode == "📊 시스템 대시보드":
                  unverified = total_drugs - verified
 
             with r2c1: metric_card("Verified / Unverified", f"{verified} / {unverified}", "국가 의약품 표준 데이터베이스 검증 완료.")
-            with r2c2: metric_card("Avg Latency", f"{int(row['latency_ms']):,} ms", "OCR부터 AI 분석까지 소요된 총 파이프라인 시간.")
+            with r2c2:
+                metric_card("Avg Latency", f"{int(row['latency_ms']):,} ms", "OCR부터 AI 분석까지 소요된 총 파이프라인 시간.")
+                if pd.notna(row['ttfc_ms']):
+                    st.caption(f"첫 약물 카드 표시까지 {int(row['ttfc_ms']):,} ms")
             with r2c3: metric_card("Search Difficulty (Retry)", f"{int(row['retry_count'])} 회", "재검색 없이 1차 시도에서 즉시 매칭되었습니다.")
 
         # --- [Section 2] Quality Trends & Funnel (Altair Charts) ---
@@ -395,9 +540,22 @@ if app_mode == "📊 시스템 대시보드":
             elif risk_val == "HIGH": p_val = 1.0
             st.progress(p_val)
 
-        # --- [Section 4] Logs ---
+        # --- [Section 4] Latency Trace ---
         with st.container(border=True):
-            st.subheader("4) Detailed Pipeline Logs")
+            st.subheader("4) Latency Trace")
+            c1, c2 = st.columns(2, gap="large")
+
+            with c1:
+                st.caption("Stage waterfall of this case (ms from button click).")
+                plot_trace_waterfall(pipeline_data.get('trace'))
+
+            with c2:
+                st.caption(f"Per-stage p50 (dark) / p95 (light) across {len(df)} reports.")
+                plot_stage_percentiles(snapshot["stage_latency"])
+
+        # --- [Section 5] Logs ---
+        with st.container(border=True):
+            st.subheader("5) Detailed Pipeline Logs")
             with st.expander("📂 Case Summary / Provenance / Raw JSON", expanded=False):
                 st.write(f"**Provenance:** {api_stat.get('source', '-')} / {api_stat.get('endpoint', '-')}")
                 st.json(raw)
@@ -433,7 +591,7 @@ with st.sidebar:
 
     # 사이드바 하단 리스트 위치 (새로고침 위)
     st.subheader("📁 내 처방전 목록")
-    selected_case = st.selectbox("확인할 처방전을 선택하세요", case_options, format_func=format_func)
+    selected_case = st.selectbox("확인할 처방전을 선택하세요", case_options, format_func=format_func, key="selected_case")
     
     st.divider()
 
@@ -442,309 +600,45 @@ with st.sidebar:
     img_file = st.file_uploader("약을 촬영한 이미지를 업로드하세요", type=["png", "jpg", "jpeg"])
 
     if img_file is not None:
-        # [Latency 측정] 분석 시작 시간 기록
-        start_time = time.time()
-        
         # 이미지 표시
         st.image(img_file, caption="업로드된 이미지", use_container_width=True)
         if st.button("🚀 AI 정밀 분석 및 등록", use_container_width=True):
-            
-            try:
-                # --- [AI 분석 파이프라인 시작] ---
-                with st.status("Medilens AI가 분석 중입니다...", expanded=True) as status:
-                    
-                    # [1] OCR + 보정 실행
-                    st.write("👁️ 글자를 읽고 있습니다... (OCR)")
-                    ocr_result = ocr.run_ocr(img_file)
-                    
-                    # [Metric] OCR 지표 수집
-                    pipeline_metrics = {
-                        "ocr": {
-                            "success": True if ocr_result else False,
-                            "extracted_count": len(ocr_result) if ocr_result else 0
-                        }
-                    }
-                    
-                    if not ocr_result:
-                        status.update(label="❌ OCR 실패 (텍스트 없음)", state="error")
-                        st.stop()
-
-                    # [Metric] 보정 지표 수집 (함수 시그니처 변경 반영: tuple 반환)
-                    st.write("🔧 약물 DB와 대조하여 오타를 수정합니다...")
-                    corrected_drugs, correction_stats = ocr_correction.correct_drug_names(ocr_result)
-                    pipeline_metrics["correction"] = correction_stats
-                    
-                    # [DEBUG] 중간 결과 저장
-                    st.session_state.ocr_result = corrected_drugs
-
-                    # [2] API 검증 (재시도 로직 포함 - Phase 4)
-                    st.write("🔍 식약처 데이터를 조회합니다... (3단계 정밀 검색)")
-                    validated_drugs = []
-                    
-                    # [Metric] API 지표 초기화
-                    api_stats = {
-                        "attempted": 0, 
-                        "matched": 0, 
-                        "retry_count": 0,
-                        "source": "MFDS (식품의약품안전처)",
-                        "endpoint": "DrugPrdtPrmsnInfoService07 (의약품제품허가정보)", 
-                        "api_version": "v1 (getDrugPrdtPrmsnDtlInq06)"
-                    }
-                    
-                    for drug in corrected_drugs:
-                        base_name = drug.get('corrected_medicine_name', drug.get('medicine_name'))
-                        api_stats["attempted"] += 1
-                        
-                        search_res = None
-                        # 4단계 재시도 로직 (Full -> No Dosage -> No Paren -> Prefix)
-                        for i in range(4):
-                            query = base_name
-                            
-                            # 단계별 쿼리 생성
-                            if i == 0:
-                                pass # 1단계: 원본 그대로
-                            elif i == 1:
-                                # 2단계: 용량/단위 제거 (User Request 복구)
-                                name_only, _ = ocr_correction.split_name_and_dosage(base_name)
-                                query = name_only
-                            elif i == 2:
-                                # 3단계: 괄호 제거
-                                query = api_search.remove_parentheses(base_name)
-                            elif i == 3:
-                                # 4단계: 앞 4글자 (최후의 수단)
-                                query = base_name[:4] if len(base_name) > 4 else base_name
-                                
-                            # 중복 쿼리 방지 (예: 괄호 없는데 괄호제거 단계 수행 시)
-                            if i > 0 and query == base_name: 
-                                continue
-                            if i == 3 and len(base_name) <= 4:
-                                continue
-
-                            print(f"[DEBUG] API 검색 {i+1}차: {query}")
-                            search_res = api_search.search_drug_api(query)
-                            
-                            if search_res:
-                                print(f"  -> 성공!")
-                                break
-                            else:
-                                if i < 3: api_stats["retry_count"] += 1
-                        
-                        if search_res:
-                            # 매칭 성공
-                            api_stats["matched"] += 1
-                            drug['efficacy'] = api_search.remove_xml_tags(search_res.get('efcyQesitm', ''))
-                            drug['usage'] = api_search.remove_xml_tags(search_res.get('useMethodQesitm', ''))
-                            drug['caution'] = api_search.remove_xml_tags(search_res.get('atpnQesitm', ''))
-                        
-                        validated_drugs.append(drug)
-
-                    # [Metric] API 결과 저장
-                    pipeline_metrics["api"] = api_stats
-                    
-                    # [3] DUR 및 LLM 분석
-                    st.write("🧠 AI가 복약 지도를 작성 중입니다...")
-                    
-                    # DUR Check (Metric)
-                    warnings = interaction_checker.check_interactions(validated_drugs)
-                    pipeline_metrics["dur"] = {
-                        "interaction_count": len(warnings),
-                        "has_warning": len(warnings) > 0
-                    }
-                    
-                    # 최종 AI 요청 (메타 포함)
-                    final_json = {
-                        "drugs": validated_drugs, 
-                        "meta": {"source": "Medilens", "timestamp": str(datetime.datetime.now())}
-                    }
-                    ai_result = care_processor.analyze_with_llm(final_json)
-                    
-                    # 세션에 메트릭 및 결과 저장
-                    st.session_state.pipeline_metrics = pipeline_metrics
-                    st.session_state.ai_result = ai_result
-                    
-                    # DUR 결과 병합 (LLM 결과에 없을 수도 있으므로)
-                    if not ai_result.get('interactions'):
-                        ai_result['interactions'] = warnings
-                    
-                    st.session_state['debug_ocr'] = ocr_result # 하위 호환
-                    st.session_state['debug_ai'] = ai_result
-                    
-                    if "error" in ai_result:
-                        st.error(ai_result["error"])
-                        st.stop()
-                        
-                st.success("✅ 분석 완료! 데이터베이스에 등록합니다.")
-
-                # --- [데이터 변환 및 저장] ---
-                ai_result_final = st.session_state.ai_result
-                schedule_list = ai_result_final.get('schedule_time_list', [])
-                time_str = ", ".join(schedule_list) if schedule_list else "식후 30분"
-                
-                # [Case ID 생성] 이번 처방전 업로드를 하나의 사건(Case)으로 그룹핑
-                case_id = str(uuid.uuid4())
-
-                # 1. 약물 DB 저장
-                count = 0
-                for drug in ai_result_final.get('drug_analysis', []):
-                    drug_name = drug.get('name', '알 수 없음')
-                    
-                    try:
-                        raw_days = drug.get('days', 3)
-                        days = int(raw_days)
-                    except:
-                        days = 3
-                    
-                    # 약물별 개별 스케줄 우선 적용
-                    d_schedule = drug.get('time_list', [])
-                    if not d_schedule:
-                        # 없으면 전체 공용 스케줄 사용
-                        d_schedule = ai_result_final.get('schedule_time_list', ["식후 30분"])
-                    
-                    # 리스트 -> 문자열 변환 ("아침, 점심, 저녁")
-                    time_str = ", ".join(d_schedule)
-
-                    # DB 저장용 딕셔너리 구성
-                    entry = {
-                        "name": drug_name,
-                        "days": days,
-                        "color": get_random_color(),
-                        "time": time_str, 
-                        "start_date": today, 
-                        "efficacy": drug.get('efficacy', '-'), 
-                        "usage": drug.get('usage', '-'),       
-                        "info": drug.get('caution', '특이사항 없음'), 
-                        "food": drug.get('food_guide', '특이사항 없음')
-                    }
-                    
-                    # case_id 전달
-                    if db.add_medicine(user_id, entry, case_id=case_id):
-                        count += 1
-                
-                # 2. 리포트 DB 저장
-                if "report" in ai_result_final:
-                    report_data = ai_result_final["report"]
-                    report_data["medicines"] = ai_result_final.get('drug_analysis', [])
-                    
-                    # [Phase 4] Advanced Analytics & Meta Data Construction
-                    metrics = st.session_state.get('pipeline_metrics', {})
-                    
-                    # 1. 신뢰도 점수 계산 (Data Quality Score)
-                    quality_score = 100
-                    breakdown = []
-                    
-                    # (1) OCR Check (치명적 실패)
-                    if not metrics.get('ocr', {}).get('success', False):
-                        quality_score -= 40
-                        breakdown.append("OCR 인식 실패 (-40)")
-                    
-                    # (2) Correction Check (과도한 보정)
-                    corr_stats = metrics.get('correction', {})
-                    if corr_stats.get('total_edits', 0) > 10:
-                        quality_score -= 10
-                        breakdown.append("과도한 오타 보정 (-10)")
-                        
-                    # (3) API Match Check (매칭 실패율 반영)
-                    api_stats = metrics.get('api', {})
-                    attempted = api_stats.get('attempted', 1)
-                    matched = api_stats.get('matched', 0)
-                    success_rate = matched / attempted if attempted > 0 else 0.0
-                    
-                    if success_rate < 1.0:
-                        # 실패율 * 40점 감점
-                        penalty = int((1.0 - success_rate) * 40)
-                        quality_score -= penalty
-                        breakdown.append(f"식약처 미매칭 {attempted-matched}건 (-{penalty})")
-                        
-                    # (참고) DUR/Safety 지표는 점수에서 제외 (별도 리스크 카드로 분리)
-                    
-                    # 점수 보정 (0~100)
-                    quality_score = max(0, min(100, quality_score))
-
-                    # [Explicit Feedback] 만점인 경우 성공 메시지 명시
-                    if quality_score == 100:
-                        breakdown.append("Perfect Match: No penalties applied (OCR, API, Correction passed)")
-
-                    # [Latency 측정] 분석 종료 및 시간 계산
-                    end_time = time.time()
-                    total_latency_ms = int((end_time - start_time) * 1000)
-
-                    # 2. 메타 데이터 조립
-                    meta = {
-                        "case_id": case_id, # [Traceability] 처방전 식별 ID (DB와 리포트 연결 고리)
-                        "risk_level": ai_result_final.get('meta_analysis', {}).get('risk_level', 'Unknown'),
-                        "quality_score": quality_score,
-                        "quality_breakdown": breakdown,
-                        "pipeline": metrics, # (Refactored) Standardized key
-                        "data_sources": {
-                            "primary": "MFDS (식품의약품안전처)",
-                            "coverage_pct": int(success_rate * 100),
-                            "total_drugs": attempted
-                        },
-                        "safety_summary": { # 대시보드 표시용 별도 카드 데이터
-                            "interaction_count": metrics.get('dur', {}).get('interaction_count', 0),
-                            "has_warning": metrics.get('dur', {}).get('has_warning', False)
-                        },
-                        "case_summary": { # [New] 처방전 규모 요약 (Volume Context)
-                            "total_drugs": attempted,
-                            "verified_drugs": matched,
-                            "unverified_drugs": attempted - matched,
-                            "success_ratio": success_rate
-                        },
-                        "meta_version": "1.1", # [Legacy Check] 리포트 버전 태깅 (1.1 = Funnel Data Available)
-                        # [Dashboard KPI] 대시보드용 핵심 성과 지표 (Pre-calcutated)
-                        "kpis": {
-                            "drug_name_accuracy_proxy": round(success_rate * 100, 1), # 약물명 인식 정확도 (대체지표)
-                            "api_success_rate": round(success_rate * 100, 1),         # (Refactored) API 검색 성공률
-                            "total_latency_ms": total_latency_ms                     # 총 처리 속도 (ms)
-                        }
-                    }
-
-                    # [New] Confidence Timeline Logic (60 -> 80 -> 100)
-                    # "데이터가 이 과정을 거치며 점점 더 믿을만해진다"는 가치 시각화
-                    timeline = [{"stage": "Start", "score": 0}]
-                    
-                    # 1. OCR Stage (Base: 60)
-                    if attempted > 0:
-                        timeline.append({"stage": "OCR Extraction", "score": 60})
-                    
-                    # 2. Correction Stage (Base: 80)
-                    if attempted > 0: 
-                         timeline.append({"stage": "SymSpell Correction", "score": 80})
-
-                    # 3. Validation Stage (Final: 100)
-                    final_score = 80
-                    if success_rate == 1.0:
-                        final_score = 100
-                    elif success_rate > 0:
-                        final_score = 80 + int(success_rate * 20) # 부분 점수
-                    
-                    timeline.append({"stage": "API Validation", "score": final_score})
-                    
-                    timeline.append({"stage": "API Validation", "score": final_score})
-                    
-                    metrics["confidence_timeline"] = timeline
-                    
-                    # [New] Drug Survival Funnel Metrics (OCR -> Correction -> API)
-                    ocr_cnt = metrics.get('ocr', {}).get('extracted_count', 0)
-                    metrics["drug_survival"] = {
-                        "ocr": ocr_cnt,
-                        "correction": len(corrected_drugs) if 'corrected_drugs' in locals() else ocr_cnt,
-                        "api": matched
-                    }
-                    
-                    # 리포트에 주입
-                    report_data["meta_analysis"] = meta
-                    
-                    # case_id 전달 및 저장
-                    db.save_report(user_id, report_data, case_id=case_id)
-                    st.session_state['last_report'] = report_data
-                
+            # [Job Queue] 분석은 작업 큐의 작업자 스레드가 수행 -> 버튼 클릭은 등록만 하고 즉시 반환
+            # (지연 측정은 작업자가 실행을 시작한 시점부터, 큐 대기 시간은 pipeline.job.queue_ms)
+            job_id = job_queue.submit(user_id, img_file.getvalue())
+            st.toast(f"분석 작업이 등록되었습니다. (작업 ID: {job_id[:8]})")
+            st.rerun()
+
+    # [Job Queue] 진행 중 / 확인하지 않은 작업 표시 (2초마다 이 부분만 다시 그림)
+    @st.fragment(run_every=2)
+    def render_jobs():
+        jobs_pending = job_queue.pending_for_user(user_id)
+        if not jobs_pending:
+            st.rerun()  # 모두 끝나면 전체 화면 갱신 (새 약물/리포트 반영)
+
+        for job in jobs_pending:
+            if job["status"] in jobs.ACTIVE_STATUSES:
+                with st.status(job["progress"] or "Medilens AI가 분석 중입니다...", expanded=True):
+                    # [Streaming] 완성된 약물 카드 (캐시 적중분은 즉시)
+                    for item in job["partial"]:
+                        with st.container(border=True):
+                            st.markdown(f"**💊 {item.get('name', '약품')}**")
+                            st.caption(item.get('efficacy', '-'))
+            elif job["status"] == "done":
+                count = job["result"].get("saved_medicines", 0)
                 st.success(f"{count}개의 약물이 클라우드에 성공적으로 등록되었습니다!")
+                job_queue.acknowledge(job["job_id"])
+                db.invalidate(user_id)  # 작업자가 세션 밖에서 저장 -> 이 세션의 읽기 캐시 갱신
                 time.sleep(1)
                 st.rerun()
+            else:
+                st.error(job["error"] or "처리 중 오류가 발생했습니다.")
+                if st.button("확인", key=f"ack_{job['job_id']}"):
+                    job_queue.acknowledge(job["job_id"])
+                    st.rerun()
 
-            except Exception as e:
-                st.error(f"처리 중 오류가 발생했습니다: {e}")
+    if job_queue.pending_for_user(user_id):
+        render_jobs()
 
     # 사이드바 하단
     for _ in range(5): st.sidebar.write("")
@@ -752,7 +646,9 @@ with st.sidebar:
     
     # 데이터 초기화 (전체 삭제 기능은 복잡하므로 개별 삭제 권장, 일단 비활성화 or 전체 삭제 구현)
     if st.sidebar.button("DB 새로고침", use_container_width=True):
-        st.cache_resource.clear()
+        db.init_supabase.clear()  # 작업 큐 등 다른 리소스는 유지 (작업자 스레드 중복 방지)
+        db.invalidate(user_id)
+        st.session_state.pop('history_sync', None)
         st.rerun()
 
 # ----------------------------------------------------
@@ -774,48 +670,37 @@ st.session_state['last_report'] = current_report
 # ==========================================
 # 3. 달력 이벤트 구성 (filtered_medicines 기준)
 # ==========================================
+# 복용 일정 색인: 약물 목록이 바뀔 때만 다시 펼치고, 기록이 동기화된 리런에서만 체크 수 재계산
+schedule = st.session_state.get('dose_schedule')
+if schedule is None or schedule.fingerprint != dose_schedule.fingerprint(user_medicines):
+    schedule = st.session_state.dose_schedule = dose_schedule.DoseSchedule(user_medicines, st.session_state.check_history)
+elif history_call:
+    schedule.recount(st.session_state.check_history)
+
+case_filter = None if selected_case == "전체 보기" else selected_case
 calendar_events = []
 
-for drug in filtered_medicines:
-    # DB에서 가져온 날짜는 String일 수 있음
-    s_date_str = drug['start_date']
-    if isinstance(s_date_str, str):
-        start_date = datetime.datetime.strptime(s_date_str, "%Y-%m-%d").date()
-    else:
-        start_date = s_date_str
-
-    days = int(drug['days'])
+# 달력에 보이는 6주 범위만 이벤트로 변환 (장기 처방이어도 전달량은 한 달 치로 일정)
+# 이전 / 다음 달은 색인과 복용 기록이 이미 준비되어 있어 이동 시 범위 조회만 다시 함
+grid_start, grid_end = month_grid(st.session_state.cal_month)
+for event in schedule.range(grid_start, grid_end, case_id=case_filter):
+    drug = event["drug"]
+    # [달력 체크 확인] 약물의 모든 복용 시간(아침, 점심 등)을 완료했는지 (미리 집계된 체크 수)
+    is_checked = schedule.all_checked(event)
     
-    for i in range(days):
-        current_date = start_date + datetime.timedelta(days=i)
-        current_date_str = current_date.strftime("%Y-%m-%d")
-        
-        # [달력 체크 확인] 약물의 모든 복용 시간(아침, 점심 등)을 완료했는지 검사
-        time_list = [t.strip() for t in drug.get('time', '').split(',') if t.strip()]
-        if not time_list: time_list = ['기본']
-
-        all_checked = True
-        for t_val in time_list:
-            h_key = (current_date_str, drug['name'], t_val)
-            if not st.session_state.check_history.get(h_key, False):
-                all_checked = False
-                break
-        
-        is_checked = all_checked
-        
-        display_title = f"✅ {drug['name']}" if is_checked else drug['name']
-        base_color = drug.get('color', '#3D9DF3')
-        
-        calendar_events.append({
-            "title": display_title,
-            "start": current_date_str,
-            "end": current_date_str,
-            "allDay": True,
-            "display": "block",
-            "backgroundColor": "#D4EDDA" if is_checked else base_color,
-            "borderColor": "#28A745" if is_checked else base_color,
-            "textColor": "#000000" if is_checked else "#FFFFFF",
-        })
+    display_title = f"✅ {drug['name']}" if is_checked else drug['name']
+    base_color = drug.get('color', '#3D9DF3')
+    
+    calendar_events.append({
+        "title": display_title,
+        "start": event["date"],
+        "end": event["date"],
+        "allDay": True,
+        "display": "block",
+        "backgroundColor": "#D4EDDA" if is_checked else base_color,
+        "borderColor": "#28A745" if is_checked else base_color,
+        "textColor": "#000000" if is_checked else "#FFFFFF",
+    })
 
 
 
@@ -898,25 +783,30 @@ col_left, col_right = st.columns([1, 1], gap="large")
 # --- [왼쪽: 바둑판 달력] ---
 with col_left:
     st.subheader("🗓️ 복약 스케줄")
+    # 설치된 streamlit-calendar는 datesSet(보이는 기간 변경)을 전달하지 않으므로
+    # 달 이동은 앱에서 처리하고, 달마다 다른 key로 컴포넌트를 새로 그림 (initialDate = 그 달)
+    cal_month = st.session_state.cal_month
+    nav_prev, nav_today, nav_next = st.columns([1, 1, 1])
+    nav_prev.button("◀ 이전 달", on_click=move_calendar_month, args=(-1,), use_container_width=True)
+    nav_today.button("오늘", on_click=move_calendar_month, args=(None,), use_container_width=True)
+    nav_next.button("다음 달 ▶", on_click=move_calendar_month, args=(1,), use_container_width=True)
     calendar_options = {
-        "headerToolbar": {"left": "prev,next today", "center": "title", "right": "dayGridMonth"},
-        "initialView": "dayGridMonth", 
+        "headerToolbar": {"left": "", "center": "title", "right": ""},
+        "initialView": "dayGridMonth",
+        "initialDate": cal_month.isoformat(),
         "height": 550,
     }
-    state = calendar(events=calendar_events, options=calendar_options, key="main_cal")
+    calendar_key = f"main_cal_{cal_month:%Y-%m}"
+    state = calendar(events=calendar_events, options=calendar_options, key=calendar_key)
+    payload_bytes = len(json.dumps(calendar_events, ensure_ascii=False).encode("utf-8"))
+    st.caption(f"달력 이벤트 {len(calendar_events)}개 · {payload_bytes / 1024:.1f} KB "
+               f"({grid_start.strftime('%m/%d')} ~ {grid_end.strftime('%m/%d')})")
 
 # --- [오른쪽: 체크리스트] ---
 with col_right:
     # 1. 클릭한 날짜에 따른 view_date 결정 로직
-    clicked_date_str = state.get("dateClick", {}).get("date")
-    if clicked_date_str:
-        temp_date = datetime.datetime.strptime(clicked_date_str[:10], "%Y-%m-%d").date()
-        if "T" in clicked_date_str:  # 타임존 이슈 해결용
-            view_date = temp_date + datetime.timedelta(days=1)
-        else:
-            view_date = temp_date
-    else:
-        view_date = today
+    # (누른 날짜가 없으면 오늘, 오늘이 보이는 달 밖이면 그 달 1일)
+    view_date = clicked_date(state) or (today if today.replace(day=1) == cal_month else cal_month)
 
     # 상단 헤더 및 일괄 수정 팝오버
     head_col1, head_col2, head_col3 = st.columns([2.5, 1.5, 1.5]) 
@@ -971,70 +861,74 @@ with col_right:
 
     st.divider()
     
-    active_drugs = []
-    
-    # DB 데이터를 순회하며 해당 날짜에 먹어야 하는 약 필터링
-    # [수정] filtered_medicines 사용
-    for i, drug in enumerate(filtered_medicines):
-        s_date_str = drug['start_date']
-        if isinstance(s_date_str, str):
-            drug_start = datetime.datetime.strptime(s_date_str, "%Y-%m-%d").date()
-        else:
-            drug_start = s_date_str
-            
-        try:
-            raw_days = drug.get('days', 3)
-            days = int(raw_days)
-        except:
-            days = 3
-        drug_end = drug_start + datetime.timedelta(days=days - 1)
+    # 해당 날짜에 먹어야 하는 약 (복용 일정 색인에서 하루 조회)
+    active_drugs = schedule.on_date(view_date, case_id=case_filter)
+    target_date_str = view_date.strftime("%Y-%m-%d")
+
+    for event in active_drugs:
+        drug = event["drug"]
         
-        if drug_start <= view_date <= drug_end:
-            active_drugs.append(drug)
-            remaining = (drug_end - view_date).days
+        with st.container(border=True):
+            c1, c2, c3, c4, = st.columns([2.2, 1.5, 1, 0.8])
             
-            with st.container(border=True):
-                c1, c2, c3, c4, = st.columns([2.2, 1.5, 1, 0.8])
-                
-                with c1: st.markdown(f"**{drug['name']}**")
-                with c2: st.caption(f"{drug['time']}")
-                with c3: st.caption(f"📅 {days}일분")
-                with c4: st.markdown(f"**D-{remaining}**")
+            with c1: st.markdown(f"**{drug['name']}**")
+            with c2: st.caption(f"{drug['time']}")
+            with c3: st.caption(f"📅 {event['days']}일분")
+            with c4: st.markdown(f"**D-{event['remaining']}**")
 
 
-                st.divider()
-                
-                # [Time-based Check logic]
-                # 시간 파싱: "아침, 저녁" -> ["아침", "저녁"] / "식후 30분" -> ["식후 30분"]
-                time_list = [t.strip() for t in drug['time'].split(',')]
-                
-                # 한 줄에 여러 체크박스 배치
-                cols = st.columns(len(time_list))
-                target_date_str = view_date.strftime("%Y-%m-%d")
-
-                for idx, t_val in enumerate(time_list):
-                    with cols[idx]:
-                        # Key에 Time 포함 (Unique)
-                        h_key = (target_date_str, drug['name'], t_val)
-                        
-                        # DB에서 로드해온 기록 확인
-                        is_checked = st.session_state.check_history.get(h_key, False)
-                        
-                        if st.checkbox(f"{t_val} 복용", value=is_checked, key=f"cb_{i}_{target_date_str}_{drug['name']}_{t_val}"):
-                            if not is_checked: # False -> True 될 때
-                                db.toggle_check(user_id, target_date_str, drug['name'], t_val, True)
-                                st.session_state.check_history[h_key] = True
-                                st.rerun()
-                        else:
-                            if is_checked: # True -> False 될 때
-                                db.toggle_check(user_id, target_date_str, drug['name'], t_val, False)
-                                st.session_state.check_history[h_key] = False
-                                st.rerun()
+            st.divider()
+            
+            # [Time-based Check logic]
+            # 시간 파싱: "아침, 저녁" -> ["아침", "저녁"] / "식후 30분" -> ["식후 30분"]
+            time_list = event["slots"]
+            
+            # 한 줄에 여러 체크박스 배치
+            cols = st.columns(len(time_list))
+
+            for idx, t_val in enumerate(time_list):
+                with cols[idx]:
+                    # Key에 Time 포함 (Unique)
+                    h_key = (target_date_str, drug['name'], t_val)
+                    
+                    # DB에서 로드해온 기록 확인
+                    is_checked = st.session_state.check_history.get(h_key, False)
+                    
+                    if st.checkbox(f"{t_val} 복용", value=is_checked, key=f"cb_{event['med_index']}_{target_date_str}_{drug['name']}_{t_val}"):
+                        if not is_checked: # False -> True 될 때
+                            check_queue.enqueue(user_id, target_date_str, drug['name'], t_val, True)
+                            st.session_state.check_history[h_key] = True
+                            schedule.set_checked(target_date_str, drug['name'], t_val, True)
+                            st.rerun()
+                    else:
+                        if is_checked: # True -> False 될 때
+                            check_queue.enqueue(user_id, target_date_str, drug['name'], t_val, False)
+                            st.session_state.check_history[h_key] = False
+                            schedule.set_checked(target_date_str, drug['name'], t_val, False)
+                            st.rerun()
 
 
     if not active_drugs and filtered_medicines:
         st.info("해당 날짜에는 복용할 약이 없습니다.")
 
+    retrying = check_queue.retrying(user_id)
+    if retrying:
+        st.warning(f"체크 {retrying}건이 아직 저장되지 않았습니다. 연결이 복구되면 자동으로 저장됩니다.")
+
+    failed_checks = check_queue.failed(user_id)
+    if failed_checks:
+        with st.container(border=True):
+            st.error(f"체크 {len(failed_checks)}건을 저장하지 못했습니다.")
+            for f in failed_checks:
+                st.caption(f"{f['date']} {f['drug_name']} {f['time']} - {f['last_error']}")
+            c_retry, c_discard = st.columns(2)
+            if c_retry.button("🔁 다시 시도", key="retry_failed_checks", use_container_width=True):
+                check_queue.retry_failed(user_id); st.rerun()
+            if c_discard.button("🗑️ 버리기", key="discard_failed_checks", use_container_width=True):
+                # 서버 기록을 다시 불러와 화면의 체크 상태를 맞춤
+                check_queue.discard_failed(user_id)
+                st.session_state.pop('history_sync', None); st.rerun()
+
 st.divider()
 # with st.container(border=True):
 #     st.markdown("### ⚠️ 면책 조항 (Disclaimer)")
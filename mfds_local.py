@@ -0,0 +1,208 @@
+# mfds_local.py
+"""
+식약처 의약품 제품허가정보(DrugPrdtPrmsnInfoService07) 대량 덤프를 로컬 SQLite 인덱스로 적재하고,
+네트워크 없이 api_search.search_drug_api 와 같은 형태의 결과(item dict)를 돌려주는 오프라인 백엔드.
+
+적재:
+    python mfds_local.py <dump.json|dump.jsonl|dump.csv> [db_path]
+    python mfds_local.py data/mfds_fixture.json          # 샘플 데이터(개발/데모용)
+
+덤프 형식:
+    - JSON : item 리스트, 또는 API 응답 페이지({"body": {"items": [...]}}) / 그 리스트
+    - JSONL: 한 줄에 item 하나 (또는 응답 페이지 하나)
+    - CSV  : 헤더가 API 필드명(ITEM_SEQ, ITEM_NAME, MAIN_ITEM_INGR ...)인 표
+
+검색 우선순위 (식약처 item_name 부분 검색과 최대한 비슷하게):
+    1. item_name 완전 일치
+    2. 정규화 이름 완전 일치 (공백 제거/소문자/밀리그램->mg)
+    3. 괄호 제거 정규화 이름 완전 일치
+    4. 주성분(ingredient) 완전 일치
+    5. 정규화 이름 접두 일치 (인덱스 범위 검색)
+    6. 정규화 이름 부분 일치 (전체 스캔, 최후의 수단)
+"""
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+DEFAULT_DB_PATH = os.path.join("data", "mfds_local.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    item_seq  TEXT PRIMARY KEY,
+    item_name TEXT NOT NULL,
+    norm_name TEXT NOT NULL,
+    norm_base TEXT NOT NULL,
+    payload   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_item_name ON products(item_name);
+CREATE INDEX IF NOT EXISTS idx_products_norm_name ON products(norm_name);
+CREATE INDEX IF NOT EXISTS idx_products_norm_base ON products(norm_base);
+CREATE TABLE IF NOT EXISTS ingredients (
+    ingredient TEXT NOT NULL,
+    item_seq   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ingredients ON ingredients(ingredient);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_local = threading.local()
+
+
+# =========================================================
+# 1. 정규화
+# =========================================================
+def normalize_name(text):
+    """검색 키 정규화: NFC + 공백 제거 + 소문자 + 단위 통일"""
+    text = unicodedata.normalize("NFC", text or "")
+    text = re.sub(r'\s+', '', text).lower()
+    return text.replace("밀리그램", "mg").replace("밀리그람", "mg")
+
+def normalize_base(text):
+    """괄호(성분/제조사 표기) 제거 후 정규화"""
+    return normalize_name(re.sub(r'\(.*?\)', '', unicodedata.normalize("NFC", text or "")))
+
+def parse_ingredients(raw):
+    """'[M040702]포도당|[M040426]염화나트륨' -> ['포도당', '염화나트륨']"""
+    if not raw: return []
+    names = []
+    for part in re.split(r'[|,]', raw):
+        name = re.sub(r'\[.*?\]', '', part).strip()
+        if name: names.append(normalize_name(name))
+    return names
+
+
+# =========================================================
+# 2. 적재 (Ingest)
+# =========================================================
+def _iter_dump(path):
+    """덤프 파일에서 item dict를 하나씩 꺼냄"""
+    def unwrap(obj):
+        if isinstance(obj, list):
+            for o in obj: yield from unwrap(o)
+        elif isinstance(obj, dict) and "body" in obj:
+            yield from unwrap(obj["body"].get("items") or [])
+        elif isinstance(obj, dict) and "item" in obj and isinstance(obj["item"], dict):
+            yield obj["item"]
+        elif isinstance(obj, dict):
+            yield obj
+
+    if path.endswith(".csv"):
+        with open(path, "r", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip(): yield from unwrap(json.loads(line))
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from unwrap(json.load(f))
+
+def ingest(dump_path, db_path=DEFAULT_DB_PATH):
+    """덤프를 새 인덱스 파일로 적재 후 원자적으로 교체. 적재 건수 반환"""
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(_SCHEMA)
+    count = 0
+    with conn:
+        for item in _iter_dump(dump_path):
+            item_name = (item.get("ITEM_NAME") or "").strip()
+            if not item_name: continue
+            item_seq = str(item.get("ITEM_SEQ") or item_name)
+
+            conn.execute(
+                "INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?)",
+                (item_seq, item_name, normalize_name(item_name), normalize_base(item_name),
+                 json.dumps(item, ensure_ascii=False))
+            )
+            conn.execute("DELETE FROM ingredients WHERE item_seq = ?", (item_seq,))
+            raw_ingr = item.get("MAIN_ITEM_INGR") or item.get("ITEM_INGR_NAME") or ""
+            conn.executemany(
+                "INSERT INTO ingredients VALUES (?, ?)",
+                [(ingr, item_seq) for ingr in parse_ingredients(raw_ingr)]
+            )
+            count += 1
+
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [
+            ("source", os.path.basename(dump_path)),
+            ("ingested_at", time.strftime("%Y-%m-%d %H:%M:%S")),
+            ("count", str(count)),
+        ])
+    conn.execute("ANALYZE")
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    return count
+
+
+# =========================================================
+# 3. 검색 (search_drug_api 대체 백엔드)
+# =========================================================
+def _conn(db_path):
+    """스레드별 읽기 전용 연결 (인덱스 파일이 없으면 None)"""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        if not os.path.exists(db_path): return None
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        conns[db_path] = conn
+    return conn
+
+def _first(conn, sql, args):
+    row = conn.execute(sql, args).fetchone()
+    return json.loads(row[0]) if row else None
+
+def search(query, db_path=DEFAULT_DB_PATH):
+    """로컬 인덱스에서 약품 1건 검색 (API의 items[0]와 같은 dict, 없으면 None)"""
+    if not query: return None
+    conn = _conn(db_path)
+    if conn is None: return None
+
+    q = unicodedata.normalize("NFC", query).strip()
+    norm = normalize_name(q)
+    order = " ORDER BY length(p.item_name), p.item_seq LIMIT 1"
+
+    item = (
+        _first(conn, "SELECT payload FROM products p WHERE item_name = ?" + order, (q,))
+        or _first(conn, "SELECT payload FROM products p WHERE norm_name = ?" + order, (norm,))
+        or _first(conn, "SELECT payload FROM products p WHERE norm_base = ?" + order, (normalize_base(q),))
+        or _first(conn, "SELECT p.payload FROM ingredients i JOIN products p ON p.item_seq = i.item_seq"
+                        " WHERE i.ingredient = ?" + order, (norm,))
+    )
+    if item or not norm: return item
+
+    # 접두 일치: 인덱스 범위 검색 (norm <= name < norm + U+FFFF)
+    item = _first(conn, "SELECT payload FROM products p WHERE norm_name >= ? AND norm_name < ?" + order,
+                  (norm, norm + "\uffff"))
+    if item: return item
+
+    # 부분 일치 (식약처 item_name 검색과 동일한 동작, 전체 스캔)
+    return _first(conn, "SELECT payload FROM products p WHERE instr(norm_name, ?) > 0" + order, (norm,))
+
+def index_info(db_path=DEFAULT_DB_PATH):
+    """적재 정보 {source, ingested_at, count} (없으면 빈 dict)"""
+    conn = _conn(db_path)
+    if conn is None: return {}
+    return dict(conn.execute("SELECT key, value FROM meta").fetchall())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python mfds_local.py <dump.json|dump.jsonl|dump.csv> [db_path]")
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    dump_path = sys.argv[1]
+    db_path = os.path.join(current_dir, sys.argv[2] if len(sys.argv) > 2 else DEFAULT_DB_PATH)
+
+    t0 = time.time()
+    n = ingest(dump_path, db_path)
+    print(f"[INGEST] {n} products -> {db_path} ({time.time() - t0:.1f}s)")
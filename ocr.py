@@ -1,29 +1,30 @@
 # ocr.py
 import streamlit as st
-from google import genai
 from google.genai import types
 import PIL.Image
 import json
+import io
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 
-def run_ocr(image_file):
-    """
-    이미지 파일을 받아 Gemini 3 Flash를 이용해 1차 OCR 결과를 반환하는 함수
-    """
-    # 1. API 키 설정 (secrets.toml 사용)
-    try:
-        api_key = st.secrets["gemini_api_key"]
-    except:
-        st.error("❌ secrets.toml에 'gemini_api_key'가 설정되지 않았습니다.")
-        return []
-
-    client = genai.Client(api_key=api_key)
-    MODEL_ID = "gemini-3-flash-preview" 
+import llm_gateway
+import image_preprocess
+import tracing
 
-    # 2. 이미지 로드
-    img = PIL.Image.open(image_file)
+try:
+    PREPROCESS = bool(st.secrets.get("ocr_preprocess", True))
+    OCR_CACHE_SIZE = int(st.secrets.get("ocr_cache_size", 256))
+    # 디스크 캐시는 처방전 내용이 파일로 남으므로 명시적으로 경로를 줄 때만 사용
+    OCR_CACHE_DIR = st.secrets.get("ocr_cache_dir", "")
+except Exception:
+    PREPROCESS = True
+    OCR_CACHE_SIZE = 256
+    OCR_CACHE_DIR = ""
 
-    # 3. 프롬프트
-    SYSTEM_PROMPT = """
+# 프롬프트
+SYSTEM_PROMPT = """
     당신은 약봉투/처방전 OCR 전문가입니다.
     이미지에서 아래 정보를 추출하여 JSON 리스트로만 응답하세요.
     
@@ -38,15 +39,141 @@ def run_ocr(image_file):
     [{"medicine_name": "...", "dosage": "...", "frequency": "...", "days": "...", "usage": "..."}]
     """
 
+# 프롬프트/모델이 바뀌면 이전 캐시는 자동으로 무효 (키에 포함)
+_PROMPT_VERSION = hashlib.sha256(
+    f"{SYSTEM_PROMPT}|{llm_gateway.MODEL_ID}".encode("utf-8")
+).hexdigest()[:16]
+# 전처리 설정(긴 변 상한/JPEG 품질/용량 예산/흑백)과 전처리 코드 버전도 키에 포함
+# (전처리 없이 원본을 보낸 결과와도 구분)
+_PREPROCESS_VERSION = hashlib.sha256(
+    image_preprocess.settings_signature().encode("utf-8")
+).hexdigest()[:8]
+
+
+class OcrResultCache:
+    """이미지 내용 해시 -> OCR 결과. 메모리 LRU(크기 제한) + 선택적 디스크 계층"""
+
+    def __init__(self, max_entries=256, disk_dir=""):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(image_bytes, kind, preprocess=True):
+        """kind: "raw"(업로드 원본) / "normalized"(전처리 결과, 전처리 설정이 같으면 동일)"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        prep = _PREPROCESS_VERSION if preprocess else "orig"
+        return f"{_PROMPT_VERSION}-{prep}-{kind}-{digest}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key):
+        """(결과, 계층) 반환. 계층: "memory" / "disk" / None(미스)"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key], "memory"
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                self._put_memory(key, result)
+                return result, "disk"
+            except (OSError, ValueError):
+                pass
+        return None, None
+
+    def put(self, key, result):
+        self._put_memory(key, result)
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                tmp_path = self._disk_path(key) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(result, f, ensure_ascii=False)
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError as e:
+                print(f"[WARN] OCR 디스크 캐시 저장 실패: {e}")
+
+    def _put_memory(self, key, result):
+        with self._lock:
+            self._items[key] = result
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+@st.cache_resource
+def get_ocr_cache():
+    """프로세스 공용 OCR 캐시 (세션 간 공유)"""
+    disk_dir = OCR_CACHE_DIR
+    if disk_dir and not os.path.isabs(disk_dir):
+        disk_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), disk_dir)
+    return OcrResultCache(OCR_CACHE_SIZE, disk_dir)
+
+
+def run_ocr(image_file, metrics=None, preprocess=None, use_cache=True):
+    """
+    이미지 파일을 받아 Gemini 3 Flash를 이용해 1차 OCR 결과를 반환하는 함수
+    - metrics: pipeline_metrics (LLM 지연/토큰, 전처리 통계, 캐시 적중 기록용, 선택)
+    - preprocess: 업로드 전 이미지 전처리 여부 (기본: secrets의 ocr_preprocess, true)
+    - use_cache: 같은 이미지(내용 해시)를 다시 올리면 OCR 호출 없이 이전 결과 재사용
+    """
+    if preprocess is None: preprocess = PREPROCESS
+    ocr_metrics = metrics.setdefault("ocr", {}) if metrics is not None else {}
+
+    cache = get_ocr_cache() if use_cache else None
+    raw_bytes = image_preprocess.read_image_bytes(image_file)
+
+    # 1. 원본 바이트 해시로 먼저 조회 (같은 파일 재업로드 -> 전처리도 생략)
+    raw_key = OcrResultCache.make_key(raw_bytes, "raw", preprocess)
+    if cache:
+        cached, tier = cache.get(raw_key)
+        if cached is not None:
+            ocr_metrics.update({"cache_hit": True, "cache_tier": tier, "cache_key": "raw"})
+            return [dict(d) for d in cached]
+
+    # 2. 이미지 로드 (+ 전처리: 회전 보정/리사이즈/흑백·대비/JPEG 용량 예산)
+    if preprocess:
+        with tracing.span(metrics, "ocr.preprocess"):
+            img_bytes, prep_stats = image_preprocess.preprocess_image(raw_bytes)
+        img = types.Part.from_bytes(data=img_bytes, mime_type="image/jpeg")
+        ocr_metrics["preprocess"] = prep_stats
+    else:
+        img_bytes = raw_bytes
+        img = PIL.Image.open(io.BytesIO(raw_bytes))
+
+    # 정규화(전처리)된 이미지 해시로 조회 (다른 기기에서 재업로드 등 원본 바이트만 다른 경우)
+    cache_keys = [raw_key]
+    if preprocess:
+        norm_key = OcrResultCache.make_key(img_bytes, "normalized")
+        cache_keys.append(norm_key)
+        if cache:
+            cached, tier = cache.get(norm_key)
+            if cached is not None:
+                cache.put(raw_key, cached)
+                ocr_metrics.update({"cache_hit": True, "cache_tier": tier, "cache_key": "normalized"})
+                return [dict(d) for d in cached]
+    if cache: ocr_metrics["cache_hit"] = False
+
+    # 3. API 키 설정 (secrets.toml 사용, 클라이언트는 게이트웨이에서 재사용)
+    if llm_gateway.get_client() is None:
+        st.error("❌ secrets.toml에 'gemini_api_key'가 설정되지 않았습니다.")
+        return []
+
     # 4. Gemini 호출
     try:
-        response = client.models.generate_content(
-            model=MODEL_ID,
+        response = llm_gateway.generate(
             contents=[SYSTEM_PROMPT, img],
             config=types.GenerateContentConfig(
                 temperature=0.0, # 정확도를 위해 0으로 설정 
                 response_mime_type="application/json" 
-            )
+            ),
+            metrics=metrics,
+            stage="ocr"
         )
         
         # 5. 결과 파싱
@@ -56,10 +183,16 @@ def run_ocr(image_file):
         
         if start_idx != -1 and end_idx != -1:
             json_str = res_text[start_idx:end_idx+1]
-            return json.loads(json_str)
+            result = json.loads(json_str)
         else:
-            return json.loads(res_text)
+            result = json.loads(res_text)
+
+        # 정상 결과만 캐시 (빈 결과/오류는 다음 업로드에서 다시 시도)
+        if cache and isinstance(result, list) and result and all(isinstance(d, dict) for d in result):
+            for key in cache_keys:
+                cache.put(key, [dict(d) for d in result])
+        return result
 
     except Exception as e:
         st.error(f"OCR 처리 중 오류 발생: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -6,47 +6,59 @@ from symspellpy import SymSpell, Verbosity
 from jamo import h2j, j2hcj
 
 import os 
+import symspell_index
 
 # === [DB 로딩 캐싱] 속도 최적화 ===
 @st.cache_resource
-def load_symspell_db(db_path='drug_db.csv'): 
+def load_symspell_db(db_path='drug_db.csv', index_path=symspell_index.DEFAULT_INDEX_PATH): 
     # print(f"[DEBUG] load_symspell_db 시작")
-    sym_spell = SymSpell(max_dictionary_edit_distance=2, prefix_length=7)
-    jamo_to_original = {}
-    
     # 절대 경로 계산 (현재 파일 위치 기준)
     current_dir = os.path.dirname(os.path.abspath(__file__))
     full_path = os.path.join(current_dir, db_path)
+    full_index_path = os.path.join(current_dir, index_path)
     # print(f"[DEBUG] DB 경로: {full_path}")
 
+    # 호스트 공용 아티팩트를 mmap (없거나 오래됐으면 락을 잡은 한 프로세스만 CSV로 빌드)
+    # -> 여러 Streamlit 프로세스가 같은 읽기 전용 페이지를 공유
     if not os.path.exists(full_path):
-        # print(f"[ERROR] DB 파일이 없습니다: {full_path}")
-        return None, None
+        # 원본 CSV 없이 배포된 경우 아티팩트만으로 동작
+        try:
+            return symspell_index.load_index(full_index_path)
+        except Exception as e:
+            # print(f"[ERROR] DB 파일이 없습니다: {full_path}")
+            return None, None
     
     try:
-        with open(full_path, 'r', encoding='utf-8-sig') as f:
-            reader = csv.DictReader(f)
-            count = 0
-            for row in reader:
-                full_name = row.get('drug_name', '').strip() 
-                if not full_name: continue
-                
-                # 전처리
-                search_name = re.sub(r'\(.*?\)', '', full_name).strip()
-                search_name = normalize_unit(search_name)
-                jamo_word = decompose_text(search_name)
-                
-                sym_spell.create_dictionary_entry(jamo_word, 1)
-                
-                clean_full_name = re.sub(r'\s+', '', full_name)
-                jamo_to_original[jamo_word] = convert_to_api_format(clean_full_name)
-                count += 1
-            # print(f"[DEBUG] DB 로딩 완료. {count}개 단어 로드됨.")
-                
+        return symspell_index.ensure_index(full_index_path, full_path, build_symspell_from_csv)
     except Exception as e:
         st.error(f"DB 로딩 실패: {e}")
         print(f"[ERROR] DB 로딩 예외: {e}")
         return None, None
+
+
+def build_symspell_from_csv(full_path):
+    """drug_db.csv를 파싱해 SymSpell 사전과 jamo_to_original 맵을 메모리에 생성"""
+    sym_spell = SymSpell(max_dictionary_edit_distance=2, prefix_length=7)
+    jamo_to_original = {}
+
+    with open(full_path, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        count = 0
+        for row in reader:
+            full_name = row.get('drug_name', '').strip() 
+            if not full_name: continue
+            
+            # 전처리
+            search_name = re.sub(r'\(.*?\)', '', full_name).strip()
+            search_name = normalize_unit(search_name)
+            jamo_word = decompose_text(search_name)
+            
+            sym_spell.create_dictionary_entry(jamo_word, 1)
+            
+            clean_full_name = re.sub(r'\s+', '', full_name)
+            jamo_to_original[jamo_word] = convert_to_api_format(clean_full_name)
+            count += 1
+        # print(f"[DEBUG] DB 로딩 완료. {count}개 단어 로드됨.")
         
     return sym_spell, jamo_to_original
 
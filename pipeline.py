@@ -0,0 +1,454 @@
+# pipeline.py
+"""
+처방전 분석 파이프라인 (Streamlit 화면 없이 호출 가능)
+OCR -> SymSpell 보정 -> 식약처 검증(재시도 사다리) -> DUR -> LLM 분석 -> (선택) DB 저장
+- main.py 업로드 버튼, 배치 CLI, 벤치마크가 같은 코드를 사용
+- 리포트의 meta_analysis 스키마(품질 점수, 신뢰도 타임라인, 생존 퍼널, KPI)도 여기서 조립
+
+배치 CLI (폴더 안 이미지 일괄 처리 -> JSONL):
+    python pipeline.py <이미지 폴더> [--out reports.jsonl] [--workers 4]
+    python pipeline.py <이미지 폴더> --persist --user-id <사용자 ID>   # Supabase에도 저장
+    python pipeline.py <이미지 폴더> --out reports.jsonl --resume      # 이미 성공한 이미지는 건너뜀
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import closing
+
+import ocr
+import ocr_correction
+import api_search
+import care_processor
+import interaction_checker
+import tracing
+import db
+
+MEDICINE_COLORS = [
+    "#FF6B6B", "#4ECDC4", "#45B7D1", "#FFA07A", "#98D8C8",
+    "#F06292", "#AED581", "#FFD54F", "#4DB6AC", "#9575CD"
+]
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+
+
+class PipelineError(Exception):
+    """단계 실패 (stage: "ocr" / "llm")"""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+def random_color():
+    """약 구분을 위한 랜덤 색상 부여"""
+    return random.choice(MEDICINE_COLORS)
+
+
+# =========================================================
+# 1. 분석 (저장 없음)
+# =========================================================
+def analyze(image_file, metrics, on_progress=None, on_drug=None, use_ocr_cache=True):
+    """
+    이미지 1장 분석 -> {ocr_result, corrected_drugs, validated_drugs, warnings, ai_result, first_content_time}
+    - metrics: pipeline_metrics (tracing.start_trace 후 전달하면 단계별 span 기록)
+    - on_progress(message): 단계 시작 알림 (UI 진행 표시용, 선택)
+    - on_drug(item): 약물 카드가 완성될 때마다 호출 (스트리밍 표시용, 선택)
+    실패 시 PipelineError
+    """
+    progress = on_progress or (lambda message: None)
+
+    # [1] OCR + 보정 실행
+    progress("👁️ 글자를 읽고 있습니다... (OCR)")
+    with tracing.span(metrics, "ocr"):
+        ocr_result = ocr.run_ocr(image_file, metrics=metrics, use_cache=use_ocr_cache)
+
+    # [Metric] OCR 지표 수집 (전처리 통계는 run_ocr가 "preprocess"에 기록)
+    metrics.setdefault("ocr", {}).update({
+        "success": True if ocr_result else False,
+        "extracted_count": len(ocr_result) if ocr_result else 0
+    })
+    if not ocr_result:
+        raise PipelineError("ocr", "OCR 실패 (텍스트 없음)")
+
+    progress("🔧 약물 DB와 대조하여 오타를 수정합니다...")
+    with tracing.span(metrics, "correction"):
+        corrected_drugs, correction_stats = ocr_correction.correct_drug_names(ocr_result)
+    metrics["correction"] = correction_stats
+
+    # [2] API 검증 (재시도 로직 포함)
+    progress("🔍 식약처 데이터를 조회합니다... (3단계 정밀 검색)")
+    api_stats = {
+        "attempted": 0,
+        "matched": 0,
+        "retry_count": 0,
+        "source": "MFDS (식품의약품안전처)",
+        "endpoint": "DrugPrdtPrmsnInfoService07 (의약품제품허가정보)",
+        "api_version": "v1 (getDrugPrdtPrmsnDtlInq06)",
+        "backend": api_search.BACKEND, # api (OpenAPI) / local (오프라인 인덱스)
+        "cache_hit": 0,
+        "cache_miss": 0
+    }
+
+    # 4단계 재시도 로직 (Full -> No Dosage -> No Paren -> Prefix)을 약물별로 동시에 수행
+    base_names = [drug.get('corrected_medicine_name', drug.get('medicine_name')) for drug in corrected_drugs]
+    with tracing.span(metrics, "mfds", drugs=len(base_names)):
+        search_results = api_search.search_drugs_batch(base_names, stats=api_stats, metrics=metrics)
+
+    validated_drugs = []
+    for drug, (search_res, retries) in zip(corrected_drugs, search_results):
+        api_stats["attempted"] += 1
+        api_stats["retry_count"] += retries
+
+        if search_res:
+            api_stats["matched"] += 1
+            drug['efficacy'] = api_search.remove_xml_tags(search_res.get('efcyQesitm', ''))
+            drug['usage'] = api_search.remove_xml_tags(search_res.get('useMethodQesitm', ''))
+            drug['caution'] = api_search.remove_xml_tags(search_res.get('atpnQesitm', ''))
+            # [Cache Key] 약물별 LLM 분석 캐시용 정규 품목명/품목기준코드
+            drug['mfds_item_name'] = search_res.get('ITEM_NAME') or search_res.get('itemName')
+            drug['mfds_item_seq'] = search_res.get('ITEM_SEQ') or search_res.get('itemSeq')
+
+        validated_drugs.append(drug)
+    metrics["api"] = api_stats
+
+    # [3] DUR 및 LLM 분석
+    progress("🧠 AI가 복약 지도를 작성 중입니다...")
+    with tracing.span(metrics, "dur"):
+        warnings = interaction_checker.check_interactions(validated_drugs)
+    metrics["dur"] = {
+        "interaction_count": len(warnings),
+        "has_warning": len(warnings) > 0
+    }
+
+    final_json = {
+        "drugs": validated_drugs,
+        "meta": {"source": "Medilens", "timestamp": str(datetime.datetime.now())}
+    }
+    ai_result = {"error": "AI 분석 실패: 결과 없음"}
+    first_content_time = None # [Latency 측정] 첫 약물 카드 완성 시점
+    with tracing.span(metrics, "llm"):
+        # on_drug 콜백이 실패해도 LLM 스트림(게이트웨이 동시 호출 슬롯)을 바로 닫음
+        with closing(care_processor.analyze_with_llm_stream(final_json, metrics=metrics)) as events:
+            for event, data in events:
+                if event == "drug":
+                    if first_content_time is None:
+                        first_content_time = time.time()
+                    if on_drug: on_drug(data)
+                elif event == "result":
+                    ai_result = data
+
+    if "error" in ai_result:
+        raise PipelineError("llm", ai_result["error"])
+
+    # DUR 결과 병합 (LLM 결과에 없을 수도 있으므로)
+    if not ai_result.get('interactions'):
+        ai_result['interactions'] = warnings
+
+    return {
+        "ocr_result": ocr_result,
+        "corrected_drugs": corrected_drugs,
+        "validated_drugs": validated_drugs,
+        "warnings": warnings,
+        "ai_result": ai_result,
+        # 첫 카드 없이 끝난 경우(약물 0건)는 리포트 완료 시점으로 기록
+        "first_content_time": first_content_time or time.time(),
+    }
+
+
+# =========================================================
+# 2. 저장용 데이터 조립
+# =========================================================
+def build_medicine_entries(ai_result, start_date, color_fn=random_color):
+    """LLM 결과 -> db.save_case용 약물 dict 리스트"""
+    entries = []
+    for drug in ai_result.get('drug_analysis', []):
+        try:
+            days = int(drug.get('days', 3))
+        except (TypeError, ValueError):
+            days = 3
+
+        # 약물별 개별 스케줄 우선 적용, 없으면 전체 공용 스케줄 사용
+        d_schedule = drug.get('time_list', []) or ai_result.get('schedule_time_list', ["식후 30분"])
+
+        entries.append({
+            "name": drug.get('name', '알 수 없음'),
+            "days": days,
+            "color": color_fn(),
+            "time": ", ".join(d_schedule), # 리스트 -> 문자열 변환 ("아침, 점심, 저녁")
+            "start_date": start_date,
+            "efficacy": drug.get('efficacy', '-'),
+            "usage": drug.get('usage', '-'),
+            "info": drug.get('caution', '특이사항 없음'),
+            "food": drug.get('food_guide', '특이사항 없음')
+        })
+    return entries
+
+
+def save_case(user_id, entries, report, case_id, metrics=None, replace=False):
+    """약물 + 리포트 일괄 저장 (db.save_case) -> {"saved", "round_trips", "via", "latency_ms", "error"?}"""
+    started = time.time()
+    with tracing.span(metrics, "db.save_case", drugs=len(entries)) as sp:
+        result = db.save_case(user_id, entries, report, case_id, replace=replace)
+        sp.update(round_trips=result["round_trips"], via=result["via"])
+    result["latency_ms"] = int((time.time() - started) * 1000)
+    return result
+
+
+def build_meta(ai_result, metrics, case_id, start_time, first_content_time, corrected_count):
+    """
+    [Phase 4] Advanced Analytics & Meta Data Construction
+    품질 점수 / 신뢰도 타임라인 / 생존 퍼널 / KPI -> meta_analysis dict
+    (타임라인/퍼널은 metrics에도 기록되어 meta["pipeline"]으로 함께 저장됨)
+    """
+    # 1. 신뢰도 점수 계산 (Data Quality Score)
+    quality_score = 100
+    breakdown = []
+
+    # (1) OCR Check (치명적 실패)
+    if not metrics.get('ocr', {}).get('success', False):
+        quality_score -= 40
+        breakdown.append("OCR 인식 실패 (-40)")
+
+    # (2) Correction Check (과도한 보정)
+    corr_stats = metrics.get('correction', {})
+    if corr_stats.get('total_edits', 0) > 10:
+        quality_score -= 10
+        breakdown.append("과도한 오타 보정 (-10)")
+
+    # (3) API Match Check (매칭 실패율 반영)
+    api_stats = metrics.get('api', {})
+    attempted = api_stats.get('attempted', 1)
+    matched = api_stats.get('matched', 0)
+    success_rate = matched / attempted if attempted > 0 else 0.0
+
+    if success_rate < 1.0:
+        # 실패율 * 40점 감점
+        penalty = int((1.0 - success_rate) * 40)
+        quality_score -= penalty
+        breakdown.append(f"식약처 미매칭 {attempted-matched}건 (-{penalty})")
+
+    # (참고) DUR/Safety 지표는 점수에서 제외 (별도 리스크 카드로 분리)
+
+    # 점수 보정 (0~100)
+    quality_score = max(0, min(100, quality_score))
+
+    # [Explicit Feedback] 만점인 경우 성공 메시지 명시
+    if quality_score == 100:
+        breakdown.append("Perfect Match: No penalties applied (OCR, API, Correction passed)")
+
+    # [Latency 측정] 분석 종료 및 시간 계산
+    end_time = time.time()
+    total_latency_ms = int((end_time - start_time) * 1000)
+    time_to_first_content_ms = int((first_content_time - start_time) * 1000)
+
+    # 2. 메타 데이터 조립
+    meta = {
+        "case_id": case_id, # [Traceability] 처방전 식별 ID (DB와 리포트 연결 고리)
+        "risk_level": ai_result.get('meta_analysis', {}).get('risk_level', 'Unknown'),
+        "quality_score": quality_score,
+        "quality_breakdown": breakdown,
+        "pipeline": metrics, # (Refactored) Standardized key
+        "data_sources": {
+            "primary": "MFDS (식품의약품안전처)",
+            "coverage_pct": int(success_rate * 100),
+            "total_drugs": attempted
+        },
+        "safety_summary": { # 대시보드 표시용 별도 카드 데이터
+            "interaction_count": metrics.get('dur', {}).get('interaction_count', 0),
+            "has_warning": metrics.get('dur', {}).get('has_warning', False)
+        },
+        "case_summary": { # [New] 처방전 규모 요약 (Volume Context)
+            "total_drugs": attempted,
+            "verified_drugs": matched,
+            "unverified_drugs": attempted - matched,
+            "success_ratio": success_rate
+        },
+        "meta_version": "1.1", # [Legacy Check] 리포트 버전 태깅 (1.1 = Funnel Data Available)
+        # [Dashboard KPI] 대시보드용 핵심 성과 지표 (Pre-calcutated)
+        "kpis": {
+            "drug_name_accuracy_proxy": round(success_rate * 100, 1), # 약물명 인식 정확도 (대체지표)
+            "api_success_rate": round(success_rate * 100, 1),         # (Refactored) API 검색 성공률
+            "total_latency_ms": total_latency_ms,                    # 총 처리 속도 (ms)
+            "time_to_first_content_ms": time_to_first_content_ms     # 첫 약물 카드 표시까지 (ms)
+        }
+    }
+
+    # [New] Confidence Timeline Logic (60 -> 80 -> 100)
+    # "데이터가 이 과정을 거치며 점점 더 믿을만해진다"는 가치 시각화
+    timeline = [{"stage": "Start", "score": 0}]
+
+    # 1. OCR Stage (Base: 60) / 2. Correction Stage (Base: 80)
+    if attempted > 0:
+        timeline.append({"stage": "OCR Extraction", "score": 60})
+        timeline.append({"stage": "SymSpell Correction", "score": 80})
+
+    # 3. Validation Stage (Final: 100)
+    final_score = 80
+    if success_rate == 1.0:
+        final_score = 100
+    elif success_rate > 0:
+        final_score = 80 + int(success_rate * 20) # 부분 점수
+
+    timeline.append({"stage": "API Validation", "score": final_score})
+    metrics["confidence_timeline"] = timeline
+
+    # [New] Drug Survival Funnel Metrics (OCR -> Correction -> API)
+    metrics["drug_survival"] = {
+        "ocr": metrics.get('ocr', {}).get('extracted_count', 0),
+        "correction": corrected_count,
+        "api": matched
+    }
+    return meta
+
+
+def build_report(ai_result, meta):
+    """리포트 DB 저장용 dict (LLM 리포트 + 약물 목록 + meta_analysis). 리포트가 없으면 None"""
+    if "report" not in ai_result:
+        return None
+    report_data = ai_result["report"]
+    report_data["medicines"] = ai_result.get('drug_analysis', [])
+    report_data["meta_analysis"] = meta
+    return report_data
+
+
+# =========================================================
+# 3. 전체 실행 (1건)
+# =========================================================
+def run(image_file, user_id=None, persist=False, start_date=None, use_ocr_cache=True,
+        on_progress=None, on_drug=None, metrics=None, case_id=None, replace=False):
+    """
+    이미지 1장을 끝까지 처리 -> {case_id, status("ok"/"error"), error?, stage?, saved_medicines, medicines, report, metrics}
+    - persist: True면 user_id로 약물/리포트를 DB에 일괄 저장 (db.save_case, 작업 큐 업로드와 동일)
+    - report["meta_analysis"]는 main.py가 저장하는 것과 같은 스키마
+    - on_progress / on_drug: analyze()와 동일 (작업 큐의 진행 상황 표시용)
+    - metrics: 미리 채워 둘 pipeline_metrics (예: 작업 큐 대기 시간). 없으면 새로 만듦
+    - case_id: 처방전 ID (없으면 새로 만듦). 작업 큐는 job_id를 넘겨 재실행해도 같은 ID로 저장
+    - replace: 같은 case_id로 이미 저장된 약물/리포트를 지우고 저장 (작업 재실행 시 중복 방지)
+    """
+    start_time = time.time()
+    metrics = metrics if metrics is not None else {}
+    tracing.start_trace(metrics)
+    case_id = case_id or str(uuid.uuid4())
+
+    try:
+        analysis = analyze(image_file, metrics, on_progress=on_progress, on_drug=on_drug,
+                           use_ocr_cache=use_ocr_cache)
+    except PipelineError as e:
+        return {"case_id": case_id, "status": "error", "stage": e.stage, "error": str(e),
+                "metrics": metrics}
+
+    ai_result = analysis["ai_result"]
+    entries = build_medicine_entries(ai_result, start_date or datetime.date.today())
+    meta = build_meta(ai_result, metrics, case_id, start_time,
+                      analysis["first_content_time"], len(analysis["corrected_drugs"]))
+    report = build_report(ai_result, meta)
+
+    result = {"case_id": case_id, "status": "ok", "saved_medicines": 0,
+              "medicines": entries, "report": report, "metrics": metrics}
+    if persist:
+        # 리포트의 meta_analysis.pipeline은 metrics 자체이므로, 저장 직전 사본을 보냄
+        # (저장 중 열린 db.save_case span이 리포트에 섞이지 않도록)
+        # 저장 지연 / 왕복 수는 저장이 끝나야 알 수 있으므로 반환되는 metrics(db.save_case span,
+        # persist)와 result["persist"](배치 JSONL / 작업 큐 결과)로 전달. 리포트를 다시 쓰지 않음
+        # (저장된 행에는 save_case RPC가 서버 측 처리 시간을 pipeline.persist로 기록)
+        saved = save_case(user_id, entries, copy.deepcopy(report), case_id, metrics, replace=replace)
+        result["saved_medicines"] = saved["saved"]
+        result["persist"] = saved
+        metrics["persist"] = {k: saved.get(k) for k in ("latency_ms", "round_trips", "via")}
+        if "error" in saved:
+            result.update(status="error", stage="persist", error=saved["error"])
+    return result
+
+
+# =========================================================
+# 4. 배치 CLI
+# =========================================================
+def _done_images(out_path):
+    """--resume: 출력 JSONL에서 이미 성공한 이미지 이름"""
+    done = set()
+    if not os.path.exists(out_path): return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if row.get("status") == "ok": done.add(row.get("image"))
+    return done
+
+
+def run_batch(paths, out_path, workers=4, user_id=None, persist=False, use_ocr_cache=True, append=False):
+    """
+    이미지 경로 목록을 제한된 작업자 풀로 처리, 끝나는 순서대로 JSONL 한 줄씩 기록
+    (한 번에 workers * 2건까지만 제출 -> 대량 폴더에서도 메모리 일정). 반환: (성공, 실패) 건수
+    """
+    ok = failed = 0
+    pending = set()
+    paths = iter(paths)
+
+    def process(path):
+        started = time.time()
+        try:
+            result = run(path, user_id=user_id, persist=persist, use_ocr_cache=use_ocr_cache)
+        except Exception as e:
+            result = {"status": "error", "stage": "exception", "error": str(e)}
+        result.pop("metrics", None)  # 성공 건은 report.meta_analysis.pipeline에 포함됨
+        return {"image": os.path.basename(path), "elapsed_ms": int((time.time() - started) * 1000), **result}
+
+    with open(out_path, "a" if append else "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline") as pool:
+        while True:
+            for path in paths:
+                pending.add(pool.submit(process, path))
+                if len(pending) >= workers * 2: break
+            if not pending: break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                row = fut.result()
+                out.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+                if row["status"] == "ok": ok += 1
+                else: failed += 1
+                print(f"[{row['status'].upper()}] {row['image']} ({row['elapsed_ms']} ms)"
+                      + (f" - {row.get('error')}" if row["status"] != "ok" else ""))
+    return ok, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image_dir")
+    parser.add_argument("--out", default="reports.jsonl", help="결과 JSONL 경로 (기본 reports.jsonl)")
+    parser.add_argument("--workers", type=int, default=4, help="동시 처리 이미지 수 (기본 4)")
+    parser.add_argument("--persist", action="store_true", help="Supabase에 약물/리포트 저장")
+    parser.add_argument("--user-id", help="--persist 시 저장할 사용자 ID")
+    parser.add_argument("--resume", action="store_true", help="출력 파일에서 이미 성공한 이미지는 건너뜀")
+    parser.add_argument("--no-ocr-cache", action="store_true", help="OCR 결과 캐시 사용 안 함")
+    args = parser.parse_args()
+
+    if args.persist and not args.user_id:
+        sys.exit("--persist에는 --user-id가 필요합니다.")
+
+    names = sorted(f for f in os.listdir(args.image_dir) if f.lower().endswith(IMAGE_EXTS))
+    if args.resume:
+        done = _done_images(args.out)
+        names = [n for n in names if n not in done]
+    if not names:
+        sys.exit(f"처리할 이미지가 없습니다: {args.image_dir}")
+
+    t0 = time.time()
+    ok, failed = run_batch([os.path.join(args.image_dir, n) for n in names], args.out,
+                           workers=args.workers, user_id=args.user_id, persist=args.persist,
+                           use_ocr_cache=not args.no_ocr_cache, append=args.resume)
+    print(f"[BATCH] {ok} ok / {failed} failed -> {args.out} ({time.time() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+-- supabase/check_history_sync.sql
+-- 복용 기록 기간 조회 / 증분 동기화용 컬럼과 인덱스 (db.load_history, db.sync_history)
+-- Supabase 대시보드 SQL Editor에서 1회 실행. 없으면 db.sync_history가 매번 기간 전체를 다시 조회
+
+alter table public.check_history
+    add column if not exists updated_at timestamptz not null default now();
+
+-- upsert(on conflict do update)로 바뀐 행도 updated_at 갱신
+create or replace function public.touch_updated_at() returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+drop trigger if exists check_history_touch on public.check_history;
+create trigger check_history_touch
+    before update on public.check_history
+    for each row execute function public.touch_updated_at();
+
+-- 달력 기간 조회 / 증분 동기화
+create index if not exists check_history_user_date on public.check_history (user_id, date);
+create index if not exists check_history_user_updated on public.check_history (user_id, updated_at);
@@ -0,0 +1,82 @@
+-- supabase/report_stats.sql
+-- 대시보드 / 통계용 서버 측 집계 (db.get_report_kpis, db.get_stage_latency_stats, db.get_analysis_stats)
+-- report_json 전체를 내려받지 않고 KPI 컬럼 / 집계 결과만 전달
+-- Supabase 대시보드 SQL Editor에서 1회 실행. 없으면 db.py가 report_json을 받아 같은 값을 직접 계산
+
+create index if not exists reports_user_created on public.reports (user_id, created_at desc);
+
+-- 리포트 1건 = KPI 1행 (main.py 대시보드의 케이스 목록 / 카드)
+create or replace view public.report_kpis
+with (security_invoker = on) as
+select
+    r.id,
+    r.user_id,
+    r.created_at,
+    coalesce(m.meta->>'case_id', r.case_id::text, 'unknown') as case_id,
+    coalesce((m.meta->>'quality_score')::numeric, 0) as quality_score,
+    coalesce((p.pipeline->'ocr'->>'success')::boolean, false) as ocr_success,
+    coalesce((m.meta->'kpis'->>'api_success_rate')::numeric,
+             (m.meta->'kpis'->>'search_success_rate')::numeric, 0) as api_success_rate,
+    coalesce((m.meta->'data_sources'->>'coverage_pct')::numeric, 0) as mfds_coverage,
+    coalesce((m.meta->'kpis'->>'total_latency_ms')::numeric, 0) as latency_ms,
+    (m.meta->'kpis'->>'time_to_first_content_ms')::numeric as ttfc_ms,
+    coalesce((p.pipeline->'api'->>'retry_count')::integer, 0) as retry_count,
+    coalesce(m.meta->>'risk_level', 'Unknown') as risk_level,
+    coalesce((m.meta->'safety_summary'->>'interaction_count')::integer, 0) as interaction_count,
+    coalesce((m.meta->'safety_summary'->>'has_warning')::boolean, false) as has_warning
+from public.reports r
+cross join lateral (select coalesce(r.report_json->'meta_analysis', '{}'::jsonb) as meta) m
+cross join lateral (select coalesce(m.meta->'pipeline', m.meta->'pipeline_metrics', '{}'::jsonb) as pipeline) p;
+
+-- 단계(span 이름)별 지연 p50 / p95 (전체 리포트의 pipeline.trace 기준, 끝난 span만)
+create or replace function public.report_stage_latency(p_user_id text)
+returns table (stage text, p50 double precision, p95 double precision, n integer)
+language sql
+stable
+as $$
+    select
+        s->>'name',
+        percentile_cont(0.5) within group (order by (s->>'duration_ms')::double precision),
+        percentile_cont(0.95) within group (order by (s->>'duration_ms')::double precision),
+        count(*)::integer
+    from public.reports r
+    cross join lateral jsonb_array_elements(coalesce(
+        r.report_json->'meta_analysis'->'pipeline'->'trace'->'spans',
+        r.report_json->'meta_analysis'->'pipeline_metrics'->'trace'->'spans',
+        '[]'::jsonb
+    )) s
+    where r.user_id::text = p_user_id
+      and s->>'duration_ms' is not null  -- 리포트 직렬화 시점에 열려 있던 span 제외
+    group by 1;
+$$;
+
+-- 위험도 분포 / 상호작용 수 / 품질 이슈 건수
+create or replace function public.analysis_stats(p_user_id text)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'total_reports', count(*),
+        'risk_distribution', jsonb_build_object(
+            'High', count(*) filter (where risk = 'High'),
+            'Medium', count(*) filter (where risk = 'Medium'),
+            'Low', count(*) filter (where risk = 'Low')
+        ),
+        'total_interactions', coalesce(sum(interactions), 0),
+        'quality_issues', count(*) filter (where issue)
+    )
+    from (
+        select
+            coalesce(meta->>'risk_level', 'Low') as risk,
+            coalesce((meta->>'interaction_count')::integer,
+                     (meta->'safety_summary'->>'interaction_count')::integer, 0) as interactions,
+            (meta->'quality_flags'->>'api_match_success')::boolean is false
+                or coalesce((meta->'case_summary'->>'unverified_drugs')::integer, 0) > 0 as issue
+        from (
+            select report_json->'meta_analysis' as meta
+            from public.reports
+            where user_id::text = p_user_id
+        ) r
+    ) x;
+$$;
@@ -0,0 +1,48 @@
+-- supabase/save_case.sql
+-- 처방전 1건(약물 여러 개 + 리포트)을 한 트랜잭션으로 저장하는 RPC (db.save_case)
+-- Supabase 대시보드 SQL Editor에서 1회 실행. 없으면 db.save_case가 일괄 insert(왕복 2회)로 대신 저장
+--
+-- p_medicines: medicines 행 JSON 배열 (db._medicine_row 형식), p_report: report_json (없으면 null)
+-- 반환: 저장한 약물 행 수
+-- 같은 case_id로 이미 저장된 약물/리포트는 먼저 지움 -> 작업 큐가 같은 작업을 다시 실행해도 중복 저장되지 않음
+-- 리포트의 meta_analysis.pipeline.persist에 저장 방식 / 왕복 수 / 서버 측 처리 시간(server_ms)을 기록
+-- (클라이언트가 재는 전체 저장 지연은 반환되는 metrics / 작업 결과에만 남음, 리포트를 두 번 쓰지 않도록)
+
+create or replace function public.save_case(
+    p_user_id text,
+    p_case_id text,
+    p_medicines jsonb,
+    p_report jsonb default null
+) returns integer
+language plpgsql
+as $$
+declare
+    saved integer;
+    started timestamptz := clock_timestamp();
+begin
+    delete from public.medicines where user_id = p_user_id and case_id = p_case_id;
+    delete from public.reports where user_id = p_user_id and case_id = p_case_id;
+
+    insert into public.medicines (user_id, case_id, name, days, start_date, color, time, efficacy, usage, info, food)
+    select user_id, case_id, name, days, start_date, color, time, efficacy, usage, info, food
+    from jsonb_populate_recordset(null::public.medicines, p_medicines);
+    get diagnostics saved = row_count;
+
+    if p_report is not null then
+        if jsonb_typeof(p_report->'meta_analysis'->'pipeline') = 'object' then
+            p_report := jsonb_set(p_report, '{meta_analysis,pipeline,persist}', jsonb_build_object(
+                'via', 'rpc',
+                'round_trips', 1,
+                'server_ms', round(extract(epoch from clock_timestamp() - started) * 1000)
+            ));
+        end if;
+        insert into public.reports (user_id, case_id, report_json)
+        select user_id, case_id, report_json
+        from jsonb_populate_record(null::public.reports, jsonb_build_object(
+            'user_id', p_user_id, 'case_id', p_case_id, 'report_json', p_report
+        ));
+    end if;
+
+    return saved;
+end;
+$$;
@@ -0,0 +1,429 @@
+# symspell_index.py
+"""
+SymSpell 보정 사전을 바이너리 파일(아티팩트)로 미리 빌드하고, mmap으로 바로 붙여 쓰는 모듈.
+
+drug_db.csv(약 8만 행)를 매번 파싱하면 프로세스마다 콜드 스타트에 수 초가 걸리므로,
+오프라인에서 deletes 인덱스 + jamo_to_original 맵을 한 번 빌드해 두고
+런타임에서는 파일을 메모리 매핑만 해서 사용합니다.
+
+빌드/측정:
+    python symspell_index.py              # drug_db.csv -> data/symspell_index.bin
+    python symspell_index.py --measure 4  # 프로세스 4개 기준 CSV vs mmap 호스트 메모리 비교
+
+아티팩트가 없으면 첫 Streamlit 프로세스가 락을 잡고 빌드하며(ensure_index),
+같은 호스트의 모든 프로세스가 한 파일을 읽기 전용 mmap으로 공유합니다.
+
+[파일 포맷] (little-endian)
+    header | words | word_table | delete_table | lists | strings
+    - words        : 단어 ID별 (자모 단어 offset/len, API 포맷 원본 offset/len, count)
+    - word_table   : 자모 단어 -> 단어 ID (open addressing 해시 테이블)
+    - delete_table : delete 문자열 -> lists 구간 (open addressing 해시 테이블)
+    - lists        : delete별 단어 ID 배열 (u32)
+    - strings      : UTF-8 문자열 풀
+"""
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+
+try:
+    import fcntl  # 빌드 락 (POSIX)
+except ImportError:
+    fcntl = None
+
+# 포맷이 바뀌면 반드시 올릴 것 (구버전 파일은 로더가 거부 -> CSV 폴백)
+FORMAT_VERSION = 1
+MAGIC = b"MLSYMSP\x00"
+
+DEFAULT_INDEX_PATH = os.path.join("data", "symspell_index.bin")
+
+# magic, version, max_edit_distance, prefix_length, max_length,
+# n_words, n_deletes, word_table_size, delete_table_size, source_sha256,
+# words_off, word_table_off, delete_table_off, lists_off, strings_off
+_HEADER = struct.Struct("<8sIIIIIIII32sQQQQQ")
+_WORD = struct.Struct("<IIIII")        # key_off, key_len, orig_off, orig_len, count
+_WORD_SLOT = struct.Struct("<QI")      # hash, word_id + 1 (0 = 빈 슬롯)
+_DELETE_SLOT = struct.Struct("<QIIII") # hash, key_off, key_len, list_off, list_len (0 = 빈 슬롯)
+
+
+def _hash(key_bytes):
+    return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little")
+
+
+def _table_size(n):
+    size = 8
+    while size < n * 2:
+        size <<= 1
+    return size
+
+
+def file_sha256(path):
+    """원본 CSV 지문 (아티팩트가 최신인지 확인용)"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+# =========================================================
+# 1. 빌드 (오프라인)
+# =========================================================
+def write_index(sym_spell, jamo_to_original, out_path, source_sha256=b"\x00" * 32):
+    """메모리에 빌드된 SymSpell + jamo_to_original을 아티팩트 파일로 저장"""
+    strings = bytearray()
+    string_offsets = {}
+
+    def intern(text):
+        if text not in string_offsets:
+            raw = text.encode("utf-8")
+            string_offsets[text] = (len(strings), len(raw))
+            strings.extend(raw)
+        return string_offsets[text]
+
+    # 단어 목록
+    words = list(sym_spell.words.items())
+    word_ids = {}
+    words_blob = bytearray()
+    word_table = bytearray(_WORD_SLOT.size * _table_size(len(words)))
+    word_mask = _table_size(len(words)) - 1
+    for word_id, (word, count) in enumerate(words):
+        word_ids[word] = word_id
+        key_off, key_len = intern(word)
+        orig_off, orig_len = intern(jamo_to_original.get(word, word))
+        words_blob.extend(_WORD.pack(key_off, key_len, orig_off, orig_len, count))
+
+        h = _hash(word.encode("utf-8"))
+        slot = h & word_mask
+        while _WORD_SLOT.unpack_from(word_table, slot * _WORD_SLOT.size)[1]:
+            slot = (slot + 1) & word_mask
+        _WORD_SLOT.pack_into(word_table, slot * _WORD_SLOT.size, h, word_id + 1)
+
+    # deletes 인덱스
+    deletes = sym_spell.deletes
+    lists = array("I")
+    delete_size = _table_size(len(deletes))
+    delete_mask = delete_size - 1
+    delete_table = bytearray(_DELETE_SLOT.size * delete_size)
+    n_deletes = 0
+    for key, suggestions in deletes.items():
+        if not suggestions: continue
+        n_deletes += 1
+        list_off = len(lists)
+        lists.extend(word_ids[s] for s in suggestions)
+        key_off, key_len = intern(key)
+
+        h = _hash(key.encode("utf-8"))
+        slot = h & delete_mask
+        while _DELETE_SLOT.unpack_from(delete_table, slot * _DELETE_SLOT.size)[4]:
+            slot = (slot + 1) & delete_mask
+        _DELETE_SLOT.pack_into(delete_table, slot * _DELETE_SLOT.size,
+                               h, key_off, key_len, list_off, len(suggestions))
+
+    if sys.byteorder != "little":
+        lists.byteswap()
+    lists_blob = lists.tobytes()
+
+    # 섹션 배치 (8바이트 정렬)
+    def align(n): return (n + 7) & ~7
+    words_off = align(_HEADER.size)
+    word_table_off = align(words_off + len(words_blob))
+    delete_table_off = align(word_table_off + len(word_table))
+    lists_off = align(delete_table_off + len(delete_table))
+    strings_off = align(lists_off + len(lists_blob))
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION,
+        sym_spell._max_dictionary_edit_distance, sym_spell._prefix_length, sym_spell._max_length,
+        len(words), n_deletes, _table_size(len(words)), delete_size, source_sha256,
+        words_off, word_table_off, delete_table_off, lists_off, strings_off,
+    )
+
+    # 원자적 교체 (읽는 중인 프로세스가 깨진 파일을 보지 않도록)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for off, blob in ((0, header), (words_off, words_blob), (word_table_off, word_table),
+                          (delete_table_off, delete_table), (lists_off, lists_blob),
+                          (strings_off, strings)):
+            f.write(b"\x00" * (off - f.tell()))
+            f.write(blob)
+    os.replace(tmp_path, out_path)
+
+
+# =========================================================
+# 2. 로드 (런타임, mmap)
+# =========================================================
+class SymSpellIndex:
+    """아티팩트 파일을 읽기 전용으로 mmap 하고 섹션별 뷰를 제공"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.max_edit_distance, self.prefix_length, self.max_length,
+         self.n_words, self.n_deletes, self._word_size, self._delete_size, self.source_sha256,
+         self._words_off, self._word_table_off, self._delete_table_off,
+         self._lists_off, self._strings_off) = _HEADER.unpack_from(self._mm, 0)
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"지원하지 않는 인덱스 포맷입니다: {magic!r} v{version}")
+
+        self._lists = memoryview(self._mm)[self._lists_off:self._strings_off].cast("I")
+
+    def close(self):
+        self._lists.release()
+        self._mm.close()
+
+    def _string(self, off, length):
+        start = self._strings_off + off
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _word(self, word_id):
+        return _WORD.unpack_from(self._mm, self._words_off + word_id * _WORD.size)
+
+    def find_word(self, word):
+        """자모 단어 -> 단어 ID (없으면 -1)"""
+        raw = word.encode("utf-8")
+        h = _hash(raw)
+        mask = self._word_size - 1
+        slot = h & mask
+        while True:
+            slot_hash, ref = _WORD_SLOT.unpack_from(self._mm, self._word_table_off + slot * _WORD_SLOT.size)
+            if not ref:
+                return -1
+            if slot_hash == h:
+                key_off, key_len = self._word(ref - 1)[:2]
+                start = self._strings_off + key_off
+                if self._mm[start:start + key_len] == raw:
+                    return ref - 1
+            slot = (slot + 1) & mask
+
+    def find_delete(self, key):
+        """delete 문자열 -> 후보 단어 리스트 (없으면 None)"""
+        raw = key.encode("utf-8")
+        h = _hash(raw)
+        mask = self._delete_size - 1
+        slot = h & mask
+        while True:
+            slot_hash, key_off, key_len, list_off, list_len = _DELETE_SLOT.unpack_from(
+                self._mm, self._delete_table_off + slot * _DELETE_SLOT.size)
+            if not list_len:
+                return None
+            if slot_hash == h:
+                start = self._strings_off + key_off
+                if self._mm[start:start + key_len] == raw:
+                    return [self.word_at(i) for i in self._lists[list_off:list_off + list_len]]
+            slot = (slot + 1) & mask
+
+    def word_at(self, word_id):
+        key_off, key_len = self._word(word_id)[:2]
+        return self._string(key_off, key_len)
+
+    def count_at(self, word_id):
+        return self._word(word_id)[4]
+
+    def original_at(self, word_id):
+        _, _, orig_off, orig_len, _ = self._word(word_id)
+        return self._string(orig_off, orig_len)
+
+
+class _MappedWords(Mapping):
+    """SymSpell._words 대체: {자모 단어: count}"""
+    def __init__(self, index): self._index = index
+    def __len__(self): return self._index.n_words
+    def __iter__(self): return (self._index.word_at(i) for i in range(self._index.n_words))
+    def __contains__(self, word): return self._index.find_word(word) >= 0
+
+    def __getitem__(self, word):
+        word_id = self._index.find_word(word)
+        if word_id < 0: raise KeyError(word)
+        return self._index.count_at(word_id)
+
+
+class _MappedDeletes(Mapping):
+    """SymSpell._deletes 대체: {delete: [자모 단어, ...]}"""
+    def __init__(self, index): self._index = index
+    def __len__(self): return self._index.n_deletes
+    def __contains__(self, key): return self._index.find_delete(key) is not None
+
+    def __iter__(self):
+        index = self._index
+        for slot in range(index._delete_size):
+            _, key_off, key_len, _, list_len = _DELETE_SLOT.unpack_from(
+                index._mm, index._delete_table_off + slot * _DELETE_SLOT.size)
+            if list_len: yield index._string(key_off, key_len)
+
+    def __getitem__(self, key):
+        suggestions = self._index.find_delete(key)
+        if suggestions is None: raise KeyError(key)
+        return suggestions
+
+
+class _MappedOriginals(Mapping):
+    """jamo_to_original 대체: {자모 단어: API 포맷 원본명}"""
+    def __init__(self, index): self._index = index
+    def __len__(self): return self._index.n_words
+    def __iter__(self): return iter(_MappedWords(self._index))
+
+    def __getitem__(self, word):
+        word_id = self._index.find_word(word)
+        if word_id < 0: raise KeyError(word)
+        return self._index.original_at(word_id)
+
+
+def load_index(path, source_path=None):
+    """
+    아티팩트를 mmap으로 열어 (sym_spell, jamo_to_original)을 반환합니다.
+    source_path가 주어지면 원본 CSV 지문을 비교해 오래된 아티팩트는 거부(ValueError)합니다.
+    """
+    from symspellpy import SymSpell
+
+    index = SymSpellIndex(path)
+    if source_path and os.path.exists(source_path):
+        if index.source_sha256 != file_sha256(source_path):
+            index.close()
+            raise ValueError("인덱스가 drug_db.csv보다 오래되었습니다. 다시 빌드하세요.")
+
+    sym_spell = SymSpell(max_dictionary_edit_distance=index.max_edit_distance,
+                         prefix_length=index.prefix_length)
+    # symspellpy의 load_pickle과 같은 방식으로 내부 사전을 교체 (lookup은 조회만 수행)
+    sym_spell._words = _MappedWords(index)
+    sym_spell._deletes = _MappedDeletes(index)
+    sym_spell._max_length = index.max_length
+    return sym_spell, _MappedOriginals(index)
+
+
+def ensure_index(path, source_path, build_fn):
+    """
+    호스트 공용 아티팩트를 보장하고 mmap으로 붙입니다.
+    - 아티팩트가 없거나 오래됐으면 파일 락을 잡은 한 프로세스만 CSV로 빌드하고,
+      나머지 Streamlit 프로세스는 락 해제 후 같은 파일을 붙여 씁니다.
+    - 읽기 전용 mmap 페이지는 OS 페이지 캐시를 공유하므로 프로세스 수와 무관하게 사전은 호스트에 한 벌만 상주합니다.
+    - 빌드/쓰기에 실패하면 build_fn 결과(프로세스 전용 메모리 사전)를 그대로 반환합니다.
+    """
+    try:
+        return load_index(path, source_path)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    try:
+        lock_file = open(path + ".lock", "a")
+    except OSError:
+        return build_fn(source_path)
+
+    with lock_file:
+        if fcntl: fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # 락 대기 중 다른 프로세스가 이미 빌드했을 수 있음
+            try:
+                return load_index(path, source_path)
+            except (OSError, ValueError, struct.error):
+                pass
+
+            sym_spell, jamo_to_original = build_fn(source_path)
+            if sym_spell is None:
+                return None, None
+            try:
+                write_index(sym_spell, jamo_to_original, path, file_sha256(source_path))
+                return load_index(path, source_path)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"[WARN] SymSpell 인덱스 저장 실패, 프로세스 메모리 사전을 사용합니다: {e}")
+                return sym_spell, jamo_to_original
+        finally:
+            if fcntl: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# =========================================================
+# 3. 메모리 측정 (호스트 기준)
+# =========================================================
+def _memory_kb():
+    """현재 프로세스의 (RSS, PSS) KB. PSS는 공유 페이지를 공유 프로세스 수로 나눈 값 (Linux 전용)"""
+    usage = {}
+    for proc_file in ("/proc/self/smaps_rollup", "/proc/self/status"):
+        try:
+            with open(proc_file) as f:
+                for line in f:
+                    name, _, rest = line.partition(":")
+                    if name in ("Rss", "VmRSS", "Pss"):
+                        usage.setdefault("Pss" if name == "Pss" else "Rss", int(rest.split()[0]))
+        except OSError:
+            continue
+    return usage.get("Rss", 0), usage.get("Pss", 0)
+
+
+def _measure_worker(mode, db_path, index_path, ready, done):
+    import ocr_correction
+    from symspellpy import Verbosity
+
+    if mode == "csv":
+        sym_spell, _ = ocr_correction.build_symspell_from_csv(db_path)
+    else:
+        sym_spell, _ = load_index(index_path, db_path)
+    # 실제 보정처럼 조회를 돌려 필요한 페이지를 올림
+    for word in list(sym_spell.words)[:2000:7]:
+        sym_spell.lookup(word, Verbosity.CLOSEST, max_edit_distance=2)
+
+    ready.put(_memory_kb())
+    done.wait()
+
+
+def measure_memory(db_path, index_path, procs=4):
+    """
+    Streamlit 프로세스 여러 개가 각자 사전을 올린 상황을 흉내내
+    CSV(프로세스별 사본) vs mmap(공유 아티팩트)의 호스트 메모리를 비교합니다.
+    합계 PSS가 실제 호스트 상주 메모리에 가장 가까운 값입니다.
+    """
+    import multiprocessing as mp
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    for mode in ("csv", "mmap"):
+        ready, done = ctx.Queue(), ctx.Event()
+        workers = [ctx.Process(target=_measure_worker, args=(mode, db_path, index_path, ready, done))
+                   for _ in range(procs)]
+        for w in workers: w.start()
+        # 모든 프로세스가 사전을 올린 채 대기하는 시점에 측정
+        samples = [ready.get() for _ in workers]
+        done.set()
+        for w in workers: w.join()
+        results[mode] = {
+            "procs": procs,
+            "rss_mb_total": round(sum(r for r, _ in samples) / 1024, 1),
+            "pss_mb_total": round(sum(p for _, p in samples) / 1024, 1),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import ocr_correction
+
+    parser = argparse.ArgumentParser(description="SymSpell 보정 사전 아티팩트 빌드/측정")
+    parser.add_argument("db_path", nargs="?", default="drug_db.csv")
+    parser.add_argument("out_path", nargs="?", default=DEFAULT_INDEX_PATH)
+    parser.add_argument("--measure", type=int, metavar="PROCS", help="N개 프로세스 기준 호스트 메모리 비교")
+    args = parser.parse_args()
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    db_path = os.path.join(current_dir, args.db_path)
+    out_path = os.path.join(current_dir, args.out_path)
+
+    if args.measure:
+        for mode, r in measure_memory(db_path, out_path, args.measure).items():
+            print(f"[MEASURE] {mode:<4} x{r['procs']}: RSS {r['rss_mb_total']} MB, PSS {r['pss_mb_total']} MB")
+        sys.exit(0)
+
+    t0 = time.time()
+    sym_spell, jamo_to_original = ocr_correction.build_symspell_from_csv(db_path)
+    if sym_spell is None:
+        sys.exit(f"[ERROR] CSV 로딩 실패: {db_path}")
+    t1 = time.time()
+    write_index(sym_spell, jamo_to_original, out_path, file_sha256(db_path))
+    t2 = time.time()
+    print(f"[BUILD] {sym_spell.word_count} words, {sym_spell.entry_count} deletes -> {out_path}")
+    print(f"[BUILD] csv {t1 - t0:.1f}s, write {t2 - t1:.1f}s, {os.path.getsize(out_path) / 1e6:.1f} MB")
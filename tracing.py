@@ -0,0 +1,100 @@
+# tracing.py
+"""
+업로드 파이프라인 단계별 지연 시간 추적 (경량 span tracer)
+- 기록은 pipeline_metrics["trace"]에 JSON 그대로 저장 가능한 dict로 남음
+  {"started_at": epoch 초, "spans": [{"id", "parent", "name", "start_ms", "duration_ms", ...속성}]}
+- start_ms는 트레이스 시작 기준 상대 시간(ms), parent는 상위 span id (최상위는 None)
+- 아직 끝나지 않은 span은 duration_ms가 None (도중에 복사/직렬화된 트레이스에서는 집계/표시 대상 아님)
+- 같은 스레드 안에서는 with 블록 중첩으로 부모가 자동 결정되고,
+  작업 스레드에서는 current_span()으로 얻은 id를 parent로 넘겨 연결
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def start_trace(metrics):
+    """metrics에 새 트레이스를 만들고 반환 (버튼 클릭 시점에 호출)"""
+    trace = {"started_at": time.time(), "spans": []}
+    if metrics is not None:
+        metrics["trace"] = trace
+    return trace
+
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _trace_of(metrics):
+    return metrics.get("trace") if isinstance(metrics, dict) else None
+
+
+def current_span(metrics):
+    """현재 스레드에서 열려 있는 가장 안쪽 span id (없으면 None)"""
+    trace = _trace_of(metrics)
+    if trace is None: return None
+    for trace_id, span_id in reversed(_stack()):
+        if trace_id == id(trace): return span_id
+    return None
+
+
+def add_span(metrics, name, started_at, duration_ms, parent=None, **attrs):
+    """구간을 기록 (started_at: time.time() 기준 시작 시각, duration_ms=None이면 진행 중). span dict 반환"""
+    trace = _trace_of(metrics)
+    if trace is None: return {}
+    if parent is None:
+        parent = current_span(metrics)
+    with _lock:
+        entry = {
+            "id": len(trace["spans"]),
+            "parent": parent,
+            "name": name,
+            "start_ms": int((started_at - trace["started_at"]) * 1000),
+            "duration_ms": None if duration_ms is None else int(duration_ms),
+            **attrs,
+        }
+        trace["spans"].append(entry)
+    return entry
+
+
+@contextmanager
+def span(metrics, name, parent=None, **attrs):
+    """
+    with 블록 구간을 span으로 기록. 블록 안에서 yield된 dict에 속성을 추가할 수 있음
+    - 트레이스가 없으면(metrics None / start_trace 전) 아무것도 기록하지 않음
+    - 예외가 나면 error 속성을 남기고 그대로 다시 올림
+    """
+    trace = _trace_of(metrics)
+    if trace is None:
+        yield {}
+        return
+
+    # 자식 span이 parent로 참조할 수 있도록 시작할 때 열린 상태(duration_ms=None)로 추가
+    entry = add_span(metrics, name, time.time(), None, parent=parent, **attrs)
+    stack = _stack()
+    stack.append((id(trace), entry["id"]))
+    started = time.perf_counter()
+    try:
+        yield entry
+    except BaseException as e:
+        entry["error"] = type(e).__name__
+        raise
+    finally:
+        entry["duration_ms"] = int((time.perf_counter() - started) * 1000)
+        stack.pop()
+
+
+def stage_durations(trace, top_level_only=False):
+    """트레이스 -> {span 이름: [duration_ms, ...]} (같은 이름이 여러 번이면 모두 포함, 열린 span 제외)"""
+    durations = {}
+    for s in (trace or {}).get("spans", []):
+        if top_level_only and s.get("parent") is not None: continue
+        if s.get("duration_ms") is None: continue
+        durations.setdefault(s["name"], []).append(s["duration_ms"])
+    return durations